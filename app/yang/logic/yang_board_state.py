@@ -1,16 +1,47 @@
 from typing import Optional
 from app.yang.img_utils import image_overlay
+from app.yang.yang_constants import SYMBOLIC_TRANSITION, SYMBOLIC_TRANSITION_VERIFY
 from app.yang.yang_hstate import YangHiddenState
+from app.yang.logic.yang_recognition_cache import RECOGNITION_CACHE, YangRecognitionCache
+from app.yang.logic.yang_transition import apply_action, same_cards
 
 
 class YangBoardState(object):
-    def __init__(self, board_img, last_hstate: Optional[YangHiddenState], simulator):
+    __slots__ = (
+        "board_img", "_last_hstate", "_cached_hstate", "_cached_pool_cards", "_cached_queue_cards",
+        "simulator", "cache", "_root_hash",
+    )
+
+    def __init__(self, board_img, last_hstate: Optional[YangHiddenState], simulator, cache: Optional[YangRecognitionCache] = None):
         self.board_img = board_img
         self._last_hstate = last_hstate
         self._cached_hstate = None
         self._cached_pool_cards = None
         self._cached_queue_cards = None
         self.simulator = simulator
+        self.cache = cache if cache is not None else RECOGNITION_CACHE
+        self._root_hash = None
+
+    def get_root_hash(self):
+        """根局面图像的内容哈希，作为识别缓存 key 的一部分"""
+        if self._root_hash is None:
+            self._root_hash = YangRecognitionCache.image_hash(self.board_img)
+        return self._root_hash
+
+    def __getstate__(self):
+        # 发送到子进程(例如 ParallelMCTS)时不携带检测模型和缓存，子进程只能使用符号化推算
+        state = {
+            name: getattr(self, name)
+            for cls in type(self).__mro__ for name in getattr(cls, "__slots__", ()) if hasattr(self, name)
+        }
+        state["simulator"] = None
+        state["cache"] = None
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self.cache = RECOGNITION_CACHE
 
     def get_crt_img(self):
         return self.board_img
@@ -20,8 +51,17 @@ class YangBoardState(object):
             self._simulate()
         return self._cached_hstate
 
+    def get_cards(self):
+        """返回 (pool_cards, queue_cards)，queue_cards 不包含 pending action"""
+        if self._cached_pool_cards is None:
+            self._simulate()
+        return self._cached_pool_cards, self._cached_queue_cards
+
     def _simulate(self):
         pool_cards, queue_cards = self.simulator.recognize(self.board_img)
+        self._update_from_cards(pool_cards, queue_cards, pending_actions=[])
+
+    def _update_from_cards(self, pool_cards, queue_cards, pending_actions):
         # update hstate
         if self._last_hstate is not None:
             old_score = self._last_hstate.score
@@ -30,7 +70,7 @@ class YangBoardState(object):
             old_score = 0
             each_uncovered_cards = None
         hstate = YangHiddenState.from_new_cards(
-            pool_cards, queue_cards, pending_actions=[], 
+            pool_cards, list(queue_cards), pending_actions=pending_actions, 
             old_score=0, each_uncovered_cards=each_uncovered_cards
         )
 
@@ -42,6 +82,10 @@ class YangBoardState(object):
         self._cached_queue_cards = queue_cards
         self._cached_hstate = hstate
 
+    def set_recognized_cards(self, pool_cards, queue_cards):
+        """写入外部得到的识别结果 (例如局部重新识别)，之后不再调用 simulator"""
+        self._update_from_cards(pool_cards, queue_cards, pending_actions=[])
+
     def find_available_actions(self):
         if self._cached_pool_cards is None:
             print("Warning! Call find_available_actions before _simulate")
@@ -61,12 +105,18 @@ class YangBoardState(object):
 
 
 class YangSimulatedState(YangBoardState):
-    def __init__(self, board_img, last_hstate, simulator, *, pending_action_list):
-        super().__init__(board_img, last_hstate, simulator)
+    __slots__ = ("pending_action_list", "parent_cards", "_overlay_img", "_cache_checked")
+
+    def __init__(self, board_img, last_hstate, simulator, *, pending_action_list, parent_cards=None, cache=None, root_hash=None):
+        super().__init__(board_img, last_hstate, simulator, cache=cache)
+        self._root_hash = root_hash  # 由根节点传入，避免对叠加图像重复计算
         # self.board_img = board_img
         self.pending_action_list = pending_action_list
+        # 父节点的 (pool_cards, queue_cards)，用于符号化推算
+        self.parent_cards = parent_cards
         # maybe root images and following actions?
         self._overlay_img = None
+        self._cache_checked = False  # 每个局面只查询一次缓存，保证命中率统计准确
     
     def get_crt_img(self):
         # crt img is overlayed by the pending action
@@ -76,28 +126,70 @@ class YangSimulatedState(YangBoardState):
 
     def _simulate(self):
         # override
-        new_img = self.get_crt_img()
-        pool_cards, queue_cards = self.simulator.recognize(new_img)
-        # queue_cards.append(self.pending_action) # add the pending action
-        # print(f"!!!node has {len(queue_cards)} cards in queue, {len(self.pending_action_list)} pending actions: {self.pending_action_list}")
-        # queue_cards.extend(self.pending_action_list)
-
-        # update hstate
-        if self._last_hstate is not None:
-            old_score = self._last_hstate.score
-            each_uncovered_cards = self._last_hstate.get_each_uncovered_cards()
+        if self._load_from_cache():
+            return
+        if not self._needs_image():
+            pool_cards, queue_cards = self._symbolic_transition()
+            if SYMBOLIC_TRANSITION_VERIFY:
+                self._verify_with_image(pool_cards, queue_cards)
+            self._set_cards(pool_cards, queue_cards)
         else:
-            old_score = 0
-            each_uncovered_cards = None
-        hstate = YangHiddenState.from_new_cards(
-            pool_cards, queue_cards, pending_actions=self.pending_action_list, 
-            old_score=0, each_uncovered_cards=each_uncovered_cards
-        )
+            new_img = self.get_crt_img()
+            self.set_recognized_cards(*self.simulator.recognize(new_img))
 
-        # 特判是否 game over
-        if hstate.remaining_slot_num <= 0:
-            pool_cards = []  # 设置此会导致 available action 为空
+    def _needs_image(self):
+        if not SYMBOLIC_TRANSITION or self.parent_cards is None:
+            return True
+        # 点击可能释放尚未观察过的下层卡牌时，先在叠加图像上识别一次 (子进程中没有检测模型，只能符号推算)
+        return (self.simulator is not None and self._root_hash is not None
+                and self.cache.occlusion(self._root_hash).needs_probe(self.pending_action_list))
 
-        self._cached_pool_cards = pool_cards
-        self._cached_queue_cards = queue_cards
-        self._cached_hstate = hstate
+    def needs_image_recognition(self):
+        """当前局面是否还需要在叠加图像上运行检测模型 (命中缓存时会直接载入结果)"""
+        if self._cached_hstate is not None or self._load_from_cache():
+            return False
+        return self._needs_image()
+
+    def set_recognized_cards(self, pool_cards, queue_cards):
+        """写入外部(例如批量识别)得到的图像识别结果，并记录其中的遮挡关系"""
+        if self.parent_cards is not None and self._root_hash is not None:
+            self.cache.occlusion(self._root_hash).observe(self.parent_cards[0], self.pending_action_list, pool_cards)
+        self._set_cards(pool_cards, queue_cards)
+
+    def _set_cards(self, pool_cards, queue_cards):
+        self._update_from_cards(pool_cards, queue_cards, pending_actions=self.pending_action_list)
+        if self._root_hash is not None:
+            key = YangRecognitionCache.make_key(self._root_hash, self.pending_action_list)
+            # 只缓存识别结果，hstate 与点击顺序有关，载入时重新计算
+            self.cache.put(key, (pool_cards, queue_cards))
+
+    def _load_from_cache(self):
+        """尝试从识别缓存载入当前局面，成功返回 True (每个局面只真正查询一次)"""
+        if self._root_hash is None or self._cache_checked:
+            return False
+        self._cache_checked = True
+        entry = self.cache.get(YangRecognitionCache.make_key(self._root_hash, self.pending_action_list))
+        if entry is None:
+            return False
+        pool_cards, queue_cards = entry
+        self._update_from_cards(pool_cards, queue_cards, pending_actions=self.pending_action_list)
+        return True
+
+    def _symbolic_transition(self):
+        """由父节点的识别结果和最后一个 pending action 推算当前局面"""
+        parent_pool_cards, parent_queue_cards = self.parent_cards
+        if self._root_hash is None:
+            pool_cards = apply_action(parent_pool_cards, self.pending_action_list[-1])
+        else:
+            pool_cards = self.cache.occlusion(self._root_hash).apply(parent_pool_cards, self.pending_action_list)
+        return pool_cards, list(parent_queue_cards)
+
+    def _verify_with_image(self, pool_cards, queue_cards):
+        """校验模式: 与叠加图像后的识别结果进行比对"""
+        img_pool_cards, img_queue_cards = self.simulator.recognize(self.get_crt_img())
+        if not same_cards(pool_cards, img_pool_cards) or not same_cards(queue_cards, img_queue_cards):
+            print(
+                f"[警告] 符号推算与图像识别不一致: pending={self.pending_action_list}\n"
+                f"  symbolic pool={len(pool_cards)} queue={len(queue_cards)}\n"
+                f"  image    pool={len(img_pool_cards)} queue={len(img_queue_cards)}"
+            )
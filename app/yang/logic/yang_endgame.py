@@ -0,0 +1,166 @@
+"""
+残局的精确求值
+
+当剩余卡牌很少时，对 hidden state 做带记忆化的精确期望，代替随机 rollout:
+    - 移动: 与 step 相同，在优先级最高的种类中等概率选择
+    - 翻牌: 按 step 中的概率模型 (翻牌张数、按未翻牌数加权的种类)
+即 rollout 策略下分数的精确期望 (无方差的无穷多次 rollout 的均值)，与兄弟节点的 rollout 均值口径相同，
+可以混在同一个 rewards / best_q 中。不取最优移动: 最优策略下的期望值系统性地高于 rollout 均值，
+会使剩余卡牌刚好低于 ENDGAME_EXACT_MAX_CARDS 的节点显得更好。
+"""
+from typing import Optional
+
+from app.yang.yang_constants import ENDGAME_EXACT_MAX_CARDS, ENDGAME_MEMO_SIZE
+from app.yang.yang_hstate import YangHiddenState
+
+from test_rollout import PRIORITY_TABLE
+
+TOTAL, QUEUE, UNCOVERED = 0, 1, 2
+
+
+def _priority(total_num, queue_num, empty_slot_num):
+    t = total_num if 0 <= total_num < 3 else (3 if total_num > 0 else 0)
+    q = queue_num if 0 <= queue_num < 3 else 3
+    e = empty_slot_num if 0 <= empty_slot_num < 3 else (3 if empty_slot_num > 0 else 0)
+    return PRIORITY_TABLE[t * 16 + q * 4 + e]
+
+
+def _pick_count_distribution(available_choice):
+    """step 中翻牌张数的分布 [(张数, 概率)]"""
+    if available_choice == 0:
+        return [(1, 1.0)]
+    if available_choice < 8:
+        return [(0, 1 / 3), (1, 1 / 3), (2, 1 / 3)]
+    return [(0, 0.5), (1, 0.5)]
+
+
+class YangEndgameEvaluator:
+    """
+    带记忆化的 rollout 策略期望求值器
+
+    状态为 (每种卡牌的 [total, queue, uncovered], pool_available_choice, queue_empty_slot)，
+    分数只会累加，因此记忆化的值是从该状态出发还能获得的期望分数，与当前分数无关。
+    """
+    def __init__(self, max_cards=ENDGAME_EXACT_MAX_CARDS, memo_size=ENDGAME_MEMO_SIZE):
+        self.max_cards = max_cards
+        self.memo_size = memo_size
+        self._memo = {}
+        self.evaluations = 0  # 精确求值的次数
+
+    @staticmethod
+    def state_size(hstate: YangHiddenState) -> int:
+        """尚未消除的卡牌数 (场上 + 队列 + 未翻开)"""
+        pool = hstate.pool_array
+        return int(pool[:, TOTAL].clip(min=0).sum() + pool[:, UNCOVERED].clip(min=0).sum())
+
+    def can_evaluate(self, hstate: YangHiddenState) -> bool:
+        return self.state_size(hstate) <= self.max_cards
+
+    def value(self, hstate: YangHiddenState) -> float:
+        """当前分数 + rollout 策略 (test_rollout.step) 下的期望剩余分数"""
+        self.evaluations += 1
+        if len(self._memo) > self.memo_size:
+            self._memo.clear()
+        rows = tuple(tuple(row) for row in hstate.pool_array.tolist())
+        return hstate.score + self._value(rows, hstate.available_choice_num, hstate.remaining_slot_num)
+
+    def __call__(self, node) -> Optional[float]:
+        """MCTS 的 exact_evaluator 钩子: 状态足够小时返回精确值，否则返回 None 交给 rollout"""
+        hstate = node.state.get_hstate()
+        if not self.can_evaluate(hstate):
+            return None
+        return self.value(hstate)
+
+    def _value(self, rows, available_choice, empty_slot_num) -> float:
+        key = (rows, available_choice, empty_slot_num)
+        cached = self._memo.get(key)
+        if cached is not None:
+            return cached
+
+        # 尝试应用规则: 队列中已有 3 张同类牌则直接消除
+        gain = 0
+        if any(row[QUEUE] >= 3 for row in rows):
+            new_rows = []
+            for total_num, queue_num, uncovered_num in rows:
+                if queue_num >= 3:
+                    total_num, queue_num, uncovered_num = total_num - 3, queue_num - 3, max(uncovered_num - 3, 0)
+                    empty_slot_num += 3
+                    gain += 1
+                new_rows.append((total_num, queue_num, uncovered_num))
+            rows = tuple(new_rows)
+
+        expected = 0.0
+        if empty_slot_num != 0:
+            # 与 step 相同: 在优先级最高的种类中等概率选择，最高优先级为 0 时结束
+            priorities = [_priority(total_num, queue_num, empty_slot_num) for total_num, queue_num, _ in rows]
+            max_priority = max(priorities)
+            if max_priority > 0:
+                moves = [k for k, priority in enumerate(priorities) if priority == max_priority]
+                expected = sum(self._move_value(rows, k, available_choice, empty_slot_num) for k in moves) / len(moves)
+        result = gain + expected
+        self._memo[key] = result
+        return result
+
+    def _move_value(self, rows, k, available_choice, empty_slot_num) -> float:
+        """将种类 k 移入队列后的期望分数"""
+        total_num, queue_num, uncovered_num = rows[k]
+        queue_num += 1
+        empty_slot_num -= 1
+        available_choice -= 1
+        gain = 0
+        if queue_num == 3:
+            total_num, queue_num, uncovered_num = total_num - 3, 0, max(uncovered_num - 3, 0)
+            empty_slot_num += 3
+            gain = 1
+        rows = rows[:k] + ((total_num, queue_num, uncovered_num),) + rows[k + 1:]
+        expected = 0.0
+        for pick_cnt, prob in _pick_count_distribution(available_choice):
+            expected += prob * self._reveal_value(rows, available_choice, empty_slot_num, pick_cnt)
+        return gain + expected
+
+    def _reveal_value(self, rows, available_choice, empty_slot_num, pick_cnt) -> float:
+        """翻开 pick_cnt 张牌，种类按未翻牌数加权"""
+        if pick_cnt == 0:
+            return self._value(rows, available_choice, empty_slot_num)
+        total_weight = sum(max(row[UNCOVERED], 0) for row in rows)
+        if total_weight == 0:
+            return self._value(rows, available_choice, empty_slot_num)
+        expected = 0.0
+        for k, (total_num, queue_num, uncovered_num) in enumerate(rows):
+            if uncovered_num <= 0:
+                continue
+            picked = rows[:k] + ((total_num + 1, queue_num, uncovered_num - 1),) + rows[k + 1:]
+            expected += uncovered_num / total_weight * self._reveal_value(
+                picked, available_choice + 1, empty_slot_num, pick_cnt - 1
+            )
+        return expected
+
+    def clear(self):
+        self._memo.clear()
+
+
+if __name__ == "__main__":
+    import contextlib
+    import io
+    import random
+    import time
+    from test_rollout import rollout_fast
+
+    # 与随机 rollout 对比: 精确值应与 rollout 的均值一致 (误差在 rollout 的标准误差以内)
+    hstate = YangHiddenState({
+        "pool": {k: ([2, 0, 1] if k < 2 else [1, 1, 2] if k == 2 else [0, 0, 0]) for k in range(16)},
+        "pool_available_choice": 5,
+        "queue_empty_slot": 6,
+        "score": 0,
+    })
+    evaluator = YangEndgameEvaluator()
+    tic = time.time()
+    exact = evaluator.value(hstate)
+    print(f"state size: {evaluator.state_size(hstate)} exact: {exact:.4f} "
+          f"memo: {len(evaluator._memo)} time: {time.time() - tic:.3f}s")
+    random.seed(0)
+    with contextlib.redirect_stdout(io.StringIO()):  # 忽略 rollout 中的修正信息
+        scores = [rollout_fast(hstate.to_dict()) for _ in range(2000)]
+    mean = sum(scores) / len(scores)
+    se = (sum((x - mean) ** 2 for x in scores) / (len(scores) - 1) / len(scores)) ** 0.5
+    print(f"rollout mean: {mean:.4f} se: {se:.4f}")
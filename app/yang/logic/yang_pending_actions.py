@@ -0,0 +1,52 @@
+class PendingActionList:
+    """
+    不可变的 pending action 列表 (持久化单链表)
+
+    每个节点只保存最后一个动作和指向父节点列表的引用，子节点与父节点共享前缀，
+    创建子节点时不需要复制整条动作序列。
+    迭代顺序与原来的 list 相同，即从第一个动作到最后一个动作。
+    """
+    __slots__ = ("last", "prev", "_len")
+
+    def __init__(self, last=None, prev=None):
+        self.last = last
+        self.prev = prev
+        self._len = 0 if prev is None else prev._len + 1  # 空列表 PendingActionList() 作为链表的末端
+
+    def push(self, action) -> "PendingActionList":
+        """返回末尾追加 action 后的新列表，自身不变"""
+        return PendingActionList(action, self)
+
+    def __len__(self):
+        return self._len
+
+    def __bool__(self):
+        return self._len > 0
+
+    def __iter__(self):
+        return iter(self.to_tuple())
+
+    def to_tuple(self) -> tuple:
+        actions = []
+        node = self
+        while node._len > 0:
+            actions.append(node.last)
+            node = node.prev
+        return tuple(reversed(actions))
+
+    def __getitem__(self, index):
+        if index == -1 and self._len > 0:
+            return self.last
+        return self.to_tuple()[index]
+
+    def __eq__(self, other):
+        if isinstance(other, PendingActionList):
+            return self.to_tuple() == other.to_tuple()
+        if isinstance(other, (list, tuple)):
+            return self.to_tuple() == tuple(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self.to_tuple()))
@@ -0,0 +1,81 @@
+import hashlib
+from collections import OrderedDict
+
+from app.yang.yang_constants import RECOGNITION_CACHE_SIZE
+from app.yang.logic.yang_transition import YangOcclusionModel
+
+
+class YangRecognitionCache:
+    """
+    识别结果缓存 (LRU)
+
+    key 为 (根图像内容哈希, pending action 集合)，与动作顺序无关，
+    因此不同搜索路径到达的同一局面可以复用识别结果。
+    value 为 (pool_cards, queue_cards)。hidden state 依赖到达该局面的点击顺序，不放入缓存，
+    由各节点用自己的 last_hstate 重新计算。
+    另外按根局面保存从识别结果中得到的遮挡关系 (YangOcclusionModel)。
+    """
+    def __init__(self, max_size=RECOGNITION_CACHE_SIZE, max_roots=8):
+        self.max_size = max_size
+        self.max_roots = max_roots
+        self._entries = OrderedDict()
+        self._occlusions = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def image_hash(img) -> str:
+        """根据图像内容计算哈希"""
+        digest = hashlib.md5(img.tobytes())
+        digest.update(f"{img.mode}{img.size}".encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def make_key(root_hash, pending_actions):
+        return root_hash, frozenset(pending_actions)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def occlusion(self, root_hash) -> YangOcclusionModel:
+        """根局面对应的遮挡关系，只保留最近的 max_roots 个根局面"""
+        model = self._occlusions.get(root_hash)
+        if model is None:
+            model = self._occlusions[root_hash] = YangOcclusionModel()
+            while len(self._occlusions) > self.max_roots:
+                self._occlusions.popitem(last=False)
+        self._occlusions.move_to_end(root_hash)
+        return model
+
+    def clear(self):
+        self._entries.clear()
+        self._occlusions.clear()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def stats(self):
+        return f"size={len(self._entries)}/{self.max_size} hits={self.hits} misses={self.misses} hit_rate={self.hit_rate:.2%}"
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# 默认的全局缓存，所有 YangBoardState 共享
+RECOGNITION_CACHE = YangRecognitionCache()
@@ -0,0 +1,211 @@
+"""
+向量化的 rollout 引擎
+
+将 hidden state 表示为 (batch, 16, 3) 的整数数组，
+每一行是一局独立的 rollout，按 test_rollout.step 的规则同步推进直到全部结束。
+数组最后一维的含义与 YangHiddenState.pool_array 一致: [total_num, total_queue_num, uncover_num]
+"""
+import hashlib
+import random
+import numpy as np
+
+from app.yang.yang_constants import CARD_KINDS
+from app.yang.yang_hstate import YangHiddenState
+
+from test_rollout import PRIORITY_TABLE, rollout_fast
+
+TOTAL, QUEUE, UNCOVERED = 0, 1, 2
+
+_default_rng = np.random.default_rng()
+_crn_base_seed = 0  # 公共随机数流的基础种子，由 seed_rollout_rng 设置 (根并行的各进程互不相同)
+
+# test_rollout.PRIORITY_TABLE 的数组形式，下标为 [total, queue, empty] (截断方式见 priority_scores)
+PRIORITY_TABLE_ARRAY = np.array(PRIORITY_TABLE, dtype=np.int64).reshape(4, 4, 4)
+
+
+def seed_rollout_rng(seed):
+    """设置 random 模块及向量化 rollout 默认随机数发生器的种子"""
+    global _default_rng, _crn_base_seed
+    random.seed(seed)
+    _default_rng = np.random.default_rng(seed)
+    _crn_base_seed = seed
+
+
+def hstate_to_arrays(hstate, batch_size: int):
+    """将 YangHiddenState (或 dict 形式的 hstate) 复制为 batch_size 份数组"""
+    if isinstance(hstate, YangHiddenState):
+        pool = hstate.pool_array
+        available_choice, empty_slot, score = hstate.available_choice_num, hstate.remaining_slot_num, hstate.score
+    else:
+        pool = np.array([hstate["pool"][k] for k in range(CARD_KINDS)], dtype=np.int64)
+        available_choice, empty_slot, score = hstate["pool_available_choice"], hstate["queue_empty_slot"], hstate["score"]
+    pool = np.repeat(pool[None], batch_size, axis=0)
+    available_choice = np.full(batch_size, available_choice, dtype=np.int64)
+    empty_slot = np.full(batch_size, empty_slot, dtype=np.int64)
+    score = np.full(batch_size, score, dtype=np.float64)
+    return pool, available_choice, empty_slot, score
+
+
+def priority_scores(pool: np.ndarray, empty_slot: np.ndarray) -> np.ndarray:
+    """按 step 中的规则查表得到每种卡牌的移动优先级，返回 (batch, 16)"""
+    total = np.clip(pool[..., TOTAL], 0, 3)
+    queue = pool[..., QUEUE]
+    queue = np.where((queue >= 0) & (queue < 3), queue, 3)
+    empty = np.clip(empty_slot, 0, 3)[:, None]
+    return PRIORITY_TABLE_ARRAY[total, queue, empty]
+
+
+def batch_step(pool, available_choice, empty_slot, score, alive, rng):
+    """
+    对所有 alive 的行执行一步，原地修改数组
+    alive 会被更新为执行后仍未结束的行
+    """
+    # 尝试应用规则: 队列中已有 3 张同类牌则直接消除
+    hit = (pool[..., QUEUE] >= 3) & alive[:, None]
+    if hit.any():
+        pool -= 3 * hit[..., None]
+        empty_slot += 3 * hit.sum(axis=1)
+        score += hit.sum(axis=1)
+        pool[..., UNCOVERED] = np.where(hit, np.maximum(pool[..., UNCOVERED], 0), pool[..., UNCOVERED])
+
+    alive &= empty_slot != 0  # 与 step 一致: 仅在空格数恰为 0 时结束
+    q = priority_scores(pool, empty_slot)
+    max_q = q.max(axis=1)
+    alive &= max_q > 0
+
+    # 在 q 值最大的种类中随机选择一个进行移动
+    noise = rng.random(q.shape)
+    op_idx = np.where(q == max_q[:, None], noise, -1.0).argmax(axis=1)
+
+    rows = np.nonzero(alive)[0]
+    ops = op_idx[rows]
+    pool[rows, ops, QUEUE] += 1
+    empty_slot[rows] -= 1
+    available_choice[rows] -= 1
+
+    # 尝试消除
+    cleared = pool[rows, ops, QUEUE] == 3
+    c_rows, c_ops = rows[cleared], ops[cleared]
+    pool[c_rows, c_ops, TOTAL] -= 3
+    pool[c_rows, c_ops, QUEUE] = 0
+    pool[c_rows, c_ops, UNCOVERED] = np.maximum(pool[c_rows, c_ops, UNCOVERED] - 3, 0)
+    empty_slot[c_rows] += 3
+    score[c_rows] += 1
+
+    # 对 pool 进行概率盲盒: 翻牌数量
+    pick_cnt = (rng.random(len(alive)) < 0.5).astype(np.int64)
+    few_choice = available_choice < 8
+    pick_cnt = np.where(few_choice, np.floor(rng.random(len(alive)) * 3).astype(np.int64), pick_cnt)
+    pick_cnt = np.where(available_choice == 0, 1, pick_cnt)
+
+    # 开盲盒加牌: 根据剩余牌数确定概率
+    for pick_idx in range(2):
+        weights = pool[..., UNCOVERED]
+        cum_weights = weights.cumsum(axis=1)
+        total_weights = cum_weights[:, -1]
+        target = rng.random(len(alive)) * total_weights
+        do_pick = alive & (pick_cnt > pick_idx) & (total_weights > 0)
+        p_rows = np.nonzero(do_pick)[0]
+        kinds = (cum_weights[p_rows] <= target[p_rows, None]).sum(axis=1)
+        pool[p_rows, kinds, TOTAL] += 1
+        pool[p_rows, kinds, UNCOVERED] -= 1
+        available_choice[p_rows] += 1
+
+    return alive
+
+
+def batch_rollout(hstate, batch_size: int, rng=None, max_steps=None, return_state=False):
+    """
+    从同一个 hstate 出发同时推进 batch_size 局 rollout
+
+    :param hstate: YangHiddenState 或 dict 形式的 hidden state
+    :param batch_size: int rollout 局数
+    :param rng: np.random.Generator 随机数发生器
+    :param max_steps: int 最大步数，None 表示直到全部结束
+    :param return_state: bool 是否同时返回截断时的状态，用于对未结束的行做价值估计
+    :return: np.ndarray (batch_size,) 每局的(截断时)分数；
+        return_state 为 True 时返回 (score, pool, available_choice, empty_slot, alive)
+    """
+    rng = _default_rng if rng is None else rng
+    pool, available_choice, empty_slot, score = hstate_to_arrays(hstate, batch_size)
+    alive = np.ones(batch_size, dtype=bool)
+    n_step = 0
+    while alive.any() and (max_steps is None or n_step < max_steps):
+        alive = batch_step(pool, available_choice, empty_slot, score, alive, rng)
+        n_step += 1
+    if return_state:
+        return score, pool, available_choice, empty_slot, alive
+    return score
+
+
+class AntitheticRNG:
+    """
+    对偶采样的随机数发生器
+
+    包装 np.random.Generator，每次调用 random(size) 时前一半行使用 u，后一半行使用 1 - u，
+    batch_step 按行消耗随机数，因此第 i 行与第 i + batch/2 行在整局中始终成对使用对偶的随机数。
+    """
+    _BELOW_ONE = np.nextafter(1.0, 0.0)  # 保持取值在 [0, 1) 内，避免翻牌数取到 3
+
+    def __init__(self, rng):
+        self.rng = rng
+
+    def random(self, size):
+        shape = (size,) if np.isscalar(size) else tuple(size)
+        half = (shape[0] + 1) // 2
+        u = self.rng.random((half,) + shape[1:])
+        return np.concatenate([u, np.minimum(1.0 - u, self._BELOW_ONE)])[:shape[0]]
+
+
+class VarianceReducedRollout:
+    """
+    减小方差的批量 rollout 策略，可作为 MCTS 的 batched rollout_policy
+
+    common_random_numbers: 同一父节点下的兄弟节点使用相同的随机数流 (相同的翻牌序列)，
+        比较兄弟节点时随机性大部分相互抵消；同一节点再次追加 rollout 时按已有的样本数切换到新的随机数流。
+    antithetic: 每个样本是一对对偶 rollout 的平均分数，返回 ceil(batch_size / 2) 个样本。
+    """
+    def __init__(self, common_random_numbers=True, antithetic=False, seed=None):
+        self.common_random_numbers = common_random_numbers
+        self.antithetic = antithetic
+        self.seed = seed  # None 表示使用 seed_rollout_rng 设置的种子
+
+    @staticmethod
+    def sibling_key(node):
+        """兄弟节点共享的 key: 根局面 + 父节点的 pending action 序列"""
+        state = node.state
+        pending_actions = getattr(state, "pending_action_list", None)
+        parent_actions = pending_actions.prev.to_tuple() if pending_actions else ()
+        return state.get_root_hash(), parent_actions
+
+    def make_rng(self, node) -> np.random.Generator:
+        if not self.common_random_numbers:
+            return _default_rng
+        seed = _crn_base_seed if self.seed is None else self.seed
+        # 不使用内置 hash(): 字符串哈希按进程加盐 (PYTHONHASHSEED)，各次运行及进程池的各 worker 会得到不同的流
+        digest = hashlib.blake2b(repr(self.sibling_key(node)).encode(), digest_size=8).digest()
+        key = int.from_bytes(digest, "little")
+        return np.random.default_rng([seed, key, node.rollout_n])
+
+    def __call__(self, node, batch_size):
+        rng = self.make_rng(node)
+        hstate = node.state.get_hstate()
+        if not self.antithetic:
+            return batch_rollout(hstate, batch_size, rng=rng)
+        pairs = (batch_size + 1) // 2
+        score = batch_rollout(hstate, 2 * pairs, rng=AntitheticRNG(rng))
+        return (score[:pairs] + score[pairs:]) / 2
+
+
+def hstate_payload(node):
+    """进程池 rollout 只需要发送紧凑的 YangHiddenState"""
+    return node.state.get_hstate()
+
+
+def step_rollout_worker(hstate, iterations: int, seed: int) -> float:
+    """在子进程中串行运行 iterations 局 step rollout，返回总分"""
+    random.seed(seed)
+    total_score = 0
+    for _ in range(iterations):
+        total_score += rollout_fast(hstate.to_dict())
+    return total_score
@@ -1,4 +1,3 @@
-from copy import deepcopy
 from PIL import Image
 
 from app.yang.logic.yang_board_state import YangBoardState
@@ -17,8 +16,7 @@ class YangSimulator(object):
 
 def sample_rollout_policy(node: YangTreeNode):
     # looping num is outside the loop
-    hstate_dict = node.state.get_hstate()._hstate
-    hstate = deepcopy(hstate_dict)
+    hstate = node.state.get_hstate().to_dict()
     while not (is_terminal := step(hstate)):
         pass
         # print(".", end="")
@@ -0,0 +1,151 @@
+"""
+符号化的状态转移
+
+给定父节点已识别的卡牌列表和待执行动作，直接推算子节点的 pool / queue，
+从而避免每个新节点都在叠加图像上重新运行一次检测模型。
+
+识别结果中只有可点击的顶层卡牌，被部分压住的下层卡牌不可见，无法单独推算点击后翻出的卡牌。
+YangOcclusionModel 从叠加图像的识别结果中记录 "哪些卡牌被哪些点击释放"，之后的同类局面据此符号化推算。
+
+卡牌条目格式与识别器一致:
+    (label, x, y, w, h, center_x, center_y, is_critical_action)
+"""
+
+
+def is_point_covered_by_cards(px, py, cards):
+    """判断点 (px, py) 是否落在任意一张卡牌的矩形内"""
+    for card in cards:
+        x, y, w, h = card[1], card[2], card[3], card[4]
+        if x <= px <= x + w and y <= py <= y + h:
+            return True
+    return False
+
+
+def is_card_covered_by_cards(card, cards):
+    """
+    卡牌重叠模型: 若卡牌的四个 1/4 中心点都被 cards 的矩形覆盖，则认为该卡牌被覆盖
+
+    与 YangReplayProcessor 生成训练标签时使用的规则一致，
+    因此符号推算与叠加图像后的识别结果口径相同。
+    """
+    x, y, w, h = card[1], card[2], card[3], card[4]
+    quarter_centers = [
+        (x + w / 4, y + h / 4),
+        (x + 3 * w / 4, y + h / 4),
+        (x + w / 4, y + 3 * h / 4),
+        (x + 3 * w / 4, y + 3 * h / 4),
+    ]
+    return all(is_point_covered_by_cards(qx, qy, cards) for qx, qy in quarter_centers)
+
+
+def apply_action(pool_cards: list, action) -> list:
+    """
+    在父节点的 pool 上执行点击动作，返回子节点的 pool
+
+    被点击的卡牌（以及被判定为与其完全重叠的重复检测框）从 pool 中移除。
+    点击后被释放的下层卡牌由 YangOcclusionModel.apply 加入。
+    queue 不在此处修改: pending action 会在 YangHiddenState.from_new_cards 中追加到 queue。
+    """
+    return [card for card in pool_cards if card != action and not is_card_covered_by_cards(card, [action])]
+
+
+def same_card(card_a, card_b, tolerance=0.25) -> bool:
+    """种类相同且中心点距离在卡牌尺寸的 tolerance 倍以内"""
+    if int(card_a[0]) != int(card_b[0]):
+        return False
+    max_dx = tolerance * max(card_a[3], card_b[3])
+    max_dy = tolerance * max(card_a[4], card_b[4])
+    return abs(card_a[5] - card_b[5]) <= max_dx and abs(card_a[6] - card_b[6]) <= max_dy
+
+
+def match_cards(cards_a: list, cards_b: list, tolerance=0.25):
+    """
+    将两组识别结果中的卡牌一一配对
+
+    :return: (cards_a 中未配对的卡牌, cards_b 中未配对的卡牌)
+    """
+    unmatched_a = []
+    remaining = list(cards_b)
+    for card in cards_a:
+        for idx, other in enumerate(remaining):
+            if same_card(card, other, tolerance):
+                remaining.pop(idx)
+                break
+        else:
+            unmatched_a.append(card)
+    return unmatched_a, remaining
+
+
+def same_cards(cards_a: list, cards_b: list, tolerance=0.25) -> bool:
+    """
+    判断两组识别结果是否一致: 种类相同且中心点距离在卡牌尺寸的 tolerance 倍以内
+
+    用于符号推算的校验模式以及后续局面比对。
+    """
+    if len(cards_a) != len(cards_b):
+        return False
+    unmatched_a, unmatched_b = match_cards(cards_a, cards_b, tolerance)
+    return not unmatched_a and not unmatched_b
+
+
+def cards_overlap(card_a, card_b) -> bool:
+    """两张卡牌的矩形是否相交"""
+    return (card_a[1] < card_b[1] + card_b[3] and card_b[1] < card_a[1] + card_a[3]
+            and card_a[2] < card_b[2] + card_b[4] and card_b[2] < card_a[2] + card_a[4])
+
+
+def may_share_covered_card(card_a, card_b) -> bool:
+    """两张卡牌是否可能同时压住同一张 (同样大小的) 下层卡牌"""
+    return (abs(card_a[5] - card_b[5]) < card_a[3] + card_b[3]
+            and abs(card_a[6] - card_b[6]) < card_a[4] + card_b[4])
+
+
+class YangOcclusionModel:
+    """
+    同一根局面下的遮挡关系
+
+    下层卡牌不在识别结果中，只能从叠加图像的识别结果得知: 与父节点相比新出现、且与已点击卡牌相交的卡牌
+    即为被释放的卡牌，与之相交的已点击卡牌为压住它的卡牌 (blockers)。
+    blockers 全部被点击后，符号推算把该卡牌加入 pool。
+
+    尚未观察过的点击需要先走一次图像识别 (needs_probe)，key 为最后点击的卡牌及之前点击的、
+    可能与它压住同一张卡牌的卡牌，因此需要多张卡牌共同释放的下层卡牌也能被观察到。
+    """
+    def __init__(self):
+        self._freed = []  # [(下层卡牌, frozenset(blockers))]
+        self._probed = set()
+
+    @staticmethod
+    def probe_key(pending_actions):
+        pending_actions = tuple(pending_actions)
+        last = pending_actions[-1]
+        return last, frozenset(a for a in pending_actions[:-1] if may_share_covered_card(a, last))
+
+    def needs_probe(self, pending_actions) -> bool:
+        return self.probe_key(pending_actions) not in self._probed
+
+    def observe(self, parent_pool_cards: list, pending_actions, pool_cards: list):
+        """记录一次图像识别的结果: pool_cards 为执行 pending_actions 后识别得到的 pool"""
+        pending_actions = tuple(pending_actions)
+        self._probed.add(self.probe_key(pending_actions))
+        revealed, _ = match_cards(pool_cards, parent_pool_cards)
+        for card in revealed:
+            blockers = frozenset(a for a in pending_actions if cards_overlap(a, card))
+            if not blockers:
+                continue  # 与点击无关，视为识别误差
+            if not any(same_card(card, c) and blockers == b for c, b in self._freed):
+                self._freed.append((card, blockers))
+
+    def apply(self, parent_pool_cards: list, pending_actions) -> list:
+        """在父节点的 pool 上执行最后一个动作，并加入因此被释放的下层卡牌"""
+        pending_actions = tuple(pending_actions)
+        last = pending_actions[-1]
+        pool_cards = apply_action(parent_pool_cards, last)
+        clicked = set(pending_actions)
+        for card, blockers in self._freed:
+            if last not in blockers or not blockers <= clicked:
+                continue
+            if any(same_card(card, c) for c in pool_cards) or any(same_card(card, a) for a in pending_actions):
+                continue
+            pool_cards.append(card)
+        return pool_cards
@@ -1,29 +1,76 @@
-from copy import deepcopy
-
 from app.yang.logic.yang_board_state import YangSimulatedState
+from app.yang.logic.yang_pending_actions import PendingActionList
+from app.yang.logic.yang_transition import same_card
 
+from search.action_pool import UntriedActionPool
 from search.tree_node import TreeNode
 
 
 class YangTreeNode(TreeNode):
+    __slots__ = ()
+
     def __init__(self, state: YangSimulatedState, action=None):
         super().__init__(state, action)
-        self.prev_state = None
         if action is not None:
-            self.prev_state = state
-            if isinstance(self.prev_state, YangSimulatedState):
-                pending_actions = deepcopy(self.prev_state.pending_action_list)  # 获取上一步的pending_action
+            prev_state = state
+            if isinstance(prev_state, YangSimulatedState):
+                pending_actions = prev_state.pending_action_list  # 获取上一步的pending_action
             else:
-                pending_actions = []
-            pending_actions.append(action)
+                pending_actions = PendingActionList()
+            # 不可变链表，与父节点共享前缀
+            pending_actions = pending_actions.push(action)
             self.state = YangSimulatedState(
-                self.prev_state.get_crt_img(), 
-                last_hstate=deepcopy(self.prev_state.get_hstate()),  # deepcopy?
-                simulator=self.prev_state.simulator,
-                pending_action_list=pending_actions
+                prev_state.get_crt_img(), 
+                last_hstate=prev_state.get_hstate(),  # 不可变对象，直接共享
+                simulator=prev_state.simulator,
+                pending_action_list=pending_actions,
+                parent_cards=prev_state.get_cards(),  # 用于符号化推算子节点局面
+                cache=prev_state.cache,
+                root_hash=prev_state.get_root_hash(),
             )
 
-        self.visited_action_mask = None
+    def replace_state(self, state, tried_actions):
+        """
+        用新识别的局面替换该节点推算出的局面 (复用子树时调用)
+
+        可选动作改为新局面中的卡牌，与 tried_actions (已有子节点的动作) 对应的卡牌记为已尝试，
+        点击后新翻出的卡牌成为未尝试的动作。
+        """
+        self.state = state
+        self._available_actions = None
+        self.expand_for_next_actions()
+        actions, weights = self.available_actions_and_weights
+        self._untried_actions = UntriedActionPool(actions, weights)
+        self._tried_action_num = 0
+        remaining = list(range(len(actions)))
+        for tried in tried_actions:
+            for k in remaining:
+                if same_card(tried, actions[k]):
+                    remaining.remove(k)
+                    self._untried_actions.remove(k)
+                    self._tried_action_num += 1
+                    break
+
+    def state_key(self):
+        # override: 已点击的卡牌集合，与点击顺序无关 (进入队列的卡牌种类也由该集合唯一确定)
+        pending_actions = getattr(self.state, "pending_action_list", [])
+        return frozenset(pending_actions)
+
+    @classmethod
+    def prepare_batch(cls, nodes):
+        # override: 将需要图像识别的节点合并为一次 predict 调用
+        states_by_simulator = {}
+        for node in nodes:
+            state = node.state
+            if isinstance(state, YangSimulatedState) and state.needs_image_recognition():
+                states_by_simulator.setdefault(id(state.simulator), []).append(state)
+        for states in states_by_simulator.values():
+            simulator = states[0].simulator
+            if not hasattr(simulator, "recognize_batch"):
+                continue
+            results = simulator.recognize_batch([state.get_crt_img() for state in states])
+            for state, (pool_cards, queue_cards) in zip(states, results):
+                state.set_recognized_cards(pool_cards, queue_cards)
 
     def get_possible_actions(self):
         # override
@@ -0,0 +1,302 @@
+"""
+学习得到的局面价值函数
+
+用线性模型或单隐层 MLP 拟合 hidden state 的剩余期望分数 (return-to-go)。
+训练数据: 对局中记录搜索树访问过的局面 (VALUE_LOG_SEARCH_STATES)，离线从这些局面出发运行向量化 rollout，
+记录每一步之前的状态，目标为该局最终分数减去当时的分数。
+MCTS 中可以完全代替 rollout (truncate_steps=0)，也可以先 rollout k 步再用模型估计未结束的局。
+模型只依赖 numpy，预测按 batch 进行。
+"""
+import glob
+import os
+import time
+
+import numpy as np
+
+from app.yang.yang_constants import (
+    CARD_KINDS, VALUE_MODEL_PATH, VALUE_ROLLOUT_TRUNCATE_STEPS, VALUE_STATE_LOG_DIR,
+)
+from app.yang.yang_hstate import YangHiddenState
+from app.yang.logic.yang_rollout import batch_rollout, batch_step, hstate_to_arrays
+
+TOTAL, QUEUE, UNCOVERED = 0, 1, 2
+MAX_EMPTY_SLOT = 7
+
+
+def hstate_features(pool: np.ndarray, available_choice: np.ndarray, empty_slot: np.ndarray) -> np.ndarray:
+    """
+    将一批 hidden state 转为特征矩阵
+
+    :param pool: (batch, 16, 3) 整数数组
+    :param available_choice: (batch,)
+    :param empty_slot: (batch,)
+    :return: (batch, n_features) float64
+    """
+    pool = np.asarray(pool)
+    batch = len(pool)
+    total = np.clip(pool[..., TOTAL], 0, 3)
+    queue = np.clip(pool[..., QUEUE], 0, 2)
+    # 与 step 的优先级规则对应: 按 (场上张数, 队列张数) 统计种类数
+    hist = np.zeros((batch, 12))
+    np.add.at(hist, (np.arange(batch)[:, None], total * 3 + queue), 1)
+    empty = np.clip(empty_slot, 0, MAX_EMPTY_SLOT)
+    empty_onehot = np.zeros((batch, MAX_EMPTY_SLOT + 1))
+    empty_onehot[np.arange(batch), empty] = 1
+    return np.concatenate([
+        pool.reshape(batch, -1) / 15,
+        hist / CARD_KINDS,
+        pool[..., UNCOVERED].clip(min=0).sum(axis=1, keepdims=True) / 30,
+        pool[..., TOTAL].clip(min=0).sum(axis=1, keepdims=True) / 30,
+        np.asarray(available_choice, dtype=np.float64)[:, None] / 30,
+        np.asarray(empty_slot, dtype=np.float64)[:, None] / MAX_EMPTY_SLOT,
+        empty_onehot,
+    ], axis=1)
+
+
+class YangValueModel:
+    """
+    hidden_size 为 0 时是岭回归的线性模型，否则为单隐层 ReLU MLP (Adam 训练)
+    输入特征先做标准化，均值和方差随模型一起保存
+    """
+    def __init__(self, hidden_size=0, l2=1e-3, seed=0):
+        self.hidden_size = hidden_size
+        self.l2 = l2
+        self.seed = seed
+        self.mean = None
+        self.std = None
+        self.params = {}
+
+    def _normalize(self, X):
+        return (X - self.mean) / self.std
+
+    def fit(self, X: np.ndarray, y: np.ndarray, epochs=30, batch_size=256, lr=1e-3, verbose=True):
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        self.mean = X.mean(axis=0)
+        self.std = X.std(axis=0) + 1e-6
+        Xn = self._normalize(X)
+        if self.hidden_size == 0:
+            # 闭式解: (X^T X + l2 I) w = X^T y，偏置不做正则
+            A = np.hstack([Xn, np.ones((len(Xn), 1))])
+            reg = self.l2 * len(Xn) * np.eye(A.shape[1])
+            reg[-1, -1] = 0
+            w = np.linalg.solve(A.T @ A + reg, A.T @ y)
+            self.params = {"w": w[:-1], "b": w[-1:]}
+            return self
+
+        rng = np.random.default_rng(self.seed)
+        n_in, n_hidden = Xn.shape[1], self.hidden_size
+        self.params = {
+            "W1": rng.normal(0, np.sqrt(2 / n_in), (n_in, n_hidden)),
+            "b1": np.zeros(n_hidden),
+            "w": rng.normal(0, np.sqrt(1 / n_hidden), n_hidden),
+            "b": np.array([y.mean()]),
+        }
+        moments = {k: (np.zeros_like(v), np.zeros_like(v)) for k, v in self.params.items()}
+        beta1, beta2, t = 0.9, 0.999, 0
+        for epoch in range(epochs):
+            order = rng.permutation(len(Xn))
+            for start in range(0, len(Xn), batch_size):
+                idx = order[start: start + batch_size]
+                xb, yb = Xn[idx], y[idx]
+                h_pre = xb @ self.params["W1"] + self.params["b1"]
+                h = np.maximum(h_pre, 0)
+                pred = h @ self.params["w"] + self.params["b"][0]
+                d_pred = 2 * (pred - yb) / len(idx)
+                d_h = np.outer(d_pred, self.params["w"]) * (h_pre > 0)
+                grads = {
+                    "W1": xb.T @ d_h + self.l2 * self.params["W1"],
+                    "b1": d_h.sum(axis=0),
+                    "w": h.T @ d_pred + self.l2 * self.params["w"],
+                    "b": np.array([d_pred.sum()]),
+                }
+                t += 1
+                for k, g in grads.items():
+                    m, v = moments[k]
+                    m *= beta1
+                    m += (1 - beta1) * g
+                    v *= beta2
+                    v += (1 - beta2) * g * g
+                    self.params[k] -= lr * (m / (1 - beta1 ** t)) / (np.sqrt(v / (1 - beta2 ** t)) + 1e-8)
+            if verbose and (epoch + 1) % 10 == 0:
+                print(f"epoch {epoch + 1} mse: {np.mean((self.predict_features(X) - y) ** 2):.4f}")
+        return self
+
+    def predict_features(self, X: np.ndarray) -> np.ndarray:
+        Xn = self._normalize(np.asarray(X, dtype=np.float64))
+        if self.hidden_size == 0:
+            return Xn @ self.params["w"] + self.params["b"][0]
+        h = np.maximum(Xn @ self.params["W1"] + self.params["b1"], 0)
+        return h @ self.params["w"] + self.params["b"][0]
+
+    def predict_arrays(self, pool, available_choice, empty_slot) -> np.ndarray:
+        """对一批状态预测剩余期望分数"""
+        return self.predict_features(hstate_features(pool, available_choice, empty_slot))
+
+    def predict(self, hstate: YangHiddenState) -> float:
+        """单个状态的期望最终分数 (当前分数 + 预测的剩余分数)"""
+        pool, available_choice, empty_slot, score = hstate_to_arrays(hstate, 1)
+        return float(score[0] + self.predict_arrays(pool, available_choice, empty_slot)[0])
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez(path, hidden_size=self.hidden_size, l2=self.l2, seed=self.seed,
+                 mean=self.mean, std=self.std, **{"param_" + k: v for k, v in self.params.items()})
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        model = cls(hidden_size=int(data["hidden_size"]), l2=float(data["l2"]), seed=int(data["seed"]))
+        model.mean, model.std = data["mean"], data["std"]
+        model.params = {k[len("param_"):]: data[k] for k in data.files if k.startswith("param_")}
+        return model
+
+
+def search_state_arrays(nodes) -> tuple:
+    """将搜索树中已访问节点的 hidden state 合并为 batch 形式 (pool, available_choice, empty_slot, score)，相同局面只保留一个"""
+    hstates = [node.state.get_hstate() for node in nodes if node.is_visited()]
+    if not hstates:
+        return (np.zeros((0, CARD_KINDS, 3), dtype=np.int64), np.zeros(0, dtype=np.int64),
+                np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64))
+    pool = np.stack([hstate.pool_array for hstate in hstates])
+    available_choice = np.array([hstate.available_choice_num for hstate in hstates], dtype=np.int64)
+    empty_slot = np.array([hstate.remaining_slot_num for hstate in hstates], dtype=np.int64)
+    score = np.array([hstate.score for hstate in hstates], dtype=np.float64)
+    # 剩余分数与当前分数无关，按 (pool, available_choice, empty_slot) 去重
+    rows = np.concatenate([pool.reshape(len(pool), -1), available_choice[:, None], empty_slot[:, None]], axis=1)
+    _, keep = np.unique(rows, axis=0, return_index=True)
+    keep.sort()
+    return pool[keep], available_choice[keep], empty_slot[keep], score[keep]
+
+
+def save_search_states(nodes, log_dir=VALUE_STATE_LOG_DIR) -> str:
+    """保存一次搜索中访问过的局面，返回文件路径"""
+    pool, available_choice, empty_slot, score = search_state_arrays(nodes)
+    os.makedirs(log_dir, exist_ok=True)
+    path = os.path.join(log_dir, f"{time.strftime('%Y%m%d_%H%M%S')}_{time.time_ns() % 10**9:09d}.npz")
+    np.savez(path, pool=pool, available_choice=available_choice, empty_slot=empty_slot, score=score)
+    return path
+
+
+def load_search_states(pattern=os.path.join(VALUE_STATE_LOG_DIR, "*.npz")) -> tuple:
+    """读取 save_search_states 记录的所有局面"""
+    pool, available_choice, empty_slot, score = [], [], [], []
+    for path in sorted(glob.glob(pattern)):
+        data = np.load(path)
+        pool.append(data["pool"])
+        available_choice.append(data["available_choice"])
+        empty_slot.append(data["empty_slot"])
+        score.append(data["score"])
+    if not pool:
+        return (np.zeros((0, CARD_KINDS, 3), dtype=np.int64), np.zeros(0, dtype=np.int64),
+                np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64))
+    return np.concatenate(pool), np.concatenate(available_choice), np.concatenate(empty_slot), np.concatenate(score)
+
+
+def collect_samples(start_states: tuple, rollouts_per_state=4, rng=None, max_samples_per_game=None):
+    """
+    从记录的局面出发各运行 rollouts_per_state 局 rollout，记录每一步之前的状态及其 return-to-go
+
+    :param start_states: (pool, available_choice, empty_slot, score)，例如 load_search_states 的结果
+    :return: (X, y) 特征矩阵和目标 (最终分数 - 当时分数)
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    pool, available_choice, empty_slot, score = (np.repeat(a, rollouts_per_state, axis=0) for a in start_states)
+    num_games = len(pool)
+    alive = np.ones(num_games, dtype=bool)
+    logged_features, logged_rows, logged_scores = [], [], []
+    while alive.any():
+        rows = np.nonzero(alive)[0]
+        logged_features.append(hstate_features(pool[rows], available_choice[rows], empty_slot[rows]))
+        logged_rows.append(rows)
+        logged_scores.append(score[rows].copy())
+        alive = batch_step(pool, available_choice, empty_slot, score, alive, rng)
+    X = np.concatenate(logged_features)
+    rows = np.concatenate(logged_rows)
+    y = score[rows] - np.concatenate(logged_scores)
+    if max_samples_per_game is not None and len(X) > num_games * max_samples_per_game:
+        keep = rng.choice(len(X), num_games * max_samples_per_game, replace=False)
+        X, y = X[keep], y[keep]
+    return X, y
+
+
+class YangValueEstimator:
+    """
+    MCTS 的 value_estimator 钩子
+
+    truncate_steps 为 0 时直接用模型预测，完全代替 rollout；
+    否则先用向量化引擎 rollout truncate_steps 步，对尚未结束的局加上模型预测的剩余分数。
+    """
+    def __init__(self, model: YangValueModel, truncate_steps=VALUE_ROLLOUT_TRUNCATE_STEPS, rng=None):
+        self.model = model
+        self.truncate_steps = truncate_steps
+        self.rng = rng
+        self.evaluations = 0
+
+    @classmethod
+    def from_file(cls, path=VALUE_MODEL_PATH, **kwargs):
+        return cls(YangValueModel.load(path), **kwargs)
+
+    def estimate(self, hstate: YangHiddenState, iterations: int) -> float:
+        self.evaluations += 1
+        if self.truncate_steps == 0:
+            return self.model.predict(hstate)
+        score, pool, available_choice, empty_slot, alive = batch_rollout(
+            hstate, iterations, rng=self.rng, max_steps=self.truncate_steps, return_state=True
+        )
+        if alive.any():
+            score[alive] += self.model.predict_arrays(pool[alive], available_choice[alive], empty_slot[alive])
+        return float(score.mean())
+
+    def __call__(self, node, iterations: int) -> float:
+        # 与 rollout 相同，pending_action_list 中每个动作的奖励已经计入 hstate 的 score
+        return self.estimate(node.state.get_hstate(), iterations)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="train the value model on states logged from real searches")
+    parser.add_argument("--states", type=str, default=os.path.join(VALUE_STATE_LOG_DIR, "*.npz"),
+                        help="files written with VALUE_LOG_SEARCH_STATES = True")
+    parser.add_argument("--rollouts", type=int, default=4, help="rollouts per logged state")
+    parser.add_argument("--val_ratio", type=float, default=0.2)
+    args = parser.parse_args()
+
+    # 离线训练: 读取搜索记录的局面 -> 从这些局面 rollout 得到样本 -> 拟合 -> 保存
+    states = load_search_states(args.states)
+    if len(states[0]) == 0:
+        raise SystemExit(f"no search states found in {args.states}, play with VALUE_LOG_SEARCH_STATES = True first")
+    rng = np.random.default_rng(0)
+    order = rng.permutation(len(states[0]))
+    num_val = max(1, int(len(order) * args.val_ratio))
+    train_states = tuple(a[order[num_val:]] for a in states)
+    val_states = tuple(a[order[:num_val]] for a in states)
+    tic = time.time()
+    X, y = collect_samples(train_states, args.rollouts, rng)
+    X_val, y_val = collect_samples(val_states, args.rollouts, rng)
+    print(f"states: {len(order)} samples: {len(X)} / {len(X_val)} features: {X.shape[1]} "
+          f"time: {time.time() - tic:.1f}s")
+    print(f"baseline (mean) mse: {np.mean((y_val - y.mean()) ** 2):.4f}")
+    best_model, best_mse = None, None
+    for hidden_size in (0, 32):
+        tic = time.time()
+        model = YangValueModel(hidden_size=hidden_size).fit(X, y)
+        mse = np.mean((model.predict_features(X_val) - y_val) ** 2)
+        print(f"hidden_size={hidden_size} val mse: {mse:.4f} fit time: {time.time() - tic:.1f}s")
+        if best_mse is None or mse < best_mse:
+            best_model, best_mse = model, mse
+    best_model.save(VALUE_MODEL_PATH)
+    print("saved to", VALUE_MODEL_PATH)
+
+    # 与完整 rollout 对比速度
+    hstate = YangHiddenState.from_arrays(val_states[0][0].copy(), val_states[1][0], val_states[2][0], 0)
+    for truncate_steps in (0, VALUE_ROLLOUT_TRUNCATE_STEPS):
+        estimator = YangValueEstimator(best_model, truncate_steps=truncate_steps)
+        tic = time.time()
+        values = [estimator.estimate(hstate, 2) for _ in range(200)]
+        print(f"truncate_steps={truncate_steps} value: {np.mean(values):.3f} "
+              f"time: {(time.time() - tic) / 200 * 1000:.3f} ms")
+    tic = time.time()
+    full = [batch_rollout(hstate, 2).mean() for _ in range(200)]
+    print(f"full rollout value: {np.mean(full):.3f} time: {(time.time() - tic) / 200 * 1000:.3f} ms")
@@ -5,16 +5,80 @@ CARD_KINDS = 16  # 卡片的种类数目
 
 MAIN_AREA_POSITION = (0.05, 0.19, 0.9, 0.68)  # 棋盘主要区域坐标 (x, y, w, h)
 
+# CommonController 的帧差门控配置 (config["frame_diff"])，见 controller/perceive/frame_diff.py
+FRAME_DIFF_CONFIG = {
+    "region": MAIN_AREA_POSITION,
+    "size": (128, 128),  # 卡牌约 18 像素宽，至少完整覆盖一个格子
+    "tile_size": 8,
+    "threshold": 4.0,  # 任一格子内的灰度平均绝对差 (0~255) 超过该值视为变化
+    "settle_frames": 1,  # 画面变化后需连续不变的帧数
+    "max_idle_frames": 30,  # 最多连续跳过的帧数
+}
+
 VERBOSE = False  # 是否打印详细信息
 
 # MCTS 算法相关
 MCTS_RUN_ITERATION = 300 // 3
+MCTS_TIME_BUDGET = None  # 每步搜索的时间预算(秒)，设置后以时间为准，不再限制迭代次数
+MCTS_NODE_BUDGET = None  # 每步搜索的节点数上限
+MCTS_REUSE_TREE = True  # 下一帧的识别结果与上一步选择的子节点一致时，复用其子树继续搜索
 MCTS_ROLLOUT_BATCH_SIZE = 2
+MCTS_VECTORIZED_ROLLOUT = True  # 使用 NumPy 向量化 rollout 引擎一次评估 MCTS_ROLLOUT_BATCH_SIZE 局
+MCTS_ROLLOUT_PROCESSES = 0  # >0 时使用常驻进程池并行 rollout (优先于向量化引擎)
+MCTS_ROLLOUT_SEED = 0  # 进程池 rollout 的随机种子
+MCTS_COMMON_RANDOM_NUMBERS = False  # 向量化 rollout 中兄弟节点使用相同的随机数流，减小比较兄弟节点时的噪声 (可选，默认关闭)
+MCTS_ANTITHETIC_ROLLOUT = False  # 向量化 rollout 使用成对的对偶随机数
+MCTS_ROLLOUT_TARGET_SE = None  # 设置后按批追加 rollout，直到节点回报的标准误差不超过该值
+MCTS_ROLLOUT_MAX_ITERATIONS = 16  # 追加 rollout 时每个节点的 rollout 数上限
+MCTS_ROOT_PARALLEL_WORKERS = 0  # >0 时使用根并行 MCTS，每个进程独立搜索后合并根节点统计
+MCTS_TREE_PARALLEL_THREADS = 0  # >0 时多个线程共享同一棵搜索树 (虚拟损失)，仅在 MCTS_ROLLOUT_PROCESSES > 0 时有加速，不使用置换表
 MCTS_CONFIDENCE = 3 * math.sqrt(15)
+MCTS_EXPAND_BATCH_SIZE = 1  # 每轮收集的待展开叶子数，>1 时启用批量识别
+MCTS_VIRTUAL_LOSS = 1.0  # 虚拟损失: 每个未回传的访问对 Q 值的惩罚
+MCTS_TRANSPOSITION = False  # 合并不同点击顺序到达的相同局面 (置换表，可选，默认关闭)
+MCTS_COMPACT_STORE = True  # 节点统计量和父子关系保存在连续的数组中 (search/node_store.py)
+MCTS_DEBUG = False  # 开启 MCTS 内部的一致性检查 (较慢)
+
+# 残局精确求值 (app/yang/logic/yang_endgame.py)
+ENDGAME_EXACT = False  # 剩余卡牌足够少时用 rollout 策略下的精确期望代替 rollout (可选，默认关闭)
+ENDGAME_EXACT_MAX_CARDS = 10  # 尚未消除的卡牌数 (场上 + 队列 + 未翻开) 不超过该值时启用
+ENDGAME_MEMO_SIZE = 200000  # 记忆化表的最大条目数，超过后清空
+
+# 学习得到的价值函数 (app/yang/logic/yang_value_model.py)
+VALUE_ESTIMATOR = True  # 模型文件存在时，用价值函数代替或截断 rollout
+VALUE_MODEL_PATH = "runs/value/yang_value_model.npz"  # 由 yang_value_model.py 离线训练得到
+VALUE_ROLLOUT_TRUNCATE_STEPS = 8  # rollout 的步数，之后由模型估计剩余分数；0 表示完全由模型代替 rollout
+VALUE_LOG_SEARCH_STATES = False  # 每一步搜索后记录搜索树中访问过的局面，用于训练价值函数
+VALUE_STATE_LOG_DIR = "runs/value/states"
+
+# 子节点状态推算方式
+# True: 根据父节点的识别结果和动作符号化推算子节点局面，不再调用检测模型
+# False: 在叠加图像上重新运行检测模型（旧逻辑）
+SYMBOLIC_TRANSITION = True
+# 符号推算的校验模式：额外运行一次图像识别并比对结果，仅用于调试
+SYMBOLIC_TRANSITION_VERIFY = False
+# 识别结果缓存的最大条目数 (LRU)
+RECOGNITION_CACHE_SIZE = 4096
 
 RWD_NON_CRITICAL_ACTION = -0.9
 RWD_IS_CRITICAL_ACTION = 0.5
 
+# 检测模型 (app/yang/yang_detector_backends.py)
+YOLO_IMGSZ = 640  # 整图识别时的输入尺寸 (ultralytics 默认值)
+DETECTOR_BACKEND = "auto"  # "auto" (按权重后缀选择) / "ultralytics" / "onnx"
+DETECTOR_DEVICE = None  # ultralytics 后端的设备，None 表示有 cuda 时使用 cuda:0，否则 cpu
+DETECTOR_CONF = 0.25  # 置信度阈值 (ultralytics 默认值)
+DETECTOR_IOU = 0.7  # NMS 的 IoU 阈值 (ultralytics 默认值)
+ONNX_INTRA_OP_THREADS = 0  # ONNX Runtime 的算子内线程数，0 表示使用默认值 (物理核数)
+
+# 局部重新识别 (app/yang/yang_roi_redetector.py)
+ROI_REDETECT = False  # 只对与上一帧相比发生变化的区域重新运行检测模型 (可选，默认关闭)
+ROI_TILE_SIZE = 32  # 比较帧差的格子大小 (像素)
+ROI_DIFF_THRESHOLD = 8.0  # 格子内灰度平均绝对差超过该值视为变化
+ROI_MARGIN = 16  # 变化区域向外扩展的像素数
+ROI_MAX_AREA_RATIO = 0.5  # 需要重新识别的面积超过整图的该比例时直接整图识别
+ROI_FULL_REFRESH_FRAMES = 10  # 每隔多少帧强制整图识别一次，避免误差累积
+
 # 核心选区配置
 # 使用 flet_label_region.py 进行选区标注，可以配置多个，每行一个，尽量不要重叠
 # 配置格式为：(x, y, w, h) i.e. (left, top, width, height) 
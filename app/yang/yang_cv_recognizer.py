@@ -1,10 +1,10 @@
 import cv2
 import numpy as np
 from PIL import Image, ImageGrab
-from skimage.metrics import structural_similarity
 
-from app.yang.yang_constants import MAIN_AREA_POSITION, CARD_KINDS
+from app.yang.yang_constants import MAIN_AREA_POSITION
 from app.yang.yang_hstate import YangHiddenState
+from app.yang.yang_template_matcher import YangTemplateMatcher
 
 from controller.perceive.split_utils import crop_image
 from controller.recognize.base_recognizer import BaseRecognizer
@@ -16,6 +16,7 @@ class YangCvRecognizer(BaseRecognizer):
         super().__init__()
         self._last_img = None
         self._last_hstate = None
+        self.matcher = YangTemplateMatcher()  # 模板只读取一次
 
     def recognize(self, image: Image) -> MaybeResult:
         # self._last_img = image
@@ -45,40 +46,30 @@ class YangCvRecognizer(BaseRecognizer):
         """
         pool_cards = []  # 池子中的卡牌
         queue_cards = []  # 待消除序列中的卡牌
-        flag = np.mean(np.abs(im - np.array([245,255,205])), 2) < 15  # 获取卡牌背景
+        # 获取卡牌背景: 三通道差值的均值 < 15，即差值之和 < 45 (int16 计算，避免 float64 的大数组)
+        flag = np.abs(im.astype(np.int16) - np.array([245,255,205], dtype=np.int16)).sum(axis=2) < 45
         flag = np.array(flag, dtype='uint8')
 
-        imgs = np.zeros((16,45,45,3), dtype='uint8')  # 读取标注模板
-        for i in range(CARD_KINDS):
-            imgs[i] = np.array(Image.open(f'images/cards/{i}.png'))
-
         num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(flag, connectivity=8)
 
-        for i in range(num_labels):
-            if stats[i,4] > 500 and i != 0:  # 判定为卡牌
-                x, y, w, h = stats[i,:4]
-                center_x,center_y = centroids[i]
-
-                img = im[y:y+h,x:x+w]  # 将判定为卡牌的区域单独取出来作为img
-                img = np.array(Image.fromarray(img).resize((45, 45)))
-
-                ssmi = np.zeros(16)
-                for j in range(16):  # 将img和标签逐个比较
-                    ssmi[j] = structural_similarity(img, imgs[j], data_range=255, channel_axis=2)
-                label = np.argmax(ssmi)
-
-                entry = [label, x, y, w, h, int(center_x), int(center_y)]
-                area = w * h
-                if area < min_area:  # 卡牌面积太小则忽略
-                    continue
-                height, width = im.shape[:2]  # 注意数组情况下的 shape 是反过来的
-                if normalize:
-                    entry = [label, x/width, y/height, w/width, h/height, center_x/width, center_y/height]
-
-                if int(center_y) < pool_queue_split_ratio * height:
-                    pool_cards.append(entry)  # 池子中的卡牌
-                else:  
-                    queue_cards.append(entry)  # 待消除序列中的卡牌
+        # 先按面积筛选出卡牌，再一次性与所有模板匹配
+        card_ids = [i for i in range(1, num_labels) if stats[i,4] > 500 and stats[i,2] * stats[i,3] >= min_area]
+        crops = [im[stats[i,1]:stats[i,1]+stats[i,3], stats[i,0]:stats[i,0]+stats[i,2]] for i in card_ids]
+        card_labels = self.matcher.match(crops) if crops else []
+
+        height, width = im.shape[:2]  # 注意数组情况下的 shape 是反过来的
+        for i, label in zip(card_ids, card_labels):
+            x, y, w, h = stats[i,:4]
+            center_x,center_y = centroids[i]
+
+            entry = [label, x, y, w, h, int(center_x), int(center_y)]
+            if normalize:
+                entry = [label, x/width, y/height, w/width, h/height, center_x/width, center_y/height]
+
+            if int(center_y) < pool_queue_split_ratio * height:
+                pool_cards.append(entry)  # 池子中的卡牌
+            else:  
+                queue_cards.append(entry)  # 待消除序列中的卡牌
 
         pool_cards = np.array(pool_cards).tolist()
         queue_cards = np.array(queue_cards).tolist()
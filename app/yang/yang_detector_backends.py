@@ -0,0 +1,271 @@
+"""
+卡牌检测模型的推理后端
+
+    - UltralyticsBackend: ultralytics / PyTorch，自动选择 cuda 或 cpu
+    - OnnxBackend: ONNX Runtime CPU 推理，前处理 (letterbox) 和 NMS 用 NumPy 实现，不依赖 torch
+
+两个后端使用同一份权重 (.pt 通过 export_onnx 导出为 .onnx)，输出统一为 Detections。
+依赖按需导入，只安装 onnxruntime 的机器也可以运行 OnnxBackend。
+"""
+import ast
+import os
+
+import cv2
+import numpy as np
+
+from app.yang.yang_constants import (
+    YOLO_IMGSZ, DETECTOR_BACKEND, DETECTOR_DEVICE, DETECTOR_CONF, DETECTOR_IOU, ONNX_INTRA_OP_THREADS,
+)
+
+
+class Detections:
+    """单张图片的检测结果，坐标为原图的 xyxy"""
+    def __init__(self, xyxy: np.ndarray, conf: np.ndarray, cls: np.ndarray, names: dict):
+        self.xyxy = np.asarray(xyxy, dtype=np.float64).reshape(-1, 4)
+        self.conf = np.asarray(conf, dtype=np.float64).reshape(-1)
+        self.cls = np.asarray(cls, dtype=np.float64).reshape(-1)
+        self.names = names
+
+    def __len__(self):
+        return len(self.conf)
+
+
+def to_rgb_array(image) -> np.ndarray:
+    """
+    将 PIL.Image 或数组统一为 (H, W, 3) uint8 RGB
+    截图可能是 RGBA / L / P 等模式，直接 np.asarray 会得到错误的通道数
+    """
+    if isinstance(image, np.ndarray):
+        if image.ndim == 2:
+            return np.repeat(image[..., None], 3, axis=2)
+        return image[..., :3]  # RGBA 丢弃 alpha
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return np.asarray(image)
+
+
+def letterbox(im: np.ndarray, new_shape=YOLO_IMGSZ, color=114, auto=False, stride=32):
+    """
+    与 ultralytics 的 LetterBox 相同的缩放和填充
+    :param im: (H, W, 3) uint8 RGB
+    :param new_shape: int 或 (h, w)
+    :param auto: True 时只填充到 stride 的整数倍 (最小矩形)
+    :return: (填充后的图片, 缩放比例, (left, top))
+    """
+    if isinstance(new_shape, int):
+        new_shape = (new_shape, new_shape)
+    height, width = im.shape[:2]
+    r = min(new_shape[0] / height, new_shape[1] / width)
+    new_unpad = int(round(width * r)), int(round(height * r))
+    dw, dh = new_shape[1] - new_unpad[0], new_shape[0] - new_unpad[1]
+    if auto:
+        dw, dh = np.mod(dw, stride), np.mod(dh, stride)
+    dw, dh = dw / 2, dh / 2
+    if (width, height) != new_unpad:
+        im = cv2.resize(im, new_unpad, interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    im = cv2.copyMakeBorder(im, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(color, color, color))
+    return im, r, (left, top)
+
+
+def nms(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float) -> np.ndarray:
+    """贪心 NMS，返回保留的下标 (按分数从高到低)"""
+    x1, y1, x2, y2 = boxes.T
+    areas = (x2 - x1) * (y2 - y1)
+    order = scores.argsort()[::-1]
+    keep = []
+    while len(order) > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        w = np.clip(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0, None)
+        h = np.clip(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0, None)
+        inter = w * h
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+
+def postprocess(output: np.ndarray, ratio, pad, image_shape, conf=DETECTOR_CONF, iou=DETECTOR_IOU, max_det=300):
+    """
+    YOLOv8 的原始输出 (4 + nc, N) -> 原图坐标的 (xyxy, conf, cls)
+    与 ultralytics 的 non_max_suppression 一致: 单标签、按类别分别做 NMS
+    """
+    pred = output.T  # (N, 4 + nc)
+    class_scores = pred[:, 4:]
+    cls = class_scores.argmax(axis=1)
+    scores = class_scores[np.arange(len(pred)), cls]
+    mask = scores > conf
+    pred, cls, scores = pred[mask], cls[mask], scores[mask]
+    cx, cy, w, h = pred[:, 0], pred[:, 1], pred[:, 2], pred[:, 3]
+    boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+    # 按类别偏移坐标，一次 NMS 即可实现分类别 NMS
+    keep = nms(boxes + cls[:, None] * 7680.0, scores, iou)[:max_det]
+    boxes, scores, cls = boxes[keep], scores[keep], cls[keep]
+    boxes[:, [0, 2]] -= pad[0]
+    boxes[:, [1, 3]] -= pad[1]
+    boxes /= ratio
+    height, width = image_shape[:2]
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, width)
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, height)
+    return boxes, scores, cls
+
+
+def auto_device():
+    import torch
+    return "cuda:0" if torch.cuda.is_available() else "cpu"
+
+
+class UltralyticsBackend:
+    def __init__(self, model_path, device=DETECTOR_DEVICE, conf=DETECTOR_CONF, iou=DETECTOR_IOU):
+        print("Loading YOLO ...")
+        from ultralytics import YOLO
+        print("YOLO loaded.")
+        self.model = YOLO(model_path)
+        self.device = device if device is not None else auto_device()
+        self.conf = conf
+        self.iou = iou
+
+    def predict(self, images: list, imgsz=None) -> list:
+        """images 为 PIL.Image 或 RGB 数组的列表"""
+        images = [to_rgb_array(image)[..., ::-1] for image in images]  # ultralytics 的数组输入为 BGR
+        kwargs = {} if imgsz is None else {"imgsz": imgsz}
+        results = self.model.predict(
+            source=images, save=False, verbose=False, device=self.device, conf=self.conf, iou=self.iou, **kwargs
+        )
+        return [
+            Detections(r.boxes.xyxy.cpu().numpy(), r.boxes.conf.cpu().numpy(), r.boxes.cls.cpu().numpy(), r.names)
+            for r in results
+        ]
+
+
+class OnnxBackend:
+    def __init__(self, model_path, intra_op_threads=ONNX_INTRA_OP_THREADS, conf=DETECTOR_CONF, iou=DETECTOR_IOU):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads > 0:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        shape = self.session.get_inputs()[0].shape  # [1, 3, h, w]，动态尺寸时为字符串
+        self.fixed_shape = tuple(shape[2:]) if all(isinstance(d, int) for d in shape[2:]) else None
+        meta = self.session.get_modelmeta().custom_metadata_map
+        self.names = ast.literal_eval(meta["names"]) if "names" in meta else {}  # ultralytics 导出时写入的类别名
+        self.conf = conf
+        self.iou = iou
+
+    def preprocess(self, ims: list, imgsz=None):
+        """
+        letterbox 并组成 (N, 3, h, w) 的输入
+        与 ultralytics 相同: 所有图片尺寸相同时只填充到 stride 的整数倍，否则填充到 imgsz 的正方形
+        """
+        if self.fixed_shape is not None:
+            letterboxed = [letterbox(im, self.fixed_shape) for im in ims]
+        else:
+            auto = len({im.shape for im in ims}) == 1
+            letterboxed = [letterbox(im, imgsz or YOLO_IMGSZ, auto=auto) for im in ims]
+        blob = np.stack([padded.transpose(2, 0, 1) for padded, _, _ in letterboxed]).astype(np.float32) / 255
+        return blob, [(ratio, pad) for _, ratio, pad in letterboxed]
+
+    def predict(self, images: list, imgsz=None) -> list:
+        """images 为 PIL.Image 或 RGB 数组的列表"""
+        ims = [to_rgb_array(image) for image in images]
+        if not ims:
+            return []
+        if self.fixed_shape is not None:
+            # 固定尺寸导出的模型 batch 维也固定为 1，逐张推理
+            outputs, params = [], []
+            for im in ims:
+                blob, (param,) = self.preprocess([im])
+                outputs.append(self.session.run(None, {self.input_name: blob})[0][0])
+                params.append(param)
+        else:
+            blob, params = self.preprocess(ims, imgsz)
+            outputs = self.session.run(None, {self.input_name: blob})[0]
+        detections = []
+        for im, output, (ratio, pad) in zip(ims, outputs, params):
+            boxes, scores, cls = postprocess(output, ratio, pad, im.shape, self.conf, self.iou)
+            detections.append(Detections(boxes, scores, cls, self.names))
+        return detections
+
+
+def export_onnx(model_path, imgsz=YOLO_IMGSZ, dynamic=True, opset=None) -> str:
+    """将 ultralytics 的 .pt 权重导出为 .onnx，返回导出的文件路径"""
+    from ultralytics import YOLO
+    kwargs = {} if opset is None else {"opset": opset}
+    return YOLO(model_path).export(format="onnx", imgsz=imgsz, dynamic=dynamic, simplify=True, **kwargs)
+
+
+def make_backend(model_path, backend=DETECTOR_BACKEND):
+    """backend 为 "auto" 时按文件后缀选择: .onnx 使用 ONNX Runtime，其余使用 ultralytics"""
+    if backend == "auto":
+        backend = "onnx" if os.path.splitext(model_path)[1] == ".onnx" else "ultralytics"
+    if backend == "onnx":
+        return OnnxBackend(model_path)
+    if backend == "ultralytics":
+        return UltralyticsBackend(model_path)
+    raise ValueError(f"unknown detector backend: {backend}")
+
+
+def box_iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """(n, 4) 与 (m, 4) 的 xyxy 两两之间的 IoU"""
+    w = np.clip(np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0]), 0, None)
+    h = np.clip(np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1]), 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return w * h / (area_a[:, None] + area_b[None, :] - w * h + 1e-9)
+
+
+def compare_detections(refs: list, dets: list, iou_threshold=0.9):
+    """
+    一致性检查: 以 refs 为准，统计同类别且 IoU 超过阈值的框
+    :return: (参考框数, 匹配的框数, 匹配框的最大坐标差)
+    """
+    num_ref, num_matched, max_diff = 0, 0, 0.0
+    for ref, det in zip(refs, dets):
+        num_ref += len(ref)
+        if len(ref) == 0 or len(det) == 0:
+            continue
+        iou = box_iou_matrix(ref.xyxy, det.xyxy)
+        best = iou.argmax(axis=1)
+        matched = (iou[np.arange(len(ref)), best] > iou_threshold) & (ref.cls == det.cls[best])
+        num_matched += int(matched.sum())
+        if matched.any():
+            max_diff = max(max_diff, float(np.abs(ref.xyxy[matched] - det.xyxy[best[matched]]).max()))
+    return num_ref, num_matched, max_diff
+
+
+if __name__ == "__main__":
+    import glob
+    import sys
+    import time
+    from PIL import Image
+
+    # 一致性检查: python -m app.yang.yang_detector_backends [best.pt] [图片目录]
+    # 同样的检查见 test_yang_detector_backends.py (YANG_DETECTOR_MODEL / YANG_DETECTOR_IMAGES)
+    model_path = sys.argv[1] if len(sys.argv) > 1 else "runs/detect/train3/weights/best.pt"
+    image_dir = sys.argv[2] if len(sys.argv) > 2 else "datasets/yang_v1/images/val"
+    images = [Image.open(path).convert("RGB") for path in sorted(glob.glob(os.path.join(image_dir, "*.png")))[:50]]
+    onnx_path = export_onnx(model_path)
+    torch_backend, onnx_backend = UltralyticsBackend(model_path), OnnxBackend(onnx_path)
+
+    timings = {"ultralytics": 0.0, "onnx": 0.0, "onnx (batch)": 0.0}
+    refs, dets = [], []
+    for image in images:
+        tic = time.time()
+        refs.append(torch_backend.predict([image])[0])
+        timings["ultralytics"] += time.time() - tic
+        tic = time.time()
+        dets.append(onnx_backend.predict([image])[0])
+        timings["onnx"] += time.time() - tic
+    tic = time.time()
+    batch_dets = onnx_backend.predict(images)
+    timings["onnx (batch)"] += time.time() - tic
+    num_ref, num_matched, max_diff = compare_detections(refs, dets)
+    print(f"images: {len(images)} boxes: {num_ref} matched: {num_matched} max coord diff: {max_diff:.2f}px")
+    num_ref, num_matched, max_diff = compare_detections(refs, batch_dets)
+    print(f"batch: boxes: {num_ref} matched: {num_matched} max coord diff: {max_diff:.2f}px")
+    for name, total in timings.items():
+        print(f"{name}: {total / max(len(images), 1) * 1000:.1f} ms/image")
@@ -1,46 +1,107 @@
 from __future__ import annotations
-from collections import Counter
+
+import numpy as np
 
 from app.yang.yang_constants import CARD_KINDS, RWD_NON_CRITICAL_ACTION, RWD_IS_CRITICAL_ACTION
 
 class YangHiddenState:
+    """
+    不可变的 hidden state
+
+    pool 保存为 (CARD_KINDS, 3) 的只读整数数组，每行为 [total_num, total_queue_num, uncover_num]，
+    另外保存 pool_available_choice, queue_empty_slot, score 三个标量。
+    节点之间可以直接共享同一个对象，无需 deepcopy；
+    rollout 需要可原地修改的 dict 时调用 to_dict() 得到一份新的副本，
+    向量化 rollout 引擎可直接读取 pool_array。
+    """
     INIT_CARDS = 5 * 3  # each 5 copy(s)
+    __slots__ = ("_pool", "_available_choice", "_empty_slot", "_score")
 
     def __init__(self, hstate: dict):
-        self._hstate = hstate
-    
+        pool = hstate["pool"]
+        self._set(
+            np.array([pool[k] for k in range(len(pool))], dtype=np.int64).reshape(-1, 3),
+            hstate["pool_available_choice"], hstate["queue_empty_slot"], hstate["score"],
+        )
+
+    def _set(self, pool: np.ndarray, available_choice, empty_slot, score):
+        pool.setflags(write=False)
+        self._pool = pool
+        self._available_choice = int(available_choice)
+        self._empty_slot = int(empty_slot)
+        self._score = score
+
+    @classmethod
+    def from_arrays(cls, pool: np.ndarray, available_choice, empty_slot, score) -> YangHiddenState:
+        """直接由 (CARD_KINDS, 3) 的数组创建，数组的所有权转移给新对象"""
+        hstate = cls.__new__(cls)
+        hstate._set(pool, available_choice, empty_slot, score)
+        return hstate
+
+    def to_dict(self) -> dict:
+        """返回 dict 形式的副本，可被 test_rollout.step 原地修改"""
+        return {
+            "pool": dict(enumerate(self._pool.tolist())),
+            "pool_available_choice": self._available_choice,
+            "queue_empty_slot": self._empty_slot,
+            "score": self._score,
+        }
+
+    @property
+    def _hstate(self):
+        # 兼容旧代码的只读访问，每次返回新的 dict
+        return self.to_dict()
+
+    @property
+    def pool_array(self) -> np.ndarray:
+        """只读的 (CARD_KINDS, 3) 数组"""
+        return self._pool
+
     @property
     def available_choice_num(self):
-        return self._hstate["pool_available_choice"]
+        return self._available_choice
 
     @property
     def remaining_slot_num(self):
-        return self._hstate["queue_empty_slot"]
+        return self._empty_slot
     
     @property
     def score(self):
-        return self._hstate["score"]
+        return self._score
 
     def get_each_uncovered_cards(self):
         """
         返回每个种类的未翻牌数
         """
-        pool = self._hstate["pool"]
-        return [pool[k][2] for k in range(CARD_KINDS)]
+        return self._pool[:, 2].tolist()
 
     def get_each_remaining_cards(self):
         """
         返回每个种类的剩余牌数 + 场上存在牌数
         """
-        pool = self._hstate["pool"]
-        return [pool[k][0] + pool[k][2] for k in range(CARD_KINDS)]
+        return (self._pool[:, 0] + self._pool[:, 2]).tolist()
     
     def get_each_in_queue_cards(self):
         """
         返回每个种类的在队列中的牌数
         """
-        pool = self._hstate["pool"]
-        return [pool[k][1] for k in range(CARD_KINDS)]
+        return self._pool[:, 1].tolist()
+
+    @staticmethod
+    def _count_labels(pool_cards, queue_cards):
+        """用 np.bincount 统计每种卡牌的 (出现总数, 队列中的数量)"""
+        labels = np.array([c[0] for c in pool_cards] + [c[0] for c in queue_cards], dtype=np.int64)
+        appear = np.bincount(labels, minlength=CARD_KINDS)
+        in_queue = np.bincount(labels[len(pool_cards):], minlength=CARD_KINDS)
+        return appear, in_queue
+
+    @staticmethod
+    def _pool_from_columns(total, in_queue, uncovered) -> np.ndarray:
+        pool = np.empty((CARD_KINDS, 3), dtype=np.int64)
+        pool[:, 0] = total
+        pool[:, 1] = in_queue
+        pool[:, 2] = uncovered
+        return pool
 
     @classmethod
     def from_new_cards(cls, pool_cards: list, queue_cards: list, pending_actions, old_score=0, each_uncovered_cards=None):
@@ -48,27 +109,20 @@ class YangHiddenState:
         从全新局面创建 HState, 或者继承分数和剩余牌数
         """
         if each_uncovered_cards is None:
-            each_uncovered_cards = [cls.INIT_CARDS for k in range(CARD_KINDS)]
+            each_uncovered_cards = cls.INIT_CARDS
         queue_cards.extend(pending_actions)
-        cnt = Counter([c[0] for c in pool_cards + queue_cards])
-        pool = {}
-        # all cards
-        for k in range(CARD_KINDS):
-            card_uncovered_num = each_uncovered_cards[k]
-            if k in cnt:
-                pool[k] = [cnt[k], 0, card_uncovered_num]
-            else:
-                pool[k] = [0, 0, card_uncovered_num]
+        appear, in_queue = cls._count_labels(pool_cards, queue_cards)
+        pool = cls._pool_from_columns(appear, in_queue, each_uncovered_cards)
+
+        # queue 中的三消: 每满 3 张消除一次
         reduced_num = 0
-        for c in queue_cards:
-            pool[c[0]][1] += 1
-            # queue 中的三消
-            while pool[c[0]][1] >= 3:
-                pool[c[0]][0] -= 3
-                pool[c[0]][1] -= 3
-                pool[c[0]][2] -= 3
-                reduced_num += 3
-                print("!! 三消 ", c[0])
+        if len(queue_cards) >= 3 and in_queue.max() >= 3:
+            cleared = in_queue // 3
+            for k in np.nonzero(cleared)[0]:
+                for _ in range(cleared[k]):
+                    print("!! 三消 ", k)
+            pool -= 3 * cleared[:, None]
+            reduced_num = 3 * int(cleared.sum())
 
         # action score
         action_rwd = 0
@@ -77,73 +131,28 @@ class YangHiddenState:
             action_rwd += RWD_NON_CRITICAL_ACTION if not is_critical_action else RWD_IS_CRITICAL_ACTION
 
         empty_slot_num = 7 - len(queue_cards) + reduced_num
-        hstate = {
-            "pool": pool,
-            "pool_available_choice": len(pool_cards),
-            "queue_empty_slot": empty_slot_num, 
-            "score": reduced_num + old_score + action_rwd,
-        }
-
-        return cls(hstate)
+        return cls.from_arrays(pool, len(pool_cards), empty_slot_num, reduced_num + old_score + action_rwd)
 
-    def continue_from_cards(self, pool_cards, queue_cards, pending_actions) -> YangHiddenState:
+    def continue_from_cards(self, pool_cards, queue_cards, pending_actions=()) -> YangHiddenState:
         """
         从一个已有的局面创建 HState, 继承分数和剩余牌数
         """
-        each_reamining_num = self.get_each_remaining_cards()
-        each_in_queue_num = self.get_each_in_queue_cards()
         prior_hstate = YangHiddenState.from_new_cards(pool_cards, queue_cards, pending_actions)
 
         empty_slot_num = prior_hstate.remaining_slot_num
         
         if self.remaining_slot_num == empty_slot_num:
             return self
+
+        each_reamining_num = self._pool[:, 0] + self._pool[:, 2]
+        appear, in_queue = self._count_labels(pool_cards, queue_cards)
         
         if self.remaining_slot_num > empty_slot_num:
             # 可用格子数减少了，认为没有消除
-            each_reamining_num = self.get_each_remaining_cards()
-
-            cnt_all = Counter([c[0] for c in pool_cards + queue_cards])
-            cnt_queue = Counter([c[0] for c in queue_cards])
-            pool = {}
-            for k in range(CARD_KINDS):
-                appear_num = cnt_all.get(k, 0)
-                in_queue_num = cnt_queue.get(k, 0)
-                pool[k] = [
-                    appear_num,
-                    in_queue_num,
-                    each_reamining_num[k] - appear_num,
-                ]
-            hstate = {
-                "pool": pool,
-                "pool_available_choice": len(pool_cards),
-                "queue_empty_slot": empty_slot_num, 
-                "score": self.score,
-            }
-            return YangHiddenState(hstate)
-        
-        if self.remaining_slot_num < empty_slot_num:
-            # 可用格子数增加了，认为消除了
-            each_reamining_num = self.get_each_remaining_cards()
-            each_in_queue_num = self.get_each_in_queue_cards()
-
-            cnt_all = Counter([c[0] for c in pool_cards + queue_cards])
-            cnt_queue = Counter([c[0] for c in queue_cards])
-            pool = {}
-            for k in range(CARD_KINDS):
-                appear_num = cnt_all.get(k, 0)
-                in_queue_num = cnt_queue.get(k, 0)
-                if in_queue_num < each_in_queue_num[k]:
-                    each_reamining_num[k] -= 3  # 这时 3 张牌消除
-                pool[k] = [
-                    appear_num,
-                    in_queue_num,
-                    each_reamining_num[k] - appear_num,
-                ]
-            hstate = {
-                "pool": pool,
-                "pool_available_choice": len(pool_cards),
-                "queue_empty_slot": empty_slot_num, 
-                "score": self.score + 1,
-            }
-            return YangHiddenState(hstate)
\ No newline at end of file
+            score = self.score
+        else:
+            # 可用格子数增加了，认为消除了: 队列中数量减少的种类有 3 张牌消除
+            each_reamining_num = each_reamining_num - 3 * (in_queue < self._pool[:, 1])
+            score = self.score + 1
+        pool = self._pool_from_columns(appear, in_queue, each_reamining_num - appear)
+        return YangHiddenState.from_arrays(pool, len(pool_cards), empty_slot_num, score)
@@ -0,0 +1,247 @@
+"""
+检测模型的 INT8 静态量化
+
+流程: .pt -> 动态尺寸的 FP32 .onnx -> 用 datasets/yang_v*/images 中的帧校准 -> INT8 (QDQ) .onnx
+并在验证集上对比 FP32 与 INT8 的 mAP@0.5、各类别 AP 以及 CPU 推理耗时。
+mAP 与 ultralytics val 相同在极低的置信度阈值下计算；耗时则在实际使用的 DETECTOR_CONF 下单独测量，
+否则大量低置信度的候选框会让 NumPy 的解码和 NMS 占据大部分时间，掩盖模型本身的加速。
+导出为动态尺寸: 固定尺寸的模型会把 recognize_region 的区域放大到整图的输入尺寸，失去局部识别的收益。
+得到的 .onnx 可直接作为 YangYOLORecognizer 的 model_path (按后缀自动使用 OnnxBackend)。
+"""
+import glob
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from app.yang.yang_constants import CARD_KINDS, DETECTOR_CONF, YOLO_IMGSZ
+from app.yang.yang_detector_backends import OnnxBackend, export_onnx, letterbox
+
+
+def dataset_images(dataset_glob="datasets/yang_v*", split="train"):
+    """YangReplayProcessor 输出的 yolo 目录结构: {dataset}/images/{split}/*.png"""
+    return sorted(glob.glob(os.path.join(dataset_glob, "images", split, "*.png")))
+
+
+def label_path(image_path):
+    """images/{split}/x.png -> labels/{split}/x.txt"""
+    image_dir, filename = os.path.split(image_path)
+    split_dir, split = os.path.split(image_dir)
+    dataset_dir = os.path.dirname(split_dir)
+    return os.path.join(dataset_dir, "labels", split, os.path.splitext(filename)[0] + ".txt")
+
+
+def load_labels(image_path, width, height):
+    """读取 yolo 格式标注 (class cx cy w h, 归一化)，返回 (classes, xyxy)"""
+    path = label_path(image_path)
+    if not os.path.exists(path):
+        return np.zeros(0, dtype=np.int64), np.zeros((0, 4))
+    rows = np.loadtxt(path, ndmin=2)
+    if len(rows) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, 4))
+    cx, cy, w, h = rows[:, 1] * width, rows[:, 2] * height, rows[:, 3] * width, rows[:, 4] * height
+    return rows[:, 0].astype(np.int64), np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+
+
+class YangCalibrationReader:
+    """
+    onnxruntime.quantization 的校准数据读取器
+    与 OnnxBackend 对动态尺寸模型的前处理一致 (letterbox 到 imgsz 并只填充到 stride 的整数倍, RGB, /255)
+    """
+    def __init__(self, image_paths, input_name, imgsz=YOLO_IMGSZ):
+        self.image_paths = list(image_paths)
+        self.input_name = input_name
+        self.imgsz = imgsz
+        self._idx = 0
+
+    def get_next(self):
+        if self._idx >= len(self.image_paths):
+            return None
+        im = np.asarray(Image.open(self.image_paths[self._idx]).convert("RGB"))
+        self._idx += 1
+        padded, _, _ = letterbox(im, self.imgsz, auto=True)
+        blob = np.ascontiguousarray(padded.transpose(2, 0, 1)[None], dtype=np.float32) / 255
+        return {self.input_name: blob}
+
+    def rewind(self):
+        self._idx = 0
+
+
+def quantize_int8(fp32_path, int8_path, calib_images, imgsz=YOLO_IMGSZ, per_channel=True):
+    """对 FP32 .onnx 做静态量化 (QDQ 格式, 激活 uint8, 权重 int8)，保留 ultralytics 写入的元数据"""
+    import onnx
+    from onnxruntime.quantization import CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    class _Reader(YangCalibrationReader, CalibrationDataReader):
+        pass
+
+    prep_path = os.path.splitext(int8_path)[0] + "_prep.onnx"
+    quant_pre_process(fp32_path, prep_path)
+    input_name = onnx.load(prep_path).graph.input[0].name
+    quantize_static(
+        prep_path, int8_path, _Reader(calib_images, input_name, imgsz),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=per_channel,
+        calibrate_method=CalibrationMethod.MinMax,
+    )
+    os.remove(prep_path)
+
+    # 量化后的模型不一定带有 names 等元数据，从 FP32 模型复制
+    fp32_model, int8_model = onnx.load(fp32_path), onnx.load(int8_path)
+    existing = {prop.key for prop in int8_model.metadata_props}
+    for prop in fp32_model.metadata_props:
+        if prop.key not in existing:
+            int8_model.metadata_props.add(key=prop.key, value=prop.value)
+    onnx.save(int8_model, int8_path)
+    return int8_path
+
+
+def _iou(box, boxes):
+    w = np.clip(np.minimum(box[2], boxes[:, 2]) - np.maximum(box[0], boxes[:, 0]), 0, None)
+    h = np.clip(np.minimum(box[3], boxes[:, 3]) - np.maximum(box[1], boxes[:, 1]), 0, None)
+    inter = w * h
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / (area + areas - inter + 1e-9)
+
+
+def average_precision(recall, precision):
+    """101 点插值的 AP (与 COCO / ultralytics 相同)"""
+    mrec = np.concatenate([[0.0], recall, [1.0]])
+    mpre = np.concatenate([[1.0], precision, [0.0]])
+    mpre = np.flip(np.maximum.accumulate(np.flip(mpre)))
+    x = np.linspace(0, 1, 101)
+    y = np.interp(x, mrec, mpre)
+    return float(np.sum((x[1:] - x[:-1]) * (y[1:] + y[:-1]) / 2))  # 梯形积分
+
+
+def evaluate(backend, image_paths, iou_threshold=0.5):
+    """
+    在带标注的图片上评估检测模型的精度 (不计时，耗时见 measure_latency)
+    :return: dict(map50, ap50 (每类别, 无标注的类别为 nan), num_gt)
+    """
+    records = {k: [] for k in range(CARD_KINDS)}  # 类别 -> [(置信度, 是否命中)]
+    num_gt = np.zeros(CARD_KINDS, dtype=np.int64)
+    for path in image_paths:
+        image = Image.open(path).convert("RGB")
+        gt_cls, gt_boxes = load_labels(path, *image.size)
+        det = backend.predict([image])[0]
+        for k in range(CARD_KINDS):
+            gt_k = gt_boxes[gt_cls == k]
+            num_gt[k] += len(gt_k)
+            used = np.zeros(len(gt_k), dtype=bool)
+            det_k = np.nonzero(det.cls == k)[0]
+            for i in det_k[np.argsort(-det.conf[det_k])]:
+                hit = False
+                if len(gt_k) > 0:
+                    iou = _iou(det.xyxy[i], gt_k)
+                    iou[used] = 0
+                    j = int(iou.argmax())
+                    if iou[j] >= iou_threshold:
+                        used[j] = True
+                        hit = True
+                records[k].append((det.conf[i], hit))
+
+    ap50 = np.full(CARD_KINDS, np.nan)
+    for k in range(CARD_KINDS):
+        if num_gt[k] == 0:
+            continue
+        if not records[k]:
+            ap50[k] = 0.0
+            continue
+        conf, hit = map(np.array, zip(*sorted(records[k], key=lambda r: -r[0])))
+        tp = np.cumsum(hit)
+        fp = np.cumsum(~hit)
+        ap50[k] = average_precision(tp / num_gt[k], tp / (tp + fp))
+    return {
+        "map50": float(np.nanmean(ap50)) if num_gt.any() else float("nan"),
+        "ap50": ap50,
+        "num_gt": num_gt,
+    }
+
+
+def measure_latency(backend, image_paths, warmup=3):
+    """
+    测量单张图片的推理耗时，backend 应使用实际的置信度阈值 (DETECTOR_CONF)
+    :return: dict(ms_per_image: predict 的整体耗时, ms_session: 其中 session.run 的耗时)
+    """
+    elapsed, elapsed_session = 0.0, 0.0
+    for i, path in enumerate(image_paths):
+        image = Image.open(path).convert("RGB")
+        if i < warmup:  # 预热: 首次推理包含内存分配等开销
+            backend.predict([image])
+        blob, _ = backend.preprocess([np.asarray(image)])
+        tic = time.perf_counter()
+        backend.session.run(None, {backend.input_name: blob})
+        elapsed_session += time.perf_counter() - tic
+        tic = time.perf_counter()
+        backend.predict([image])
+        elapsed += time.perf_counter() - tic
+    num = max(len(image_paths), 1)
+    return {"ms_per_image": elapsed / num * 1000, "ms_session": elapsed_session / num * 1000}
+
+
+def print_report(fp32_result, int8_result, names=None):
+    print(f"{'':>12} {'FP32':>8} {'INT8':>8} {'diff':>8}")
+    print(f"{'mAP@0.5':>12} {fp32_result['map50']:8.4f} {int8_result['map50']:8.4f} "
+          f"{int8_result['map50'] - fp32_result['map50']:+8.4f}")
+    for key, title in (("ms_per_image", "ms/image"), ("ms_session", "ms/run")):
+        print(f"{title:>12} {fp32_result[key]:8.1f} {int8_result[key]:8.1f} "
+              f"{fp32_result[key] / max(int8_result[key], 1e-9):7.2f}x")
+    print("per-class AP@0.5:")
+    for k in range(CARD_KINDS):
+        if fp32_result["num_gt"][k] == 0:
+            continue
+        name = names.get(k, k) if names else k
+        a, b = fp32_result["ap50"][k], int8_result["ap50"][k]
+        print(f"{str(name):>12} {a:8.4f} {b:8.4f} {b - a:+8.4f}  (n={fp32_result['num_gt'][k]})")
+
+
+if __name__ == "__main__":
+    import argparse
+    import random
+
+    parser = argparse.ArgumentParser(description="INT8 static quantization of the card detector")
+    parser.add_argument("--model", type=str, default="runs/detect/train3/weights/best.pt", help=".pt or FP32 .onnx")
+    parser.add_argument("--datasets", type=str, default="datasets/yang_v*", help="yolo datasets written by YangReplayProcessor")
+    parser.add_argument("--calib_num", type=int, default=200, help="number of calibration frames")
+    parser.add_argument("--eval_num", type=int, default=500, help="number of validation frames, 0 for all")
+    parser.add_argument("--imgsz", type=int, default=YOLO_IMGSZ)
+    parser.add_argument("--threads", type=int, default=0, help="onnxruntime intra-op threads, 0 for default")
+    parser.add_argument("--eval_conf", type=float, default=0.001,
+                        help="confidence threshold for mAP, low like ultralytics val so mAP is comparable")
+    parser.add_argument("--latency_num", type=int, default=100,
+                        help="number of validation frames for timing, measured at DETECTOR_CONF")
+    args = parser.parse_args()
+
+    fp32_path = args.model
+    if not fp32_path.endswith(".onnx"):
+        fp32_path = export_onnx(args.model, imgsz=args.imgsz, dynamic=True)
+    int8_path = os.path.splitext(fp32_path)[0] + "_int8.onnx"
+
+    random.seed(0)
+    calib_images = dataset_images(args.datasets, "train")
+    calib_images = random.sample(calib_images, min(args.calib_num, len(calib_images)))
+    print(f"calibrating with {len(calib_images)} frames ...")
+    quantize_int8(fp32_path, int8_path, calib_images, imgsz=args.imgsz)
+    print("saved to", int8_path)
+
+    eval_images = dataset_images(args.datasets, "val")
+    if args.eval_num > 0:
+        eval_images = eval_images[:args.eval_num]
+    print(f"evaluating on {len(eval_images)} frames (conf={args.eval_conf}) ...")
+    results = []
+    for path in (fp32_path, int8_path):
+        backend = OnnxBackend(path, intra_op_threads=args.threads, conf=args.eval_conf)
+        results.append(evaluate(backend, eval_images))
+    print(f"timing on {min(args.latency_num, len(eval_images))} frames (conf={DETECTOR_CONF}) ...")
+    for path, result in zip((fp32_path, int8_path), results):
+        backend = OnnxBackend(path, intra_op_threads=args.threads, conf=DETECTOR_CONF)
+        result.update(measure_latency(backend, eval_images[:args.latency_num]))
+    if backend.fixed_shape is not None:
+        print(f"[警告] 模型为固定输入尺寸 {backend.fixed_shape}，ROI_REDETECT 将退回整图识别")
+    print_report(*results, backend.names)
@@ -1,10 +1,21 @@
-from copy import deepcopy
+import os
 
 from app.yang.logic.yang_board_state import YangBoardState
 from app.yang.logic.yang_tree_node import YangTreeNode
+from app.yang.logic.yang_endgame import YangEndgameEvaluator
+from app.yang.logic.yang_rollout import (
+    VarianceReducedRollout, batch_rollout, hstate_payload, seed_rollout_rng, step_rollout_worker,
+)
+from app.yang.logic.yang_transition import cards_overlap, match_cards
+from app.yang.logic.yang_value_model import YangValueEstimator, save_search_states
 from app.yang.yang_constants import (
     MAIN_AREA_POSITION,
-    MCTS_RUN_ITERATION, RWD_NON_CRITICAL_ACTION, MCTS_ROLLOUT_BATCH_SIZE, RWD_IS_CRITICAL_ACTION
+    MCTS_RUN_ITERATION, MCTS_ROLLOUT_BATCH_SIZE,
+    MCTS_EXPAND_BATCH_SIZE, MCTS_TRANSPOSITION, MCTS_VECTORIZED_ROLLOUT,
+    MCTS_ROLLOUT_PROCESSES, MCTS_ROLLOUT_SEED, MCTS_ROOT_PARALLEL_WORKERS, SYMBOLIC_TRANSITION,
+    MCTS_TREE_PARALLEL_THREADS, MCTS_TIME_BUDGET, MCTS_NODE_BUDGET, MCTS_REUSE_TREE, MCTS_COMPACT_STORE,
+    ENDGAME_EXACT, VALUE_ESTIMATOR, VALUE_MODEL_PATH, VALUE_LOG_SEARCH_STATES, VALUE_STATE_LOG_DIR,
+    MCTS_COMMON_RANDOM_NUMBERS, MCTS_ANTITHETIC_ROLLOUT, MCTS_ROLLOUT_TARGET_SE, MCTS_ROLLOUT_MAX_ITERATIONS,
 )
 
 from controller.react.base_react import BaseReact
@@ -13,46 +24,144 @@ from controller.react.gui_action import GUIAction
 from controller.react.mouse_action import ClickAction, DragAction
 
 from search.mcts import MCTS
-from test_rollout import step
+from search.parallel_mcts import ParallelMCTS, TreeParallelMCTS
+from search.rollout_executor import ProcessPoolRolloutExecutor
+from test_rollout import rollout_fast
 
 
 def fast_rollout_policy(node: YangTreeNode):
     # looping num is outside the loop
-    hstate_dict = node.state.get_hstate()._hstate
-    if hasattr(node.state, "pending_action") and node.state.pending_action:
-        pending_action = node.state.pending_action
-        is_critical_action = pending_action[7]
-        action_rwd = RWD_NON_CRITICAL_ACTION if not is_critical_action else RWD_IS_CRITICAL_ACTION
-    else:
-        action_rwd = 0
-    hstate = deepcopy(hstate_dict)
-    while not (is_terminal := step(hstate)):
-        pass
-        # print(".", end="")
+    # 所有 pending action 的奖励已经计入 hstate 的 score (YangHiddenState.from_new_cards)
+    hstate = node.state.get_hstate().to_dict()  # 新的可修改副本
+    # 查表版本，结果与逐步调用 step 逐位一致
+    rollout_fast(hstate)
 
     # print("W" if hstate["queue_empty_slot"] == 7 else "L", f"Score: {hstate['score']}")
     # total_score += hstate["score"]
-    return hstate["score"] + action_rwd
+    return hstate["score"]
+
+
+def vectorized_rollout_policy(node: YangTreeNode, batch_size):
+    # 一次性推进 batch_size 局 rollout, 返回每局的分数
+    return batch_rollout(node.state.get_hstate(), batch_size)
+
+
+def make_rollout_policy():
+    """按配置选择 rollout 策略"""
+    if not MCTS_VECTORIZED_ROLLOUT:
+        return fast_rollout_policy
+    if MCTS_COMMON_RANDOM_NUMBERS or MCTS_ANTITHETIC_ROLLOUT:
+        return VarianceReducedRollout(
+            common_random_numbers=MCTS_COMMON_RANDOM_NUMBERS, antithetic=MCTS_ANTITHETIC_ROLLOUT
+        )
+    return vectorized_rollout_policy
 
 
 class YangReact(BaseReact):
     def __init__(self):
-        pass
+        self.mcts = None
+        self._last_child = None  # 上一步选择的子节点，用于复用子树
+        self.rollout_executor = None
+        # 残局精确求值器，记忆化表在整个对局中共享
+        self.endgame_evaluator = YangEndgameEvaluator() if ENDGAME_EXACT else None
+        # 学习得到的价值函数，需要先运行 yang_value_model.py 训练并保存模型
+        self.value_estimator = None
+        if VALUE_ESTIMATOR and os.path.exists(VALUE_MODEL_PATH):
+            self.value_estimator = YangValueEstimator.from_file(VALUE_MODEL_PATH)
+        if MCTS_ROLLOUT_PROCESSES > 0:
+            # 进程池在整个对局中常驻，避免每一步重新创建进程
+            self.rollout_executor = ProcessPoolRolloutExecutor(
+                hstate_payload, step_rollout_worker,
+                processes=MCTS_ROLLOUT_PROCESSES, seed=MCTS_ROLLOUT_SEED
+            )
+        self.parallel_mcts = None
+        if MCTS_ROOT_PARALLEL_WORKERS > 0 and SYMBOLIC_TRANSITION:
+            # 子进程中没有检测模型，因此仅在符号化推算模式下启用
+            self.parallel_mcts = ParallelMCTS(
+                num_workers=MCTS_ROOT_PARALLEL_WORKERS,
+                seed=MCTS_ROLLOUT_SEED,
+                seed_fn=seed_rollout_rng,
+                rollout_policy=make_rollout_policy(),
+                rollout_iterations=MCTS_ROLLOUT_BATCH_SIZE,
+                node_clz=YangTreeNode,
+                transposition=MCTS_TRANSPOSITION,
+                batched_rollout=MCTS_VECTORIZED_ROLLOUT,
+                compact_store=MCTS_COMPACT_STORE,
+                exact_evaluator=self.endgame_evaluator,
+                value_estimator=self.value_estimator,
+                rollout_target_se=MCTS_ROLLOUT_TARGET_SE,
+                rollout_max_iterations=MCTS_ROLLOUT_MAX_ITERATIONS,
+            )
 
     def react(self, result: MaybeResult) -> GUIAction:
         state = result.result  # type: YangBoardState
-        root = YangTreeNode(state=state)
-
-        # Construct Monte Carlo Tree Search
-        self.mcts = MCTS(
-            root,
-            rollout_policy=fast_rollout_policy,
-            rollout_iterations=MCTS_ROLLOUT_BATCH_SIZE,
-            node_clz=YangTreeNode
-        )
-        child_node = self.mcts.run(MCTS_RUN_ITERATION)
+        # 设置了时间预算时按固定响应时间搜索，否则按迭代次数
+        budget = {
+            "iterations": MCTS_RUN_ITERATION if MCTS_TIME_BUDGET is None else None,
+            "time_budget": MCTS_TIME_BUDGET,
+            "node_budget": MCTS_NODE_BUDGET,
+        }
+
+        if self.parallel_mcts is not None:
+            state.get_hstate()  # 在主进程中完成识别，子进程只做符号化推算
+            best_action = self.parallel_mcts.run(YangTreeNode(state=state), **budget)
+            print(self.parallel_mcts.stats())
+            print(f"MCTS iterations done: {self.parallel_mcts.iterations_done}")
+            return YangTreeNode(state=state, action=best_action)
+
+        reused_root = self._find_reusable_root(state) if MCTS_REUSE_TREE else None
+        if reused_root is not None:
+            # 换成新识别的局面，新翻出的卡牌成为根节点未尝试的动作 (在 reroot 之前，置换表按新局面登记)
+            old_actions = list(reused_root.available_actions)
+            reused_root.replace_state(state, self.mcts.child_actions.get(reused_root, []))
+            _, new_actions = match_cards(old_actions, reused_root.available_actions)
+            # 提升上一步选择的子节点为根节点，其余子树被丢弃
+            self.mcts.reroot(reused_root)
+            if budget["iterations"] is not None:
+                # 子树已有的访问计入本步的迭代预算，新翻出的卡牌至少各尝试一次
+                budget["iterations"] = max(
+                    budget["iterations"] - reused_root.visits, len(reused_root.untried_actions), 1
+                )
+            print(f"复用上一步的子树: visits={reused_root.visits} nodes={self.mcts.num_nodes} "
+                  f"revealed actions={len(new_actions)} untried={len(reused_root.untried_actions)}")
+        else:
+            root = YangTreeNode(state=state)
+            # Construct Monte Carlo Tree Search
+            mcts_kwargs = {}
+            mcts_clz = MCTS
+            if MCTS_TREE_PARALLEL_THREADS > 0:
+                mcts_clz = TreeParallelMCTS
+                mcts_kwargs["num_threads"] = MCTS_TREE_PARALLEL_THREADS
+            self.mcts = mcts_clz(
+                root,
+                rollout_policy=make_rollout_policy(),
+                rollout_iterations=MCTS_ROLLOUT_BATCH_SIZE,
+                node_clz=YangTreeNode,
+                expand_batch_size=MCTS_EXPAND_BATCH_SIZE,
+                transposition=MCTS_TRANSPOSITION and mcts_clz is MCTS,  # 树并行不支持置换表
+                batched_rollout=MCTS_VECTORIZED_ROLLOUT,
+                rollout_executor=self.rollout_executor,
+                compact_store=MCTS_COMPACT_STORE,
+                exact_evaluator=self.endgame_evaluator,
+                value_estimator=self.value_estimator,
+                rollout_target_se=MCTS_ROLLOUT_TARGET_SE,
+                rollout_max_iterations=MCTS_ROLLOUT_MAX_ITERATIONS,
+                **mcts_kwargs,
+            )
+        child_node = self.mcts.run(**budget)
+        self._last_child = child_node
 
         print("node", child_node, child_node.action)
+        print(f"MCTS iterations done: {self.mcts.iterations_done}, nodes: {self.mcts.num_nodes}")
+        print("recognition cache:", state.cache.stats())
+        if self.endgame_evaluator is not None:
+            print("endgame exact evaluations:", self.endgame_evaluator.evaluations)
+        if self.value_estimator is not None:
+            print("value estimations:", self.value_estimator.evaluations)
+        if VALUE_LOG_SEARCH_STATES:
+            # 记录本次搜索访问过的局面，作为价值函数的训练数据
+            path = save_search_states(self.mcts.children.keys(), VALUE_STATE_LOG_DIR)
+            print("search states saved to", path)
         
         return child_node
 
@@ -60,6 +169,26 @@ class YangReact(BaseReact):
         # else:
         #     return BaseReact.GUIAction.RETRY
 
+    def _find_reusable_root(self, state: YangBoardState):
+        """
+        判断新识别的局面是否与上一步选择的子节点一致，一致则返回该子节点
+
+        推算的 pool 中的卡牌(种类与位置)都要出现在新识别的 pool 中，多出的卡牌只能位于被点击卡牌的区域内
+        (点击后翻出的下层卡牌)，且队列中每种卡牌的数量一致。
+        点击未生效或其他区域发生了变化时不复用。
+        """
+        child = self._last_child
+        if self.mcts is None or child is None or child not in self.mcts.children:
+            return None
+        predicted_pool_cards, _ = child.state.get_cards()
+        pool_cards, _ = state.get_cards()
+        missing, revealed = match_cards(predicted_pool_cards, pool_cards)
+        if missing or not all(cards_overlap(card, child.action) for card in revealed):
+            return None
+        if child.state.get_hstate().get_each_in_queue_cards() != state.get_hstate().get_each_in_queue_cards():
+            return None
+        return child
+
     def cvt(self, result, child_node):
         crop_img = result.result.board_img
         width, height = crop_img.size
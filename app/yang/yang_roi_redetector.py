@@ -0,0 +1,142 @@
+"""
+局部重新识别
+
+点击一张卡牌后，棋盘上只有被点击的卡牌、它压住的卡牌以及下方的队列会发生变化。
+将当前帧与上一帧按格子比较灰度差，只对变化区域的外接矩形重新运行检测模型，
+其余区域直接沿用上一帧的识别结果。
+"""
+import numpy as np
+from PIL import Image
+
+from app.yang.yang_constants import (
+    ROI_TILE_SIZE, ROI_DIFF_THRESHOLD, ROI_MARGIN, ROI_MAX_AREA_RATIO, ROI_FULL_REFRESH_FRAMES,
+)
+
+
+def _center_in(card, rect):
+    x1, y1, x2, y2 = rect
+    return x1 <= card[5] < x2 and y1 <= card[6] < y2
+
+
+def _intersects(card, rect):
+    x1, y1, x2, y2 = rect
+    return card[1] < x2 and card[1] + card[3] > x1 and card[2] < y2 and card[2] + card[4] > y1
+
+
+class YangRoiRedetector:
+    """
+    detector 需要提供:
+        recognize(image) -> (pool_cards, queue_cards)  整图识别
+        recognize_region(image, rect) -> (pool_cards, queue_cards)  区域识别，坐标相对于整图
+        supports_region (可选)  为 False 时不做区域识别，画面有变化即整图识别
+    卡牌格式与 YangYOLORecognizer 一致: (label, x, y, w, h, center_x, center_y, is_critical)
+    """
+    def __init__(self, detector, tile_size=ROI_TILE_SIZE, threshold=ROI_DIFF_THRESHOLD, margin=ROI_MARGIN,
+                 max_area_ratio=ROI_MAX_AREA_RATIO, full_refresh_frames=ROI_FULL_REFRESH_FRAMES,
+                 pool_queue_split_ratio=0.85):
+        self.detector = detector
+        self.tile_size = tile_size
+        self.threshold = threshold
+        self.margin = margin
+        self.max_area_ratio = max_area_ratio
+        self.full_refresh_frames = full_refresh_frames
+        self.pool_queue_split_ratio = pool_queue_split_ratio
+        self._last_gray = None
+        self._last_cards = None  # 上一帧的 pool_cards + queue_cards
+        self._frames_since_full = 0
+        self.stats = {"full": 0, "roi": 0, "reuse": 0}
+
+    def dirty_tiles(self, gray: np.ndarray) -> np.ndarray:
+        """返回 (rows, cols) 的布尔数组，表示每个格子是否发生变化"""
+        ts = self.tile_size
+        height, width = gray.shape
+        rows, cols = -(-height // ts), -(-width // ts)
+        diff = np.abs(gray.astype(np.int16) - self._last_gray.astype(np.int16))
+        padded = np.zeros((rows * ts, cols * ts), dtype=np.int32)
+        padded[:height, :width] = diff
+        tile_sum = padded.reshape(rows, ts, cols, ts).sum(axis=(1, 3))
+        # 边缘格子按实际像素数求均值
+        tile_h = np.minimum(ts, height - np.arange(rows) * ts)
+        tile_w = np.minimum(ts, width - np.arange(cols) * ts)
+        return tile_sum / np.outer(tile_h, tile_w) > self.threshold
+
+    def plan_rects(self, dirty: np.ndarray, width: int, height: int) -> list:
+        """
+        根据变化的格子确定需要重新识别的矩形列表 [(x1, y1, x2, y2)]
+        矩形会扩展到完整包含与之相交的上一帧卡牌；队列有变化时整条队列重新识别 (消除后卡牌会左移)
+        """
+        ts = self.tile_size
+        split_y = self.pool_queue_split_ratio * height
+        ys, xs = np.nonzero(dirty)
+        if len(ys) == 0:
+            return []
+        rects = []
+        if ((ys + 1) * ts > split_y).any():
+            rects.append((0, max(0, int(split_y) - self.margin), width, height))
+        in_pool = ys * ts < split_y
+        if in_pool.any():
+            rect = (
+                max(0, int(xs[in_pool].min()) * ts - self.margin),
+                max(0, int(ys[in_pool].min()) * ts - self.margin),
+                min(width, (int(xs[in_pool].max()) + 1) * ts + self.margin),
+                min(height, (int(ys[in_pool].max()) + 1) * ts + self.margin),
+            )
+            # 扩展到完整包含相交的卡牌，直到不再变化
+            changed = True
+            while changed:
+                changed = False
+                for card in self._last_cards:
+                    if _intersects(card, rect):
+                        x1 = max(0, min(rect[0], int(card[1])))
+                        y1 = max(0, min(rect[1], int(card[2])))
+                        x2 = min(width, max(rect[2], int(np.ceil(card[1] + card[3]))))
+                        y2 = min(height, max(rect[3], int(np.ceil(card[2] + card[4]))))
+                        if (x1, y1, x2, y2) != rect:
+                            rect = (x1, y1, x2, y2)
+                            changed = True
+            if rects and rect[3] >= rects[0][1]:
+                # 与队列区域相连，合并为一个矩形
+                queue_rect = rects.pop()
+                rect = (0, min(rect[1], queue_rect[1]), width, height)
+            rects.append(rect)
+        return rects
+
+    def _split(self, cards, height):
+        pool_cards = [card for card in cards if card[6] < self.pool_queue_split_ratio * height]
+        queue_cards = [card for card in cards if card[6] >= self.pool_queue_split_ratio * height]
+        return pool_cards, queue_cards
+
+    def _full(self, image: Image, gray: np.ndarray):
+        pool_cards, queue_cards = self.detector.recognize(image)
+        self.stats["full"] += 1
+        self._frames_since_full = 0
+        self._last_gray = gray
+        self._last_cards = list(pool_cards) + list(queue_cards)
+        return pool_cards, queue_cards
+
+    def recognize(self, image: Image):
+        """返回当前帧的 (pool_cards, queue_cards)"""
+        gray = np.asarray(image.convert("L"))
+        width, height = image.size
+        if (self._last_gray is None or self._last_gray.shape != gray.shape
+                or self._frames_since_full + 1 >= self.full_refresh_frames):
+            return self._full(image, gray)
+        self._frames_since_full += 1
+
+        rects = self.plan_rects(self.dirty_tiles(gray), width, height)
+        if not rects:
+            self.stats["reuse"] += 1
+            return self._split(self._last_cards, height)
+        area = sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in rects)
+        if not getattr(self.detector, "supports_region", True) or area > self.max_area_ratio * width * height:
+            return self._full(image, gray)
+
+        # 矩形外沿用上一帧的结果，矩形内使用新的识别结果
+        cards = [card for card in self._last_cards if not any(_center_in(card, rect) for rect in rects)]
+        for rect in rects:
+            pool_cards, queue_cards = self.detector.recognize_region(image, rect)
+            cards.extend(card for card in pool_cards + queue_cards if _center_in(card, rect))
+        self.stats["roi"] += 1
+        self._last_gray = gray
+        self._last_cards = cards
+        return self._split(cards, height)
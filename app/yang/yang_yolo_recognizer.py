@@ -4,20 +4,21 @@ import os
 import random
 import time
 from PIL import Image
-print("Loading YOLO ...")
-from ultralytics import YOLO
-print("YOLO loaded.")
 
 from app.yang.yang_constants import (
     CARD_KINDS,
     MAIN_AREA_POSITION,
     VERBOSE, 
     CRITIC_AREA_CONFIG,
+    YOLO_IMGSZ,
+    ROI_REDETECT,
     # NUM_BOARD_ROWS,
     # NUM_BOARD_COLS,
     # SHOULD_SAVE_LOW_CONF_IMAGES,
 )
 from app.yang.logic.yang_board_state import YangBoardState
+from app.yang.yang_detector_backends import make_backend
+from app.yang.yang_roi_redetector import YangRoiRedetector
 
 from controller.perceive.split_utils import split_image, crop_image
 from controller.recognize.maybe_result import MaybeResult
@@ -27,6 +28,8 @@ class YangRecognizer:
     def __init__(self, model_path):
         self.yolo_recognizer = YangYOLORecognizer(model_path)
         self._last_hstate = None
+        # 与上一帧比较，只对发生变化的区域重新识别
+        self.roi_redetector = YangRoiRedetector(self.yolo_recognizer) if ROI_REDETECT else None
 
     def recognize(self, full_image: Image) -> MaybeResult:
         crop_im = crop_image(full_image, MAIN_AREA_POSITION)
@@ -35,6 +38,8 @@ class YangRecognizer:
             last_hstate=self._last_hstate, 
             simulator=self.yolo_recognizer
         )
+        if self.roi_redetector is not None:
+            state.set_recognized_cards(*self.roi_redetector.recognize(crop_im))
         self._last_hstate = state.get_hstate() # this will call _simulate() which will call recognize
         hstate = state.get_hstate()  
         return MaybeResult(result=state, prob=1)
@@ -42,23 +47,59 @@ class YangRecognizer:
 
 class YangYOLORecognizer:
     """借助YOLO模型识别棋盘的各个卡片位置"""
-    def __init__(self, model_path):
-        self.model = YOLO(model_path)
+    def __init__(self, model_path, backend=None):
+        # 推理后端: .pt 使用 ultralytics (自动选择 cuda/cpu)，.onnx 使用 ONNX Runtime CPU
+        self.backend = make_backend(model_path) if backend is None else make_backend(model_path, backend)
+
+    @property
+    def supports_region(self):
+        """固定输入尺寸的后端 (如静态导出的 .onnx) 会把区域放大到整图的输入尺寸，区域识别没有收益且卡牌尺度失真"""
+        return getattr(self.backend, "fixed_shape", None) is None
     
     def recognize(self, crop_im: Image):
-        pool_cards = []
-        queue_cards = []
-
         # crop_im = crop_image(full_image, MAIN_AREA_POSITION)
         width, height = crop_im.size
 
-        result = self.model.predict(source=[crop_im], save=False, verbose=False, device="cuda:0")[0]
-        boxes = result.boxes
-        for box in boxes:
-            x1, y1, x2, y2 = box.xyxy[0].cpu().tolist()
-            confidence = box.conf[0].item()
-            class_id = box.cls[0].item()
-            class_name = result.names[class_id]
+        result = self.backend.predict([crop_im])[0]
+        return self._parse_result(result, width, height)
+
+    def recognize_batch(self, crop_ims: list) -> list:
+        """
+        批量识别多张图片，只调用一次 predict
+
+        :param crop_ims: list[Image] 待识别的图片
+        :return: list[(pool_cards, queue_cards)] 与输入顺序一致
+        """
+        if not crop_ims:
+            return []
+        results = self.backend.predict(list(crop_ims))
+        return [
+            self._parse_result(result, *crop_im.size)
+            for crop_im, result in zip(crop_ims, results)
+        ]
+
+    def recognize_region(self, crop_im: Image, rect):
+        """
+        只识别 crop_im 中的 rect = (x1, y1, x2, y2) 区域
+        输入尺寸按区域大小缩小，保持与整图识别相同的缩放比例，耗时随区域面积下降
+        返回的坐标、关键区域判定和池子/队列的划分仍以整张图片为准
+        """
+        width, height = crop_im.size
+        x1, y1, x2, y2 = rect
+        scale = max(x2 - x1, y2 - y1) / max(width, height)
+        imgsz = max(32, int(math.ceil(YOLO_IMGSZ * scale / 32)) * 32)
+        result = self.backend.predict([crop_im.crop(rect)], imgsz=imgsz)[0]
+        return self._parse_result(result, width, height, offset=(x1, y1))
+
+    def _parse_result(self, result, width, height, offset=(0, 0)):
+        """将单张图片的检测结果 (Detections) 转换为 (pool_cards, queue_cards)，offset 为该图片在整图中的左上角"""
+        pool_cards = []
+        queue_cards = []
+
+        detections = zip(result.xyxy.tolist(), result.conf.tolist(), result.cls.tolist())
+        for (x1, y1, x2, y2), confidence, class_id in detections:
+            x1, y1, x2, y2 = x1 + offset[0], y1 + offset[1], x2 + offset[0], y2 + offset[1]
+            class_name = result.names.get(int(class_id), class_id)
 
             # 检测边界框需要是近似方的，i.e. 短边 / 长边 > 0.7 否则剔除
             range_x = x2 - x1
@@ -74,26 +115,11 @@ class YangYOLORecognizer:
             # print(repr(confidence), type(confidence), type(x1), class_name)
             entry = (class_id, x1, y1, x2 - x1, y2 - y1, (x1 + x2) * .5, (y1 + y2) * .5, is_critical_action)
 
-            # 检测边界框需要是近似方的，i.e. 短边 / 长边 > 0.7 
-            range_x = x2 - x1
-            range_y = y2 - y1
-            if min(range_x, range_y) <= 0.7 * max(range_x, range_y):
-                print(f"边界框不符合要求: range_x={range_x} range_y={range_y}")
-                continue
-
             if entry[6] < 0.85 * height:
                 pool_cards.append(entry)
             else:
                 queue_cards.append(entry)
         return pool_cards, queue_cards
-        # top_category = [result.probs.top1 for result in results]
-        # top_confidence = [result.probs.top1conf for result in results]
-        # recognize_result = np.array(top_category).reshape(rows, cols)
-        # prod_confidence = math.prod(top_confidence)
-
-        # self._save_low_conf_images(img_list, top_confidence)
-
-        return recognize_result, prod_confidence
 
     def _calc_overlap_with_critic_area(self, x1, y1, x2, y2, width, height, overlap_threshold = 0.5) -> list:
         sum_area = sum(self._calc_overlap_with_critic_area_single(x1, y1, x2, y2, critic_area, (width, height)) for critic_area in CRITIC_AREA_CONFIG)
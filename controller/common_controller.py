@@ -1,6 +1,7 @@
 import time
 import random
 
+from controller.perceive.frame_diff import FrameDiffGate
 from controller.perceive.window_utils import capture_window
 from controller.recognize.base_recognizer import BaseRecognizer
 from controller.react.base_react import BaseReact
@@ -14,6 +15,10 @@ class CommonController(object):
 
         self.frame_seconds = 1 / config["fps"]
         self.frame_max_running = config["frame_max_running"]
+        # 可选的帧差门控，参数见 FrameDiffGate，例如 {"region": MAIN_AREA_POSITION, "settle_frames": 1}
+        self.frame_gate = None
+        if config.get("frame_diff") is not None:
+            self.frame_gate = FrameDiffGate(**config["frame_diff"])
 
     def main_loop(self):
         tic = time.time()
@@ -34,6 +39,11 @@ class CommonController(object):
                 print(f"捕获窗口失败: {e}")
                 continue
 
+            # 画面静止或动画尚未结束时跳过识别和搜索
+            if self.frame_gate is not None and not self.frame_gate.update(screenshot):
+                print(f"画面未变化或尚未稳定，跳过 (diff={self.frame_gate.last_diff:.2f})")
+                continue
+
             # recognize
             maybe_result = self.recognizer.recognize(screenshot)
 
@@ -44,5 +54,7 @@ class CommonController(object):
 
             # execute
             gui_action.execute(coords)
+            if self.frame_gate is not None:
+                self.frame_gate.notify_action()
         
         print("Main Loop End")
\ No newline at end of file
@@ -0,0 +1,111 @@
+import numpy as np
+from PIL import Image
+
+from controller.perceive.split_utils import crop_image
+
+
+class FrameDiffGate:
+    """
+    基于帧差的识别门控
+
+    对截图的指定区域做灰度化和降采样，按 tile_size 分格，与上一帧及上一次识别时的画面比较各格子的平均绝对差，
+    取最大的格子作为差异 (与 YangRoiRedetector.dirty_tiles 相同的判据)。整图平均会把单张卡牌的变化
+    (约占棋盘的 2%，翻出的卡牌外观相近时更小) 稀释到阈值以下，按格子取最大值则不受变化面积影响:
+        - 画面与上一次识别时相同 (静止): 跳过识别和搜索
+        - 画面发生变化: 等待连续 settle_frames 帧不再变化 (动画结束) 后再识别
+        - 连续跳过 max_idle_frames 帧后强制识别一次，避免因阈值设置不当而停住
+    """
+    def __init__(self, region=None, size=(128, 128), tile_size=8, threshold=4.0, settle_frames=1, max_idle_frames=30):
+        """
+        :param region: 归一化的比较区域 (x, y, w, h)，None 表示整张截图
+        :param size: 降采样后的大小 (w, h)，应保证一张卡牌至少完整覆盖一个格子
+        :param tile_size: 格子大小 (降采样后的像素)
+        :param threshold: 格子内灰度平均绝对差的阈值 (0~255)，任一格子超过即认为画面变化
+        :param settle_frames: 画面变化后需要连续保持不变的帧数
+        :param max_idle_frames: 最多连续跳过的帧数
+        """
+        self.region = region
+        self.size = size
+        self.tile_size = tile_size
+        self.threshold = threshold
+        self.settle_frames = settle_frames
+        self.max_idle_frames = max_idle_frames
+        self._prev = None  # 上一帧的缩略图
+        self._processed = None  # 上一次识别时的缩略图
+        self._stable_count = 0
+        self._idle_frames = 0
+        self.last_diff = 0.0  # 与上一帧的差异 (最大的格子)，便于调阈值
+        self.skipped = 0  # 被跳过的帧数
+
+    def thumbnail(self, image: Image) -> np.ndarray:
+        if self.region is not None:
+            image = crop_image(image, self.region)
+        return np.asarray(image.convert("L").resize(self.size, Image.BILINEAR), dtype=np.float32)
+
+    def diff(self, a: np.ndarray, b: np.ndarray) -> float:
+        """各格子平均绝对差的最大值"""
+        ts = self.tile_size
+        height, width = a.shape
+        rows, cols = -(-height // ts), -(-width // ts)
+        padded = np.zeros((rows * ts, cols * ts), dtype=np.float32)
+        padded[:height, :width] = np.abs(a - b)
+        tile_sum = padded.reshape(rows, ts, cols, ts).sum(axis=(1, 3))
+        # 边缘格子按实际像素数求均值
+        tile_h = np.minimum(ts, height - np.arange(rows) * ts)
+        tile_w = np.minimum(ts, width - np.arange(cols) * ts)
+        return float((tile_sum / np.outer(tile_h, tile_w)).max())
+
+    def update(self, image: Image) -> bool:
+        """输入新的一帧，返回是否需要对该帧进行识别"""
+        thumb = self.thumbnail(image)
+        if self._prev is not None:
+            self.last_diff = self.diff(thumb, self._prev)
+            self._stable_count = self._stable_count + 1 if self.last_diff < self.threshold else 0
+        self._prev = thumb
+
+        if self._processed is None:
+            should_process = True
+        elif self._idle_frames + 1 >= self.max_idle_frames:
+            should_process = True
+        else:
+            changed = self.diff(thumb, self._processed) >= self.threshold
+            should_process = changed and self._stable_count >= self.settle_frames
+
+        if should_process:
+            self._processed = thumb
+            self._idle_frames = 0
+        else:
+            self._idle_frames += 1
+            self.skipped += 1
+        return should_process
+
+    def notify_action(self):
+        """执行了点击等动作，之后的画面需要重新等待稳定"""
+        self._stable_count = 0
+
+    def reset(self):
+        self._prev = None
+        self._processed = None
+        self._stable_count = 0
+        self._idle_frames = 0
+
+
+if __name__ == "__main__":
+    # 模拟: 静止 -> 点击后 3 帧动画 -> 静止
+    rng = np.random.default_rng(0)
+    board = rng.integers(0, 256, (400, 300, 3), dtype=np.uint8)
+    frames = [board] * 3
+    for k in range(3):
+        moving = board.copy()
+        moving[100 + 20 * k: 160 + 20 * k, 50:110] = 0
+        frames.append(moving)
+    settled = board.copy()
+    settled[160:220, 50:110] = 0
+    frames += [settled] * 4
+
+    gate = FrameDiffGate(region=(0.05, 0.19, 0.9, 0.68), settle_frames=1)
+    for k, frame in enumerate(frames):
+        process = gate.update(Image.fromarray(frame))
+        print(f"frame {k}: diff={gate.last_diff:.2f} {'识别' if process else '跳过'}")
+        if process:
+            gate.notify_action()
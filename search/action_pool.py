@@ -0,0 +1,94 @@
+"""
+未尝试动作池
+
+用树状数组 (Fenwick tree) 维护剩余动作的累计权重，
+按先验权重不放回地采样一个动作只需 O(log n)，并且不修改节点上保存的先验权重。
+"""
+import random
+
+
+class UntriedActionPool:
+    def __init__(self, actions, weights):
+        assert len(actions) == len(weights)
+        self.actions = list(actions)
+        self._weights = [float(w) for w in weights]  # 剩余动作的权重，已取出的置 0
+        self._remaining = [True] * len(self.actions)
+        self._num_remaining = len(self.actions)
+        n = len(self._weights)
+        # 线性时间建树: tree[i] 保存 (i - lowbit(i), i] 区间的权重和 (下标从 1 开始)
+        self._tree = [0.0] + self._weights
+        for i in range(1, n + 1):
+            j = i + (i & -i)
+            if j <= n:
+                self._tree[j] += self._tree[i]
+        self._top_bit = 1 << (n.bit_length() - 1) if n > 0 else 0
+
+    def _add(self, k, delta):
+        i = k + 1
+        n = len(self._weights)
+        while i <= n:
+            self._tree[i] += delta
+            i += i & -i
+
+    def total_weight(self):
+        total = 0.0
+        i = len(self._weights)
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def _find(self, target):
+        """返回前缀和首次超过 target 的下标"""
+        pos = 0
+        step = self._top_bit
+        n = len(self._weights)
+        while step > 0:
+            nxt = pos + step
+            if nxt <= n and self._tree[nxt] <= target:
+                pos = nxt
+                target -= self._tree[nxt]
+            step >>= 1
+        return pos
+
+    def remove(self, k):
+        """将第 k 个动作标记为已尝试"""
+        if not self._remaining[k]:
+            return
+        self._remaining[k] = False
+        self._num_remaining -= 1
+        self._add(k, -self._weights[k])
+        self._weights[k] = 0.0
+
+    def sample(self, rng=random):
+        """按权重采样一个剩余动作的下标 (不移除)，与 random.choices 一样只消耗一次 rng.random()"""
+        if self._num_remaining == 0:
+            raise IndexError("no untried action left")
+        total = self.total_weight()
+        u = rng.random()
+        if total > 0:
+            k = self._find(u * total)
+            if k < len(self._weights) and self._remaining[k] and self._weights[k] > 0:
+                return k
+            # 浮点误差落在了已移除的动作上，退回线性扫描
+            target = u * sum(self._weights)
+            for k, w in enumerate(self._weights):
+                if w > 0:
+                    target -= w
+                    if target < 0:
+                        return k
+        # 剩余动作的权重全为 0 时均匀采样
+        remaining = [k for k, flag in enumerate(self._remaining) if flag]
+        return remaining[min(int(u * len(remaining)), len(remaining) - 1)]
+
+    def pop_sample(self, rng=random):
+        """按权重不放回地取出一个动作"""
+        k = self.sample(rng)
+        self.remove(k)
+        return self.actions[k]
+
+    def __len__(self):
+        return self._num_remaining
+
+    def __bool__(self):
+        return self._num_remaining > 0
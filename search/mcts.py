@@ -1,33 +1,96 @@
 import random
 import math
+import time
 from collections import defaultdict
 from typing import List, Dict
-from app.yang.yang_constants import MCTS_CONFIDENCE
 
+import numpy as np
+
+from app.yang.yang_constants import MCTS_CONFIDENCE, MCTS_VIRTUAL_LOSS, MCTS_DEBUG
+
+from search.node_store import NodeStore, StoreChildrenView, StoreParentView
 from search.tree_node import TreeNode
 
 
 class MCTS:
-    def __init__(self, root_node: TreeNode, rollout_policy, rollout_iterations=1, node_clz=TreeNode):
+    def __init__(self, root_node: TreeNode, rollout_policy, rollout_iterations=1, node_clz=TreeNode, expand_batch_size=1,
+                 transposition=False, batched_rollout=False, rollout_executor=None, compact_store=False,
+                 exact_evaluator=None, value_estimator=None, rollout_target_se=None, rollout_max_iterations=None):
         self.root_node = root_node
         self.rollout_policy = rollout_policy
         self.rollout_iterations = rollout_iterations
         self.node_clz = node_clz
+        self.expand_batch_size = expand_batch_size  # 每轮收集的叶子数，交给 node_clz.prepare_batch 批量处理
+        # True 时 rollout_policy(node, n) 一次返回 n 个 rollout 的回报
+        self.batched_rollout = batched_rollout
+        # 可插拔的 rollout 执行器 (例如 ProcessPoolRolloutExecutor)，提供 evaluate(node, iterations)
+        self.rollout_executor = rollout_executor
+        # 精确求值钩子 exact_evaluator(node)，返回 None 时才进行 rollout (例如残局的 expectimax)
+        self.exact_evaluator = exact_evaluator
+        # 价值估计钩子 value_estimator(node, iterations)，代替 rollout_policy (例如学习得到的价值函数)
+        self.value_estimator = value_estimator
+        # 设置 rollout_target_se 时按批追加 rollout，直到节点回报均值的标准误差不超过该值
+        # 或总 rollout 数达到 rollout_max_iterations
+        self.rollout_target_se = rollout_target_se
+        self.rollout_max_iterations = rollout_max_iterations
         self.children = {}  # type: Dict[TreeNode, List[TreeNode]]
-        self.parent = {}
+        self.child_actions = {}  # type: Dict[TreeNode, List]  # 与 children 对应的边上的动作
+        self.parent = {}  # 第一次创建该节点时的父节点
+        self.parents = defaultdict(list)  # type: Dict[TreeNode, List[TreeNode]]  # 置换模式下的所有父节点
+        # compact_store 为 True 时节点统计量和父子关系保存在 NodeStore 的数组中，
+        # children / parent 换成只读视图，parents 只记录置换产生的额外父节点
+        self.store = None
+        if compact_store:
+            self.store = NodeStore()
+            self.store.add_node(root_node)
+            self.children = StoreChildrenView(self.store)
+            self.parent = StoreParentView(self.store)
         self.verbose = False
 
+        # 置换表: 通过 node.state_key() 合并不同路径到达的相同局面，搜索树变为 DAG
+        self.transposition = transposition
+        self.table = {}
+        self.num_nodes = 1  # 搜索树(图)中的节点数
+        self.iterations_done = 0  # 最近一次 run 完成的迭代次数
+        self._budget = (None, None, None)  # (iterations, deadline, node_budget)
+        self._transposed_parents = []  # 新增了指向已有节点的边、需要重新计算 best q 的父节点
+        if self.transposition:
+            root_key = root_node.state_key()
+            if root_key is not None:
+                self.table[root_key] = root_node
+
     def _uct_select(self, node):
-        # All children of node should already be expanded:
-        assert all(n.is_visited() for n in self.children[node])
+        if self.store is not None:
+            return self._uct_select_vectorized(node)
+        if MCTS_DEBUG:
+            # All children of node should already be expanded (or pending in current batch):
+            assert all(n.is_visited() or n.virtual_loss > 0 for n in self.children[node])
 
-        # 使用UCB1公式选择子节点
+        # 使用UCB1公式选择子节点，虚拟损失计入访问次数并惩罚 Q 值
         c = MCTS_CONFIDENCE
+        vl = MCTS_VIRTUAL_LOSS
+        log_parent_visits = math.log(node.visits + node.virtual_loss)
         return max(
             self.children[node], 
             # key=lambda x: x.rewards / x.visits + c * math.sqrt(math.log(node.visits) / x.visits )
-            key=lambda x: x.best_q + c * math.sqrt(math.log(node.visits) / x.visits )
+            key=lambda x: x.best_q - vl * x.virtual_loss + c * math.sqrt(
+                log_parent_visits / (x.visits + x.virtual_loss)
+            )
+        )
+
+    def _uct_select_vectorized(self, node):
+        """与 _uct_select 相同的 UCB 公式，直接在 NodeStore 的数组上一次算出所有子节点的分数"""
+        store = self.store
+        child_idx = store.children_indices(node._idx)
+        visits = store.visits[child_idx]
+        virtual_loss = store.virtual_loss[child_idx]
+        if MCTS_DEBUG:
+            assert np.all((visits > 0) | (virtual_loss > 0))
+        log_parent_visits = math.log(node.visits + node.virtual_loss)
+        scores = store.best_q[child_idx] - MCTS_VIRTUAL_LOSS * virtual_loss + MCTS_CONFIDENCE * np.sqrt(
+            log_parent_visits / (visits + virtual_loss)
         )
+        return store.nodes[child_idx[int(np.argmax(scores))]]
 
     def _select(self, node):
         """从根节点开始, 向下寻找一个可展开的子节点"""
@@ -38,30 +101,81 @@ class MCTS:
             if node not in self.children or node.is_terminal():
                 # node is either unexplored or terminal
                 return path
-            # 检查是否存在未被尝试过的子节点
-            visited_action_mask = {child.action for child in self.children[node]}
-            unexplored = set(node.available_actions) - visited_action_mask
             if len(node.available_actions) == 0:
                 # node is just explored and has no children
                 print("mcts:46 hit terminal node")
                 return path
-            if unexplored:
-                action = self.sample_action_from_node(node, visited_action_mask)
+            # 检查是否存在未被尝试过的子节点
+            if node.untried_actions:
+                action = self.sample_action_from_node(node)
                 node.increase_tried_action_num()
-                child_node = self.node_clz(state=node.state, action=action)
-                self.children[node].append(child_node)
-                self.parent[child_node] = node
+                child_node = self._make_child(node, action)
+                self._add_child(node, child_node, action)
+                if child_node.is_visited() and child_node in self.children:
+                    # 置换: 该局面已经由其他路径展开过，继续向下搜索
+                    node = child_node
+                    continue
                 path.append(child_node)
                 return path
             node = self._uct_select(node)  # descend a layer deeper
 
-    def sample_action_from_node(self, node: TreeNode, visited_action_mask):
-        actions, weights = node.available_actions_and_weights
-        for k in range(len(actions)):
-            if actions[k] in visited_action_mask:
-                weights[k] = 0
-        # 根据权重进行采样
-        return random.choices(actions, weights=weights, k=1)[0]
+    def _make_child(self, node, action):
+        """创建子节点，置换模式下若相同局面已存在则复用"""
+        child_node = self.node_clz(state=node.state, action=action)
+        if self.transposition:
+            key = child_node.state_key()
+            if key is not None:
+                existing = self.table.get(key)
+                if existing is not None:
+                    self.parents[existing].append(node)
+                    self._transposed_parents.append(node)
+                    return existing
+                self.table[key] = child_node
+        self.num_nodes += 1
+        if self.store is not None:
+            self.store.add_node(child_node, node._idx)
+        else:
+            self.parent[child_node] = node
+            self.parents[child_node].append(node)
+        return child_node
+
+    def _add_child(self, node, child_node, action):
+        if self.store is not None:
+            self.store.add_child(node._idx, child_node._idx, len(node.available_actions))
+        else:
+            self.children[node].append(child_node)
+        self.child_actions[node].append(action)
+
+    def _parents_of(self, node):
+        """节点的所有父节点"""
+        if self.store is None:
+            return self.parents.get(node, ())
+        parent = self.parent.get(node)
+        extra_parents = self.parents.get(node, [])
+        return extra_parents if parent is None else [parent] + extra_parents
+
+    def _select_batch(self, batch_size):
+        """借助虚拟损失收集至多 batch_size 条互不相同的路径"""
+        paths = []
+        leaves = set()
+        for _ in range(batch_size):
+            path = self._select(self.root_node)
+            if path[-1] in leaves:
+                # 虚拟损失不足以引向新的叶子，提前结束本批次
+                break
+            for node in path:
+                node.virtual_loss += 1
+            paths.append(path)
+            leaves.add(path[-1])
+        for path in paths:
+            for node in path:
+                node.virtual_loss -= 1
+        self.node_clz.prepare_batch([path[-1] for path in paths])
+        return paths
+
+    def sample_action_from_node(self, node: TreeNode):
+        # 根据先验权重从未尝试的动作中不放回地采样
+        return node.untried_actions.pop_sample()
 
     def expand_node(self, node: TreeNode):
         # 若第一次遇到该节点，则不扩展，而是直接计算 rollout
@@ -70,19 +184,55 @@ class MCTS:
             return True
         if node in self.children and len(self.children[node]) > 0:
             assert False, f"node {node} has been expanded before, has {len(self.children[node])} children"
-        self.children[node] = []
+        if self.store is not None:
+            self.store.mark_expanded(node._idx)
+        else:
+            self.children[node] = []
+        self.child_actions[node] = []
         return False
 
 
     def simulate(self, node):
         # 从当前节点开始进行模拟
-        total_reward = 0
-        for _ in range(self.rollout_iterations):
-            total_reward += self.rollout_policy(node)
-        return total_reward / self.rollout_iterations
+        if self.exact_evaluator is not None:
+            value = self.exact_evaluator(node)
+            if value is not None:
+                return value
+        if self.value_estimator is not None:
+            return self.value_estimator(node, self.rollout_iterations)
+        if self.rollout_executor is not None:
+            return self.rollout_executor.evaluate(node, self.rollout_iterations)
+        rewards = self._rollout_batch(node)
+        node.add_rollout_samples(rewards)
+        if self.rollout_target_se is None:
+            return float(sum(rewards)) / len(rewards)
+        max_iterations = self.rollout_max_iterations or 4 * self.rollout_iterations
+        while node.rollout_se > self.rollout_target_se and len(rewards) < max_iterations:
+            batch = self._rollout_batch(node)
+            node.add_rollout_samples(batch)
+            rewards.extend(batch)
+        return float(sum(rewards)) / len(rewards)
 
-    def backpropagate(self, node: TreeNode, reward):
+    def _rollout_batch(self, node) -> list:
+        """运行一批 rollout，返回每个样本的回报 (对偶采样的策略可能返回成对平均后的回报)"""
+        if self.batched_rollout:
+            return [float(r) for r in self.rollout_policy(node, self.rollout_iterations)]
+        return [self.rollout_policy(node) for _ in range(self.rollout_iterations)]
+
+    def backpropagate(self, node: TreeNode, reward, path=None):
         node._rollout_q = reward
+        if path is not None and self.store is not None:
+            # 沿路径一次性更新数组中的统计量
+            path_idx = [path_node._idx for path_node in path]
+            self.store.visits[path_idx] += 1
+            self.store.rewards[path_idx] += reward
+            return
+        if path is not None:
+            # 沿本次选择的路径回传，DAG 中的共享节点每次经过只计一次
+            for path_node in reversed(path):
+                path_node.visits += 1
+                path_node.rewards += reward
+            return
         # 反向传播结果
         while node is not None:
             node.visits += 1
@@ -105,30 +255,47 @@ class MCTS:
             print("Best child rwd", [x.rewards / x.visits for x in self.children[node]])
             print("Best child q", [x.best_q for x in self.children[node]])
             print("Best child visits", [x.visits for x in self.children[node]])
+            print("Best child rollout se", [x.rollout_se for x in self.children[node]])
         # return max(self.children[node], key=lambda x: x.rewards / x.visits)
 
-        # 选择 argmax best_Q 的节点，_calc_and_refresh_q 需传入根节点
-        self._calc_and_refresh_q(node)
+        # 选择 argmax best_Q 的节点，best_q 已在 backpropagate 后由 _update_q_upwards 增量维护
         return max(self.children[node], key=lambda x: x.best_q)
 
-    def _calc_and_refresh_q(self, node: TreeNode) -> None:
-        # 计算并递归更新每个节点的Q值
-        if len(node.available_actions) == 0:
-            node.set_best_q(node._rollout_q)
-            return node._rollout_q  # 子节点直接返回
-        elif not node.is_fully_expanded():
-            # 部分探索节点，取所有子节点的 best q，加上 rollout 的结果
-            q_of_children = [self._calc_and_refresh_q(node) for node in self.children[node]]
-            q_of_children.append(node._rollout_q)
-            max_q = max(q_of_children)
-            node.set_best_q(max_q)
-            return max_q
+    def _local_best_q(self, node: TreeNode):
+        """
+        仅根据直接子节点的 best q 计算该节点的 best q:
+            - 无可选动作的节点取自身 rollout 的结果
+            - 部分探索节点取已访问子节点的 best q 与自身 rollout 结果中的最大值
+            - 完全探索节点取已访问子节点的 best q 的最大值
+        """
+        if node._rollout_q is None:
+            # 树并行时，经过该节点的其他路径可能先于它自身的 rollout 完成回传
+            rollout_q = []
         else:
-            # 完全探索节点，取所有子节点的 best q
-            q_of_children = [self._calc_and_refresh_q(node) for node in self.children[node]]
-            max_q = max(q_of_children)
-            node.set_best_q(max_q)
-            return max_q
+            rollout_q = [node._rollout_q]
+        if len(node.available_actions) == 0:
+            return max(rollout_q, default=float("-inf"))
+        q_of_children = [child.best_q for child in self.children.get(node, []) if child.is_visited()]
+        if not node.is_fully_expanded() or not q_of_children:
+            # 部分探索节点，rollout 的结果也计入
+            q_of_children.extend(rollout_q)
+        return max(q_of_children, default=float("-inf"))
+
+    def _update_q_upwards(self, *start_nodes: TreeNode) -> None:
+        """
+        从叶子节点(以及新增了置换边的节点)向上增量更新 best q
+
+        只有取值发生变化的节点才会继续通知其父节点，单次迭代的代价与深度成正比。
+        置换模式下会通知所有父节点。
+        """
+        stack = list(start_nodes)
+        while stack:
+            node = stack.pop()
+            new_q = self._local_best_q(node)
+            if new_q == node.best_q and node not in start_nodes:
+                continue
+            node.set_best_q(new_q)
+            stack.extend(self._parents_of(node))
 
     def stats(self):
         mean_rwd = [x.rewards / x.visits for x in self.children[self.root_node]]
@@ -137,15 +304,106 @@ class MCTS:
         max_idx = np.array(mean_rwd).argmax()
         return f"Rwd: {mean_rwd}\nVisits: {visits}\nMaxIdx: {max_idx}"
 
-    def run(self, iterations):
-        for iter_idx in range(iterations):
-            path = self._select(self.root_node)
-            leaf_node = path[-1]
-            self.expand_node(leaf_node)
-            reward = self.simulate(leaf_node)
-            self.backpropagate(leaf_node, reward)
-            self._calc_and_refresh_q(self.root_node)
-            print(f"MCTS Iteration {iter_idx} path: {path} reward: {reward}")
+    def reroot(self, new_root: TreeNode) -> None:
+        """
+        将已有的节点提升为新的根节点，保留其子树的统计，其余节点全部丢弃
+
+        用于连续两步之间复用搜索树。若要替换新根节点的局面，应在 reroot 之前完成，置换表按替换后的 state_key 登记。
+        """
+        if self.store is not None:
+            self.store = self.store.rebuild(new_root)
+            self.children = StoreChildrenView(self.store)
+            self.parent = StoreParentView(self.store)
+            self._reroot_tables(new_root, set(self.store.nodes))
+            return
+        reachable = {new_root}
+        stack = [new_root]
+        while stack:
+            node = stack.pop()
+            for child in self.children.get(node, []):
+                if child not in reachable:
+                    reachable.add(child)
+                    stack.append(child)
+
+        self.children = {node: children for node, children in self.children.items() if node in reachable}
+        self.parent = {
+            child: parent for child, parent in self.parent.items()
+            if child in reachable and parent in reachable and child is not new_root
+        }
+        self._reroot_tables(new_root, reachable)
+
+    def _reroot_tables(self, new_root, reachable):
+        self.child_actions = {node: actions for node, actions in self.child_actions.items() if node in reachable}
+        self.parents = defaultdict(list, {
+            child: [parent for parent in parents if parent in reachable]
+            for child, parents in self.parents.items() if child in reachable and child is not new_root
+        })
+        # 新根节点的局面可能已被替换 (例如 YangTreeNode.replace_state)，按当前局面重新登记
+        self.table = {key: node for key, node in self.table.items() if node in reachable and node is not new_root}
+        if self.transposition:
+            root_key = new_root.state_key()
+            if root_key is not None:
+                self.table[root_key] = new_root
+        self._transposed_parents = []
+        self.num_nodes = len(reachable)
+        self.root_node = new_root
+
+    def _set_budget(self, iterations, time_budget, deadline, node_budget):
+        if iterations is None and time_budget is None and deadline is None and node_budget is None:
+            raise ValueError("MCTS.run 需要至少指定 iterations / time_budget / deadline / node_budget 之一")
+        if time_budget is not None:
+            budget_deadline = time.time() + time_budget
+            deadline = budget_deadline if deadline is None else min(deadline, budget_deadline)
+        self._budget = (iterations, deadline, node_budget)
+
+    def _out_of_budget(self, iter_num):
+        iterations, deadline, node_budget = self._budget
+        if iterations is not None and iter_num >= iterations:
+            return True
+        if deadline is not None and time.time() >= deadline:
+            return True
+        if node_budget is not None and self.num_nodes >= node_budget:
+            return True
+        return False
+
+    def _has_answer(self):
+        """根节点是否已经有可供选择的子节点 (或根节点本身无动作可选)"""
+        if self.root_node not in self.children:
+            return False
+        if len(self.root_node.available_actions) == 0:
+            return True
+        return any(child.is_visited() for child in self.children[self.root_node])
+
+    def run(self, iterations=None, *, time_budget=None, deadline=None, node_budget=None):
+        """
+        运行 MCTS 直到任一预算耗尽，返回当前最优的子节点
+
+        :param iterations: int 迭代次数上限
+        :param time_budget: float 本次搜索的时间预算(秒)
+        :param deadline: float 绝对截止时间 (time.time())
+        :param node_budget: int 搜索树节点数上限
+        实际完成的迭代次数记录在 self.iterations_done 中。
+        预算耗尽时若根节点尚无已访问的子节点，会继续迭代直到可以给出结果。
+        """
+        self._set_budget(iterations, time_budget, deadline, node_budget)
+        self.iterations_done = 0
+        while not self._out_of_budget(self.iterations_done) or not self._has_answer():
+            if self.expand_batch_size > 1:
+                batch_size = self.expand_batch_size
+                if iterations is not None:
+                    batch_size = max(1, min(batch_size, iterations - self.iterations_done))
+                paths = self._select_batch(batch_size)
+            else:
+                paths = [self._select(self.root_node)]
+            for path in paths:
+                leaf_node = path[-1]
+                self.expand_node(leaf_node)
+                reward = self.simulate(leaf_node)
+                self.backpropagate(leaf_node, reward, path)
+                self._update_q_upwards(leaf_node, *self._transposed_parents)
+                self._transposed_parents.clear()
+                print(f"MCTS Iteration {self.iterations_done} path: {path} reward: {reward}")
+                self.iterations_done += 1
         return self.best_child(self.root_node)
 
 
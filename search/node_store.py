@@ -0,0 +1,220 @@
+"""
+结构化数组 (structure of arrays) 形式的搜索树存储
+
+每个节点的统计量保存在连续的 numpy 数组中，节点对象只保留 state / action 等数据，
+通过 (store, idx) 读写自己的统计量。
+子节点关系采用 CSR 形式: 节点 p 的子节点下标为 child_index[child_start[p]: child_start[p] + child_count[p]]，
+添加第一个子节点时按可选动作数一次性预留连续的区间，因此可以对同一父节点的所有子节点做向量化计算。
+"""
+import numpy as np
+
+
+class NodeStore:
+    def __init__(self, capacity=1024):
+        capacity = max(int(capacity), 1)
+        self.size = 0  # 已分配的节点数
+        self.nodes = []  # 下标 -> 节点对象
+        self.visits = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros(capacity, dtype=np.float64)
+        self.best_q = np.full(capacity, -np.inf, dtype=np.float64)
+        self.rollout_q = np.full(capacity, np.nan, dtype=np.float64)  # nan 表示尚未 rollout
+        self.virtual_loss = np.zeros(capacity, dtype=np.int64)
+        self.parent = np.full(capacity, -1, dtype=np.int64)  # 第一次创建该节点时的父节点
+        self.expanded = np.zeros(capacity, dtype=bool)  # 对应 MCTS.children 中是否有该节点
+        self.child_start = np.zeros(capacity, dtype=np.int64)
+        self.child_count = np.zeros(capacity, dtype=np.int64)
+        self.child_capacity = np.zeros(capacity, dtype=np.int64)
+        # CSR 的列下标数组
+        self.child_index = np.full(capacity, -1, dtype=np.int64)
+        self.num_child_slots = 0
+
+    _NODE_FIELDS = ("visits", "rewards", "best_q", "rollout_q", "virtual_loss", "parent",
+                    "expanded", "child_start", "child_count", "child_capacity")
+
+    def _grow_nodes(self, min_capacity):
+        capacity = len(self.visits)
+        if min_capacity <= capacity:
+            return
+        new_capacity = max(capacity * 2, min_capacity)
+        for name in self._NODE_FIELDS:
+            old = getattr(self, name)
+            new = np.empty(new_capacity, dtype=old.dtype)
+            new[:capacity] = old
+            if name == "best_q":
+                new[capacity:] = -np.inf
+            elif name == "rollout_q":
+                new[capacity:] = np.nan
+            elif name == "parent":
+                new[capacity:] = -1
+            else:
+                new[capacity:] = 0
+            setattr(self, name, new)
+
+    def _reserve_slots(self, num):
+        start = self.num_child_slots
+        end = start + num
+        if end > len(self.child_index):
+            new_index = np.full(max(len(self.child_index) * 2, end), -1, dtype=np.int64)
+            new_index[:start] = self.child_index[:start]
+            self.child_index = new_index
+        self.num_child_slots = end
+        return start
+
+    def add_node(self, node, parent_idx=-1) -> int:
+        """为节点分配下标，将节点对象中已有的统计量写入数组，并让节点改为读写数组"""
+        idx = self.size
+        self._grow_nodes(idx + 1)
+        self.size += 1
+        self.nodes.append(node)
+        self.visits[idx] = node.visits
+        self.rewards[idx] = node.rewards
+        self.best_q[idx] = node.best_q
+        self.rollout_q[idx] = np.nan if node._rollout_q is None else node._rollout_q
+        self.virtual_loss[idx] = node.virtual_loss
+        self.parent[idx] = parent_idx
+        self.expanded[idx] = False
+        self.child_start[idx] = 0
+        self.child_count[idx] = 0
+        self.child_capacity[idx] = 0
+        node.attach_store(self, idx)
+        return idx
+
+    def mark_expanded(self, idx):
+        """标记节点已展开，对应 MCTS.children[node] = []"""
+        self.expanded[idx] = True
+
+    def add_child(self, parent_idx, child_idx, capacity_hint=4):
+        """
+        追加一条父子边
+        第一次添加时按 capacity_hint (通常为可选动作数) 预留连续的区间
+        """
+        count = self.child_count[parent_idx]
+        if count >= self.child_capacity[parent_idx]:
+            # 区间未预留或已满，在末尾重新分配并搬移已有的子节点
+            new_capacity = max(int(capacity_hint), 2 * int(self.child_capacity[parent_idx]), 1)
+            old_start = self.child_start[parent_idx]
+            new_start = self._reserve_slots(new_capacity)
+            self.child_index[new_start: new_start + count] = self.child_index[old_start: old_start + count]
+            self.child_start[parent_idx] = new_start
+            self.child_capacity[parent_idx] = new_capacity
+        self.child_index[self.child_start[parent_idx] + count] = child_idx
+        self.child_count[parent_idx] = count + 1
+
+    def children_indices(self, idx) -> np.ndarray:
+        start = self.child_start[idx]
+        return self.child_index[start: start + self.child_count[idx]]
+
+    def children_nodes(self, idx) -> list:
+        return [self.nodes[child_idx] for child_idx in self.children_indices(idx)]
+
+    def rebuild(self, root_node, extra_nodes=()):
+        """
+        只保留从 root_node 可达的节点(以及 extra_nodes)，重新分配到一个紧凑的新 store 中
+
+        返回新的 store，节点对象会被重新挂载到新 store 上。
+        """
+        old_root = root_node._idx
+        order = [old_root]
+        new_index = {old_root: 0}
+        k = 0
+        while k < len(order):
+            for child_idx in self.children_indices(order[k]):
+                child_idx = int(child_idx)
+                if child_idx not in new_index:
+                    new_index[child_idx] = len(order)
+                    order.append(child_idx)
+            k += 1
+        for node in extra_nodes:
+            if node._store is self and node._idx not in new_index:
+                new_index[node._idx] = len(order)
+                order.append(node._idx)
+
+        store = NodeStore(capacity=max(len(order), 16))
+        old = np.array(order, dtype=np.int64)
+        n = len(order)
+        store.size = n
+        store.nodes = [self.nodes[idx] for idx in order]
+        for name in ("visits", "rewards", "best_q", "rollout_q", "virtual_loss", "expanded"):
+            getattr(store, name)[:n] = getattr(self, name)[old]
+        store.parent[:n] = [new_index.get(int(self.parent[idx]), -1) for idx in order]
+        store.parent[0] = -1
+        for new_idx, old_idx in enumerate(order):
+            count = int(self.child_count[old_idx])
+            capacity = int(self.child_capacity[old_idx])
+            if capacity > 0:
+                start = store._reserve_slots(capacity)
+                store.child_start[new_idx] = start
+                store.child_capacity[new_idx] = capacity
+                store.child_count[new_idx] = count
+                store.child_index[start: start + count] = [new_index[int(c)] for c in self.children_indices(old_idx)]
+        for new_idx, node in enumerate(store.nodes):
+            node.attach_store(store, new_idx)
+        # 旧 store 中被丢弃的节点恢复为独立的节点对象
+        kept = set(order)
+        for idx in range(self.size):
+            if idx not in kept:
+                self.nodes[idx].detach_store()
+        return store
+
+    def nbytes(self):
+        """数组占用的字节数"""
+        return sum(getattr(self, name).nbytes for name in self._NODE_FIELDS) + self.child_index.nbytes
+
+    def __len__(self):
+        return self.size
+
+
+class StoreChildrenView:
+    """以 dict 的接口访问 NodeStore 中的子节点列表，兼容 MCTS.children 的用法"""
+    def __init__(self, store: NodeStore):
+        self.store = store
+
+    def __contains__(self, node):
+        return node._store is self.store and bool(self.store.expanded[node._idx])
+
+    def __getitem__(self, node):
+        if node not in self:
+            raise KeyError(node)
+        return self.store.children_nodes(node._idx)
+
+    def get(self, node, default=None):
+        if node not in self:
+            return default
+        return self.store.children_nodes(node._idx)
+
+    def __iter__(self):
+        store = self.store
+        return (store.nodes[idx] for idx in np.nonzero(store.expanded[:store.size])[0])
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self[node] for node in self]
+
+    def items(self):
+        return [(node, self[node]) for node in self]
+
+    def __len__(self):
+        return int(self.store.expanded[:self.store.size].sum())
+
+
+class StoreParentView:
+    """以 dict 的接口访问 NodeStore 中的父节点，兼容 MCTS.parent 的用法"""
+    def __init__(self, store: NodeStore):
+        self.store = store
+
+    def get(self, node, default=None):
+        if node._store is not self.store:
+            return default
+        parent_idx = self.store.parent[node._idx]
+        return default if parent_idx < 0 else self.store.nodes[parent_idx]
+
+    def __getitem__(self, node):
+        parent = self.get(node)
+        if parent is None:
+            raise KeyError(node)
+        return parent
+
+    def __contains__(self, node):
+        return self.get(node) is not None
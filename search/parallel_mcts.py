@@ -0,0 +1,161 @@
+import multiprocessing
+import random
+import threading
+import time
+
+from search.mcts import MCTS
+from search.tree_node import TreeNode
+
+
+def _run_search(root_node: TreeNode, mcts_kwargs: dict, seed: int, seed_fn, budget: dict):
+    """
+    在子进程中从同一根节点运行一次独立的 MCTS
+    返回 (以动作为 key 的根节点子节点统计, 完成的迭代次数)
+    """
+    seed_fn(seed)
+    mcts = MCTS(root_node, **mcts_kwargs)
+    mcts.run(**budget)
+    stats = {}
+    for child, action in zip(mcts.children[mcts.root_node], mcts.child_actions[mcts.root_node]):
+        stats[action] = (child.visits, child.rewards, child.best_q)
+    return stats, mcts.iterations_done
+
+
+def merge_root_stats(stats_list: list) -> dict:
+    """合并各进程的根节点统计: visits / rewards 求和，best_q 取最大值 (仅用于显示)"""
+    merged = {}
+    for stats in stats_list:
+        for action, (visits, rewards, best_q) in stats.items():
+            if action not in merged:
+                merged[action] = {"visits": 0, "rewards": 0.0, "best_q": float("-inf")}
+            entry = merged[action]
+            entry["visits"] += visits
+            entry["rewards"] += rewards
+            entry["best_q"] = max(entry["best_q"], best_q)
+    return merged
+
+
+def select_root_action(merged: dict):
+    """
+    按合并后的总访问次数选择动作，访问次数相同时取平均回报 rewards / visits 较大者
+
+    不使用 best_q: 每个进程的 best_q 本身是带噪声估计的最大值，再对各进程取最大值会进一步偏向
+    访问次数很少、恰好得到高分的动作，进程越多偏差越大。
+    """
+    return max(merged, key=lambda action: (merged[action]["visits"],
+                                           merged[action]["rewards"] / max(merged[action]["visits"], 1)))
+
+
+class ParallelMCTS:
+    """
+    根并行 MCTS
+
+    在 num_workers 个进程中以不同的随机种子从同一根节点独立搜索，
+    合并根节点各动作的统计后按总访问次数选择动作 (select_root_action)。
+    根节点会被 pickle 发送到子进程，因此应当在主进程中提前完成识别等耗时计算。
+    mcts_kwargs 会原样传给 MCTS (rollout_policy / node_clz 等需可 pickle)。
+    """
+    def __init__(self, num_workers=None, seed=0, seed_fn=random.seed, **mcts_kwargs):
+        self.num_workers = num_workers or multiprocessing.cpu_count()
+        self.seed = seed
+        self.seed_fn = seed_fn
+        self.mcts_kwargs = mcts_kwargs
+        self.root_stats = {}
+        self.iterations_done = 0  # 最近一次 run 中所有进程完成的迭代次数之和
+        self._pool = multiprocessing.Pool(self.num_workers)
+
+    def run(self, root_node: TreeNode, iterations=None, *, time_budget=None, deadline=None, node_budget=None):
+        """每个进程按相同的预算独立搜索 (参数含义同 MCTS.run)，返回合并后总访问次数最多的动作"""
+        if time_budget is not None:
+            # 换算为绝对截止时间，避免进程启动的耗时被重复计入
+            budget_deadline = time.time() + time_budget
+            deadline = budget_deadline if deadline is None else min(deadline, budget_deadline)
+        budget = {"iterations": iterations, "deadline": deadline, "node_budget": node_budget}
+        tasks = [
+            (root_node, self.mcts_kwargs, self.seed + k, self.seed_fn, budget)
+            for k in range(self.num_workers)
+        ]
+        self.seed += self.num_workers
+        results = self._pool.starmap(_run_search, tasks)
+        self.root_stats = merge_root_stats([stats for stats, _ in results])
+        self.iterations_done = sum(iterations_done for _, iterations_done in results)
+        return select_root_action(self.root_stats)
+
+    def stats(self):
+        return "\n".join(
+            f"{action}: visits={entry['visits']} mean={entry['rewards'] / max(entry['visits'], 1):.3f} best_q={entry['best_q']:.3f}"
+            for action, entry in self.root_stats.items()
+        )
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class TreeParallelMCTS(MCTS):
+    """
+    树并行 MCTS
+
+    多个线程共享同一棵搜索树: 选择 / 展开 / 回传在锁内进行，rollout 在锁外并发执行。
+    选择时在路径上累加虚拟损失，使并发的线程分散到不同的分支。
+    默认使用 NodeStore 保存节点统计量 (compact_store=True)，虚拟损失等直接读写共享的数组。
+
+    注意: 这是 Python 线程，选择和回传始终是串行的，只有 rollout 释放 GIL 时才会真正重叠。
+    配合 ProcessPoolRolloutExecutor 时线程在等待子进程结果期间释放 GIL，可以获得加速；
+    进程内的 rollout (step / rollout_fast，以及 MCTS_ROLLOUT_BATCH_SIZE 较小时的向量化引擎)
+    几乎不释放 GIL，此时不会比单线程的 MCTS 更快。
+
+    不支持置换表: 正在 rollout 的节点尚未被访问，其他线程可能已经在它下面添加了子节点，
+    若再经由置换边把它当作叶子选中，会被重复展开。
+    """
+    def __init__(self, *args, num_threads=4, **kwargs):
+        if kwargs.get("transposition", False):
+            raise ValueError("TreeParallelMCTS 不支持置换表 (transposition=True)")
+        kwargs.setdefault("compact_store", True)
+        super().__init__(*args, **kwargs)
+        self.num_threads = num_threads
+        self._lock = threading.Lock()
+        self._iterations_started = 0
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                if self._out_of_budget(self._iterations_started) and self._has_answer():
+                    return
+                self._iterations_started += 1
+                path = self._select(self.root_node)
+                leaf_node = path[-1]
+                for node in path:
+                    node.virtual_loss += 1
+                self.expand_node(leaf_node)
+                # 在锁内完成局面推算 (识别)，锁外只运行 rollout
+                self.node_clz.prepare_batch([leaf_node])
+                leaf_node.available_actions
+
+            reward = self.simulate(leaf_node)
+
+            with self._lock:
+                for node in path:
+                    node.virtual_loss -= 1
+                self.backpropagate(leaf_node, reward, path)
+                self._update_q_upwards(leaf_node, *self._transposed_parents)
+                self._transposed_parents.clear()
+                print(f"MCTS Iteration {self.iterations_done} path: {path} reward: {reward}")
+                self.iterations_done += 1
+
+    def run(self, iterations=None, *, time_budget=None, deadline=None, node_budget=None):
+        self._set_budget(iterations, time_budget, deadline, node_budget)
+        self._iterations_started = 0
+        self.iterations_done = 0
+        threads = [threading.Thread(target=self._worker) for _ in range(self.num_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.best_child(self.root_node)
@@ -0,0 +1,61 @@
+import multiprocessing
+import random
+
+
+def _init_worker(seed):
+    # 每个进程启动时先设置一个确定的种子，具体任务会再按任务序号重新设置
+    random.seed(seed)
+
+
+class SerialRolloutExecutor:
+    """在主进程中串行执行 rollout，行为与 MCTS.simulate 的默认实现一致"""
+    def __init__(self, rollout_policy):
+        self.rollout_policy = rollout_policy
+
+    def evaluate(self, node, iterations) -> float:
+        total_reward = 0
+        for _ in range(iterations):
+            total_reward += self.rollout_policy(node)
+        return total_reward / iterations
+
+    def close(self):
+        pass
+
+
+class ProcessPoolRolloutExecutor:
+    """
+    基于常驻进程池的并行 rollout
+
+    只把 state_fn(node) 得到的紧凑状态(例如 hidden state 的 dict)发送给子进程，
+    不传输节点本身及其图像。
+    worker_fn(payload, iterations, seed) 需为模块级函数，返回 iterations 局的总回报。
+    每个任务的种子由 seed 和任务序号决定，因此结果与调度到哪个进程无关，可复现。
+    """
+    def __init__(self, state_fn, worker_fn, processes=None, seed=0):
+        self.state_fn = state_fn
+        self.worker_fn = worker_fn
+        self.processes = processes or multiprocessing.cpu_count()
+        self.seed = seed
+        self._task_counter = 0
+        self._pool = multiprocessing.Pool(self.processes, initializer=_init_worker, initargs=(seed,))
+
+    def evaluate(self, node, iterations) -> float:
+        payload = self.state_fn(node)
+        num_chunks = min(self.processes, iterations)
+        chunk_sizes = [iterations // num_chunks + (1 if k < iterations % num_chunks else 0) for k in range(num_chunks)]
+        tasks = []
+        for chunk_size in chunk_sizes:
+            tasks.append((payload, chunk_size, self.seed * 1_000_003 + self._task_counter))
+            self._task_counter += 1
+        totals = self._pool.starmap(self.worker_fn, tasks)
+        return sum(totals) / iterations
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
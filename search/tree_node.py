@@ -1,17 +1,148 @@
+from search.action_pool import UntriedActionPool
 
 
 class TreeNode:
+    # 使用 __slots__ 而不是 __dict__，挂载到 NodeStore 后节点只是 (store, idx) 的薄视图
+    __slots__ = (
+        "state", "action", "_store", "_idx",
+        "_visits", "_rewards", "_best_q", "_local_rollout_q", "_local_virtual_loss",
+        "_available_actions", "_action_weights", "_untried_actions", "_tried_action_num",
+        "rollout_n", "_rollout_mean", "_rollout_m2",
+    )
+
     def __init__(self, state, action=None):
         self.state = state
         self.action = action
-        self.visits = 0
-        self.rewards = 0.0
+        # 挂载到 NodeStore 后，统计量改为读写 store 中的数组，下列字段不再使用
+        self._store = None
+        self._idx = -1
+        self._visits = 0
+        self._rewards = 0.0
         self._best_q = float("-inf")
-        self._rollout_q = None
-        self._best_q_without_rollout = float("-inf")
+        self._local_rollout_q = None
+        self._local_virtual_loss = 0  # 批量/并行选择时尚未回传结果的访问次数
         self._available_actions = None
         self._action_weights = None
+        self._untried_actions = None
         self._tried_action_num = 0
+        # 节点自身 rollout 回报的样本数、均值和离差平方和 (Welford)，用于估计方差
+        self.rollout_n = 0
+        self._rollout_mean = 0.0
+        self._rollout_m2 = 0.0
+
+    def attach_store(self, store, idx):
+        """由 NodeStore.add_node 调用，之后统计量保存在 store 的数组中"""
+        self._store = store
+        self._idx = idx
+
+    def detach_store(self):
+        """将统计量从 store 复制回节点对象，节点重新独立"""
+        if self._store is None:
+            return
+        visits, rewards, best_q = self.visits, self.rewards, self.best_q
+        rollout_q, virtual_loss = self._rollout_q, self.virtual_loss
+        self._store = None
+        self._idx = -1
+        self._visits, self._rewards, self._best_q = visits, rewards, best_q
+        self._local_rollout_q, self._local_virtual_loss = rollout_q, virtual_loss
+
+    def __getstate__(self):
+        # pickle 时(如根并行发送根节点)不带上整个 store，只保留本节点的统计量
+        state = dict(getattr(self, "__dict__", {}))  # 未声明 __slots__ 的子类
+        for cls in type(self).__mro__:
+            for name in getattr(cls, "__slots__", ()):
+                if hasattr(self, name):
+                    state[name] = getattr(self, name)
+        if self._store is not None:
+            state.update(
+                _store=None, _idx=-1, _visits=self.visits, _rewards=self.rewards, _best_q=self.best_q,
+                _local_rollout_q=self._rollout_q, _local_virtual_loss=self.virtual_loss,
+            )
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    @property
+    def visits(self):
+        if self._store is None:
+            return self._visits
+        return int(self._store.visits[self._idx])
+
+    @visits.setter
+    def visits(self, value):
+        if self._store is None:
+            self._visits = value
+        else:
+            self._store.visits[self._idx] = value
+
+    @property
+    def rewards(self):
+        if self._store is None:
+            return self._rewards
+        return float(self._store.rewards[self._idx])
+
+    @rewards.setter
+    def rewards(self, value):
+        if self._store is None:
+            self._rewards = value
+        else:
+            self._store.rewards[self._idx] = value
+
+    @property
+    def virtual_loss(self):
+        if self._store is None:
+            return self._local_virtual_loss
+        return int(self._store.virtual_loss[self._idx])
+
+    @virtual_loss.setter
+    def virtual_loss(self, value):
+        if self._store is None:
+            self._local_virtual_loss = value
+        else:
+            self._store.virtual_loss[self._idx] = value
+
+    @property
+    def _rollout_q(self):
+        """节点自身 rollout 的结果，尚未 rollout 时为 None"""
+        if self._store is None:
+            return self._local_rollout_q
+        value = self._store.rollout_q[self._idx]
+        return None if value != value else float(value)
+
+    @_rollout_q.setter
+    def _rollout_q(self, value):
+        if self._store is None:
+            self._local_rollout_q = value
+        else:
+            self._store.rollout_q[self._idx] = float("nan") if value is None else value
+
+    def add_rollout_samples(self, rewards):
+        """记录一批 rollout 回报 (合并到已有的均值和离差平方和中)"""
+        n = len(rewards)
+        if n == 0:
+            return
+        mean = sum(rewards) / n
+        m2 = sum((r - mean) ** 2 for r in rewards)
+        total = self.rollout_n + n
+        delta = mean - self._rollout_mean
+        self._rollout_m2 += m2 + delta * delta * self.rollout_n * n / total
+        self._rollout_mean += delta * n / total
+        self.rollout_n = total
+
+    @property
+    def rollout_var(self):
+        """rollout 回报的样本方差，样本不足两个时为 None"""
+        if self.rollout_n < 2:
+            return None
+        return self._rollout_m2 / (self.rollout_n - 1)
+
+    @property
+    def rollout_se(self):
+        """rollout 均值的标准误差，样本不足两个时为 inf"""
+        var = self.rollout_var
+        return float("inf") if var is None else (var / self.rollout_n) ** 0.5
 
     def is_terminal(self):
         """判断当前节点是否是目标节点"""
@@ -19,7 +150,6 @@ class TreeNode:
 
     def expand_for_next_actions(self):
         """对节点展开，这通常意味着要计算其所有可用的动作"""
-        self._expanded = True
         if self._available_actions is None:
             self._available_actions = self.get_possible_actions()
             self._action_weights = self.get_action_weights()
@@ -34,6 +164,13 @@ class TreeNode:
     def available_actions_and_weights(self):
         return self._available_actions, self._action_weights
 
+    @property
+    def untried_actions(self) -> UntriedActionPool:
+        """尚未创建子节点的动作池，按先验权重不放回采样"""
+        if self._untried_actions is None:
+            self._untried_actions = UntriedActionPool(self.available_actions, self._action_weights)
+        return self._untried_actions
+
     def get_possible_actions(self):
         # 这里需要根据具体问题定义可能的动作
         # 例如，在棋盘游戏中，可能是所有合法的走法
@@ -44,6 +181,15 @@ class TreeNode:
         # 例如，可以是每个动作的先验概率
         return [1.0, 1.0, 1.0]  # 示例权重
 
+    def state_key(self):
+        """局面的哈希 key，用于 MCTS 置换表；返回 None 表示不参与合并"""
+        return None
+
+    @classmethod
+    def prepare_batch(cls, nodes):
+        """批量展开前的钩子，子类可在此对一批叶子节点统一做耗时计算(如批量识别)"""
+        pass
+
     def is_fully_expanded(self):
         return self._available_actions is not None and len(self._available_actions) <= self._tried_action_num
 
@@ -59,11 +205,16 @@ class TreeNode:
         
         如果子节点没有被完全探索，初次 rollout_q 也计入其中
         如果子节点已经全部探索完，则取所有子节点"""
-        return self._best_q
+        if self._store is None:
+            return self._best_q
+        return float(self._store.best_q[self._idx])
 
     def set_best_q(self, q: float):
         """设置子节点的最优 Q 值"""
-        self._best_q = q
+        if self._store is None:
+            self._best_q = q
+        else:
+            self._store.best_q[self._idx] = q
 
     # def update_q(self, reward: float, is_fully_explored: bool):
     #     """更新 Q 值"""
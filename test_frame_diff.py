@@ -0,0 +1,53 @@
+import numpy as np
+from PIL import Image
+
+from app.yang.yang_constants import FRAME_DIFF_CONFIG
+from controller.perceive.frame_diff import FrameDiffGate
+
+
+def board(icons, width=700, height=600, card=90):
+    """7 列的卡牌网格，卡牌的图案 (横条) 位置随种类变化"""
+    im = np.full((height, width, 3), 200, dtype=np.uint8)
+    for i, k in enumerate(icons):
+        x, y = 10 + (i % 7) * 98, 10 + (i // 7) * 98
+        im[y:y + card, x:x + card] = 235
+        im[y:y + card, x:x + 3] = 60
+        im[y:y + 3, x:x + card] = 60
+        im[y + 20 + 3 * k:y + 35 + 3 * k, x + 20:x + 70] = 80
+    return im
+
+
+def make_gate():
+    config = dict(FRAME_DIFF_CONFIG, region=None)
+    return FrameDiffGate(**config)
+
+
+def test_single_revealed_card_is_not_skipped():
+    rng = np.random.default_rng(0)
+    icons = list(rng.integers(0, 16, 42))
+    revealed = list(icons)
+    revealed[17] = (icons[17] + 2) % 16  # 翻出的卡牌与原卡牌外观相近
+    before, after = Image.fromarray(board(icons)), Image.fromarray(board(revealed))
+
+    gate = make_gate()
+    # 整图平均的差异远低于阈值，按格子取最大值才能发现变化
+    assert np.abs(gate.thumbnail(before) - gate.thumbnail(after)).mean() < 1.0
+    assert gate.update(before)
+    assert not gate.update(before)
+    # 变化的一帧先等待画面稳定 (settle_frames=1)，下一帧即识别，而不是等到 max_idle_frames
+    assert not gate.update(after)
+    assert gate.update(after)
+    assert not gate.update(after)
+
+
+def test_static_frames_with_noise_are_skipped():
+    rng = np.random.default_rng(1)
+    icons = list(rng.integers(0, 16, 42))
+    image = board(icons).astype(np.int16)
+    gate = make_gate()
+    results = []
+    for _ in range(10):
+        noisy = np.clip(image + rng.normal(0, 3, image.shape), 0, 255).astype(np.uint8)
+        results.append(gate.update(Image.fromarray(noisy)))
+    assert results == [True] + [False] * 9
+    assert gate.skipped == 9
@@ -0,0 +1,136 @@
+import pickle
+import random
+
+import pytest
+
+from search.mcts import MCTS
+from search.node_store import NodeStore
+from search.parallel_mcts import TreeParallelMCTS, merge_root_stats, select_root_action
+from search.tree_node import TreeNode
+
+DEPTH = 4
+BRANCH = 3
+
+
+class ToyNode(TreeNode):
+    """state 为已选动作的元组，点击顺序不同但动作集合相同的局面视为同一局面"""
+    def __init__(self, state, action=None):
+        super().__init__(state if action is None else state + (action,), action)
+
+    def get_possible_actions(self):
+        return [] if len(self.state) >= DEPTH else list(range(BRANCH))
+
+    def get_action_weights(self):
+        return [1.0] * len(self.get_possible_actions())
+
+    def state_key(self):
+        return tuple(sorted(self.state))
+
+
+def toy_rollout_policy(node):
+    return sum(node.state) + random.random()
+
+
+def reference_best_q(mcts, node, memo):
+    """按定义对整棵树(图)重新计算 best q，用于与增量维护的结果对比"""
+    if node in memo:
+        return memo[node]
+    if len(node.available_actions) == 0:
+        q = node._rollout_q
+    else:
+        q_of_children = [reference_best_q(mcts, child, memo) for child in mcts.children.get(node, []) if child.is_visited()]
+        if not node.is_fully_expanded() or not q_of_children:
+            q_of_children.append(node._rollout_q)
+        q = max(q_of_children)
+    memo[node] = q
+    return q
+
+
+@pytest.mark.parametrize("transposition", [False, True])
+@pytest.mark.parametrize("compact_store", [False, True])
+@pytest.mark.parametrize("expand_batch_size", [1, 4])
+def test_incremental_best_q_matches_full_recompute(transposition, compact_store, expand_batch_size):
+    random.seed(0)
+    root = ToyNode(())
+    mcts = MCTS(root, rollout_policy=toy_rollout_policy, node_clz=ToyNode, expand_batch_size=expand_batch_size,
+                transposition=transposition, compact_store=compact_store)
+    for _ in range(5):
+        mcts.run(40)
+        memo = {}
+        visited = [node for node in mcts.children.keys() if node.is_visited()]
+        assert visited
+        for node in visited:
+            assert node.best_q == reference_best_q(mcts, node, memo)
+
+
+@pytest.mark.parametrize("compact_store", [False, True])
+def test_tree_parallel_consistent_stats(compact_store):
+    random.seed(0)
+    root = ToyNode(())
+    mcts = TreeParallelMCTS(root, rollout_policy=toy_rollout_policy, node_clz=ToyNode, num_threads=4,
+                            compact_store=compact_store)
+    mcts.run(200)
+    assert mcts.iterations_done >= 200
+    assert root.visits == mcts.iterations_done
+    memo = {}
+    for node in mcts.children.keys():
+        assert node.virtual_loss == 0
+        if node.is_visited():
+            assert node.best_q == reference_best_q(mcts, node, memo)
+        if len(node.available_actions) > 0:
+            # 每次迭代只经过一条路径: 非终局节点的访问数 = 自身 rollout 1 次 + 子节点访问数之和
+            assert node.visits == 1 + sum(child.visits for child in mcts.children[node])
+
+
+def test_tree_parallel_rejects_transposition():
+    with pytest.raises(ValueError):
+        TreeParallelMCTS(ToyNode(()), rollout_policy=toy_rollout_policy, node_clz=ToyNode, transposition=True)
+
+
+@pytest.mark.parametrize("compact_store", [False, True])
+def test_reroot_rekeys_transposition_table(compact_store):
+    random.seed(0)
+    root = ToyNode(())
+    mcts = MCTS(root, rollout_policy=toy_rollout_policy, node_clz=ToyNode, transposition=True,
+                compact_store=compact_store)
+    mcts.run(40)
+    new_root = mcts.children[root][0]
+    old_key = new_root.state_key()
+    new_root.state = ()  # 复用子树时替换为新识别的局面
+    mcts.reroot(new_root)
+    assert mcts.table[()] is new_root
+    assert old_key not in mcts.table
+    assert all(node is new_root or node in mcts.children for node in mcts.table.values())
+    mcts.run(20)
+
+
+def test_root_parallel_selects_by_pooled_visits():
+    # 动作 "b" 只在一个进程中被访问 2 次且恰好得到高分，不应因为 best_q 的最大值被选中
+    stats_list = [
+        {"a": (60, 540.0, 11.0), "b": (2, 30.0, 15.0)},
+        {"a": (55, 500.0, 10.5), "b": (5, 40.0, 9.0)},
+        {"a": (58, 520.0, 10.8), "b": (4, 30.0, 8.5)},
+    ]
+    merged = merge_root_stats(stats_list)
+    assert merged["a"]["visits"] == 173 and merged["b"]["rewards"] == 100.0
+    assert merged["b"]["best_q"] == 15.0  # 仍保留用于显示
+    assert select_root_action(merged) == "a"
+    # 访问次数相同时按平均回报
+    assert select_root_action({"a": {"visits": 3, "rewards": 3.0, "best_q": 9.0},
+                               "b": {"visits": 3, "rewards": 6.0, "best_q": 2.0}}) == "b"
+
+
+def test_nodes_are_slotted_and_pickle_without_store():
+    assert not hasattr(TreeNode(None), "__dict__")
+    store = NodeStore()
+    node = TreeNode(None, action=1)
+    store.add_node(node)
+    node.visits, node.rewards, node.virtual_loss = 3, 1.5, 0
+    node.set_best_q(0.5)
+    copied = pickle.loads(pickle.dumps(node))
+    assert copied._store is None and copied._idx == -1
+    assert (copied.action, copied.visits, copied.rewards, copied.best_q) == (1, 3, 1.5, 0.5)
+
+    # 未声明 __slots__ 的子类同样可以 pickle
+    toy = pickle.loads(pickle.dumps(ToyNode((), action=2)))
+    assert toy.state == (2,) and toy.action == 2
@@ -1,6 +1,7 @@
 import random
 import time
-from copy import deepcopy
+from bisect import bisect
+from itertools import accumulate
 
 def step(hstate):
     # print("in step, hstate=", hstate)
@@ -102,12 +103,173 @@ def step(hstate):
 
     return False
 
+def priority_rule(total_num, queue_num, empty_slot_num):
+    """与 step 中相同的移动优先级规则，用于生成 PRIORITY_TABLE"""
+    # 若局面同类型数量出现 3
+    if total_num >= 3:
+        # 若 queue 已有 2,1,0 个
+        if queue_num == 2:
+            return 901
+        elif queue_num == 1 and empty_slot_num >= 2:
+            return 802
+        elif queue_num == 0 and empty_slot_num >= 3:
+            return 703
+    # 若局面同类型数量出现 2
+    elif total_num == 2:
+        # 若 queue 已有 1,0 个
+        if queue_num == 1:
+            return 601
+        elif queue_num == 0:
+            return 501
+    # 若局面同类型数量出现 1
+    elif total_num == 1:
+        # 仅 queue 为 0 可移动
+        if queue_num == 0:
+            return 101
+    return 0
+
+
+# 预计算的优先级表，下标为 total * 16 + queue * 4 + empty:
+#   total: 局面数量截断到 [0, 3]; queue: 队列数量 0/1/2，其余记为 3; empty: 空格数截断到 [0, 3]
+# 规则只依赖这几个取值，截断后结果与 priority_rule 完全相同
+PRIORITY_TABLE = [
+    priority_rule(total_num, queue_num, empty_slot_num)
+    for total_num in range(4) for queue_num in range(4) for empty_slot_num in range(4)
+]
+
+
+def _priority_key(total_num, queue_num):
+    """PRIORITY_TABLE 下标中与空格数无关的部分"""
+    t = total_num if 0 <= total_num < 3 else (3 if total_num > 0 else 0)
+    q = queue_num if 0 <= queue_num < 3 else 3
+    return t * 16 + q * 4
+
+
+# 按空格数 (截断到 [0, 3]) 拆分的优先级表: _PRIORITY_BY_EMPTY[e][_priority_key(total, queue)]
+_PRIORITY_BY_EMPTY = [
+    [PRIORITY_TABLE[key + e] if key % 4 == 0 else 0 for key in range(64)]
+    for e in range(4)
+]
+
+
+def rollout_fast(hstate):
+    """
+    查表版本的 rollout，等价于 while not step(hstate): pass
+
+    - 优先级通过 PRIORITY_TABLE 查表得到，每种卡牌的表下标只在其数量变化时更新
+    - 状态在局部列表中推进，结束时写回 hstate (原地修改)
+    - random 的调用顺序和参数与 step 完全相同 (random.choices 按其实现展开)，
+      因此在相同的随机种子下结果逐位一致，打印信息也相同
+    返回最终分数。
+    """
+    pool = hstate["pool"]
+    rows = [pool[k] for k in range(len(pool))]
+    n = len(rows)
+    totals = [row[0] for row in rows]
+    queues = [row[1] for row in rows]
+    uncovered = [row[2] for row in rows]
+    empty_slot_num = hstate["queue_empty_slot"]
+    available_choice = hstate["pool_available_choice"]
+    score = hstate["score"]
+    keys = [_priority_key(totals[k], queues[k]) for k in range(n)]
+    rand = random.random
+    hi = n - 1
+
+    def sync():
+        # 写回 hstate，用于打印以及结束时返回
+        for k in range(n):
+            row = rows[k]
+            row[0], row[1], row[2] = totals[k], queues[k], uncovered[k]
+        hstate["queue_empty_slot"] = empty_slot_num
+        hstate["pool_available_choice"] = available_choice
+        hstate["score"] = score
+
+    # 队列数量只会在初始状态中 >= 3 (移动后满 3 张立即消除)，规则检查只需在这之后进行
+    need_rule = max(queues) >= 3
+    while True:
+        # 尝试应用规则
+        if need_rule:
+            for chk_idx in range(n):
+                if queues[chk_idx] >= 3:
+                    totals[chk_idx] -= 3
+                    queues[chk_idx] -= 3
+                    uncovered[chk_idx] -= 3
+                    empty_slot_num += 3
+                    score += 1
+                    keys[chk_idx] = _priority_key(totals[chk_idx], queues[chk_idx])
+                    print("Hited chk idx", chk_idx)
+                    if uncovered[chk_idx] < 0:
+                        sync()
+                        print("Fix1 negative left cards:", hstate)
+                        uncovered[chk_idx] = 0
+            need_rule = max(queues) >= 3
+
+        if empty_slot_num == 0:
+            break  # no more moves
+        e = empty_slot_num if 0 <= empty_slot_num < 3 else (3 if empty_slot_num > 0 else 0)
+        q = list(map(_PRIORITY_BY_EMPTY[e].__getitem__, keys))
+
+        # 选择 q 值最大的进行移动
+        max_q = max(q)
+        if max_q == 0:
+            break  # terminal state
+        if q.count(max_q) == 1:
+            argmax_idx = [q.index(max_q)]
+        else:
+            argmax_idx = [idx for idx, v in enumerate(q) if v == max_q]
+        op_idx = random.choice(argmax_idx)
+
+        # 展示移动
+        queues[op_idx] += 1
+        empty_slot_num -= 1
+
+        # 尝试消除
+        available_choice -= 1
+        if queues[op_idx] == 3:
+            totals[op_idx] -= 3
+            queues[op_idx] = 0
+            uncovered[op_idx] -= 3
+            empty_slot_num += 3
+            score += 1
+            # 修正负数剩余牌
+            if uncovered[op_idx] < 0:
+                sync()
+                print("Fix2 negative left cards:", hstate)
+                uncovered[op_idx] = 0
+        keys[op_idx] = _priority_key(totals[op_idx], queues[op_idx])
+
+        # 对 pool 进行概率盲盒
+        pick_cnt = 1 if rand() < 0.5 else 0
+        if available_choice == 0:
+            pick_cnt = 1
+        elif available_choice < 8:
+            pick_cnt = random.randint(0, 2)
+
+        # 开盲盒加牌: 根据剩余牌数确定概率
+        for _ in range(pick_cnt):
+            cum_weights = list(accumulate(uncovered))
+            if cum_weights[-1] == 0:
+                continue
+            if cum_weights[-1] < 0:
+                # 与 step 一致地抛出异常
+                random.choices(range(n), weights=uncovered, k=1)
+            # 与 random.choices(population, weights, k=1) 的实现相同
+            pick_idx = bisect(cum_weights, rand() * (cum_weights[-1] + 0.0), 0, hi)
+            totals[pick_idx] += 1
+            uncovered[pick_idx] -= 1
+            available_choice += 1
+            keys[pick_idx] = _priority_key(totals[pick_idx], queues[pick_idx])
+
+    sync()
+    return score
+
+
 def loop_for_rewards(init_hstate, loop_num=100):
-    hstate_dict = init_hstate._hstate
+    hstate_dict = init_hstate.to_dict()
     total_score = 0
     tic = time.time_ns() / 1000000
     for k in range(loop_num):
-        hstate = deepcopy(hstate_dict)
+        hstate = init_hstate.to_dict()
         while not (is_terminal := step(hstate)):
             pass
             # print(".", end="")
@@ -0,0 +1,168 @@
+import glob
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.yang.yang_detector_backends import (
+    Detections, OnnxBackend, compare_detections, letterbox, nms, postprocess, to_rgb_array,
+)
+
+MODEL_PATH = os.environ.get("YANG_DETECTOR_MODEL", "runs/detect/train3/weights/best.pt")
+IMAGE_DIR = os.environ.get("YANG_DETECTOR_IMAGES", "datasets/yang_v1/images/val")
+
+
+def test_letterbox_matches_ultralytics_shapes():
+    # ultralytics 对 1920x1080 的帧以 imgsz=640 推理时输入为 384x640，上下各填充 12
+    im = np.zeros((1080, 1920, 3), dtype=np.uint8)
+    padded, ratio, pad = letterbox(im, 640, auto=True)
+    assert padded.shape == (384, 640, 3)
+    assert ratio == pytest.approx(1 / 3)
+    assert pad == (0, 12)
+    assert (padded[:12] == 114).all() and (padded[-12:] == 114).all()
+
+    padded, ratio, pad = letterbox(im, 640)
+    assert padded.shape == (640, 640, 3)
+    assert pad == (0, 140)
+
+
+def reference_nms(boxes, scores, iou_threshold):
+    keep = []
+    for i in np.argsort(-scores, kind="stable"):
+        ok = True
+        for j in keep:
+            x1, y1 = max(boxes[i, 0], boxes[j, 0]), max(boxes[i, 1], boxes[j, 1])
+            x2, y2 = min(boxes[i, 2], boxes[j, 2]), min(boxes[i, 3], boxes[j, 3])
+            inter = max(x2 - x1, 0) * max(y2 - y1, 0)
+            union = np.prod(boxes[i, 2:] - boxes[i, :2]) + np.prod(boxes[j, 2:] - boxes[j, :2]) - inter
+            if inter / union > iou_threshold:
+                ok = False
+                break
+        if ok:
+            keep.append(i)
+    return keep
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_nms_matches_reference(seed):
+    rng = np.random.default_rng(seed)
+    xy = rng.uniform(0, 200, (60, 2))
+    boxes = np.concatenate([xy, xy + rng.uniform(10, 60, (60, 2))], axis=1)
+    scores = rng.permutation(60) / 60.0
+    assert nms(boxes, scores, 0.45).tolist() == reference_nms(boxes, scores, 0.45)
+
+
+def test_postprocess_maps_boxes_and_applies_per_class_nms():
+    # (4 + nc, N) 的原始输出，nc = 2，坐标为 letterbox 后的 cx, cy, w, h
+    output = np.zeros((6, 4), dtype=np.float32)
+    output[:4, 0], output[4, 0] = (100, 112, 40, 40), 0.9  # 类别 0
+    output[:4, 1], output[4, 1] = (102, 112, 40, 40), 0.8  # 与上一个框同类别且重叠，被抑制
+    output[:4, 2], output[5, 2] = (102, 112, 40, 40), 0.7  # 不同类别，保留
+    output[:4, 3], output[4, 3] = (300, 200, 40, 40), 0.1  # 低于置信度阈值
+    boxes, scores, cls = postprocess(output, 0.5, (0, 12), (720, 1280, 3), conf=0.25, iou=0.7)
+    assert cls.tolist() == [0, 1]
+    assert scores == pytest.approx([0.9, 0.7])
+    assert boxes[0] == pytest.approx([160, 160, 240, 240])
+    assert boxes[1] == pytest.approx([164, 160, 244, 240])
+
+
+class FakeSession:
+    """输出一个位于输入中心、大小为输入 1/4 的类别 0 框，置信度为输入的均值"""
+    def __init__(self):
+        self.batch_sizes = []
+
+    def run(self, output_names, feeds):
+        blob = feeds["images"]
+        self.batch_sizes.append(len(blob))
+        n, _, h, w = blob.shape
+        output = np.zeros((n, 6, 1), dtype=np.float32)
+        output[:, :4, 0] = (w / 2, h / 2, w / 4, h / 4)
+        output[:, 4, 0] = blob.mean(axis=(1, 2, 3))
+        return [output]
+
+
+def fake_backend(fixed_shape=None):
+    backend = OnnxBackend.__new__(OnnxBackend)
+    backend.session = FakeSession()
+    backend.input_name = "images"
+    backend.fixed_shape = fixed_shape
+    backend.names = {0: "a", 1: "b"}
+    backend.conf = 0.0
+    backend.iou = 0.7
+    return backend
+
+
+def random_images(rng, shapes):
+    return [rng.integers(1, 256, shape + (3,), dtype=np.uint8) for shape in shapes]
+
+
+def assert_same_detections(a, b):
+    assert len(a) == len(b)
+    for x, y in zip(a, b):
+        assert np.allclose(x.xyxy, y.xyxy) and np.allclose(x.conf, y.conf, atol=1e-6)
+        assert np.array_equal(x.cls, y.cls)
+
+
+def test_dynamic_onnx_predict_runs_one_batch():
+    rng = np.random.default_rng(0)
+    images = random_images(rng, [(300, 500)] * 4)
+    backend = fake_backend()
+    single = [backend.predict([image])[0] for image in images]
+    batch = backend.predict(images)
+    assert backend.session.batch_sizes == [1, 1, 1, 1, 4]
+    assert_same_detections(single, batch)
+
+
+def test_dynamic_onnx_predict_mixed_shapes():
+    rng = np.random.default_rng(1)
+    images = random_images(rng, [(300, 500), (400, 200), (123, 77)])
+    backend = fake_backend()
+    detections = backend.predict(images, imgsz=320)
+    assert backend.session.batch_sizes == [3]
+    for image, det in zip(images, detections):
+        # 尺寸不同时统一填充到 imgsz 的正方形，输入中心对应原图中心
+        cx, cy = (det.xyxy[0, 0] + det.xyxy[0, 2]) / 2, (det.xyxy[0, 1] + det.xyxy[0, 3]) / 2
+        assert cx == pytest.approx(image.shape[1] / 2, abs=1) and cy == pytest.approx(image.shape[0] / 2, abs=1)
+
+
+def test_fixed_shape_onnx_predict_runs_per_image():
+    rng = np.random.default_rng(2)
+    images = random_images(rng, [(300, 500)] * 3)
+    backend = fake_backend(fixed_shape=(640, 640))
+    detections = backend.predict(images, imgsz=320)
+    assert backend.session.batch_sizes == [1, 1, 1]
+    assert all(isinstance(det, Detections) and len(det) == 1 for det in detections)
+
+
+@pytest.mark.parametrize("mode", ["RGBA", "L", "P"])
+def test_onnx_predict_converts_image_mode(mode):
+    # 截图可能带 alpha 通道或为灰度/调色板模式，应与转换为 RGB 后的结果一致
+    rng = np.random.default_rng(3)
+    image = Image.fromarray(random_images(rng, [(120, 160)])[0]).convert(mode)
+    assert to_rgb_array(image).shape == (120, 160, 3)
+    rgb = image.convert("RGB")
+    backend = fake_backend()
+    assert_same_detections(backend.predict([image]), backend.predict([rgb]))
+    if mode == "RGBA":
+        assert_same_detections(backend.predict([np.asarray(image)]), backend.predict([rgb]))
+
+
+def test_onnx_matches_ultralytics():
+    pytest.importorskip("torch")
+    pytest.importorskip("ultralytics")
+    pytest.importorskip("onnxruntime")
+    if not os.path.exists(MODEL_PATH):
+        pytest.skip(f"model not found: {MODEL_PATH} (set YANG_DETECTOR_MODEL)")
+    paths = sorted(glob.glob(os.path.join(IMAGE_DIR, "*.png")))[:20]
+    if not paths:
+        pytest.skip(f"no images in {IMAGE_DIR} (set YANG_DETECTOR_IMAGES)")
+    from app.yang.yang_detector_backends import UltralyticsBackend, export_onnx
+
+    images = [Image.open(path).convert("RGB") for path in paths]
+    torch_backend, onnx_backend = UltralyticsBackend(MODEL_PATH), OnnxBackend(export_onnx(MODEL_PATH))
+    refs = [torch_backend.predict([image])[0] for image in images]
+    for dets in ([onnx_backend.predict([image])[0] for image in images], onnx_backend.predict(images)):
+        num_ref, num_matched, max_diff = compare_detections(refs, dets)
+        assert num_matched >= 0.99 * num_ref
+        assert max_diff < 2.0
@@ -0,0 +1,115 @@
+import contextlib
+import copy
+import io
+
+import pytest
+
+import test_rollout
+from app.yang.logic.yang_endgame import YangEndgameEvaluator
+from app.yang.yang_hstate import YangHiddenState
+from test_rollout import step
+
+
+class _Branch(Exception):
+    def __init__(self, num_options):
+        self.num_options = num_options
+
+
+class ScriptedRandom:
+    """
+    代替 test_rollout 中的 random 模块: 按给定的分支序号依次做出随机选择，并累计该路径的概率
+    遇到序号之外的新选择时抛出 _Branch，由调用方展开所有分支
+    """
+    def __init__(self, branches):
+        self.branches = branches
+        self.pos = 0
+        self.prob = 1.0
+
+    def _pick(self, options):
+        if self.pos >= len(self.branches):
+            raise _Branch(len(options))
+        value, prob = options[self.branches[self.pos]]
+        self.pos += 1
+        self.prob *= prob
+        return value
+
+    def random(self):
+        return self._pick([(0.0, 0.5), (0.75, 0.5)])
+
+    def randint(self, a, b):
+        return self._pick([(v, 1 / (b - a + 1)) for v in range(a, b + 1)])
+
+    def choice(self, seq):
+        return self._pick([(v, 1 / len(seq)) for v in seq])
+
+    def choices(self, population, weights, k=1):
+        total = sum(weights)
+        return [self._pick([(v, w / total) for v, w in zip(population, weights) if w > 0])]
+
+
+def step_outcomes(hstate: dict, monkeypatch):
+    """枚举一次 step 的所有随机分支，返回 (是否结束, 之后的局面, 概率) 列表"""
+    outcomes = []
+    stack = [[]]
+    while stack:
+        branches = stack.pop()
+        rng = ScriptedRandom(branches)
+        monkeypatch.setattr(test_rollout, "random", rng)
+        state = copy.deepcopy(hstate)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                done = step(state)
+        except _Branch as e:
+            stack.extend(branches + [k] for k in range(e.num_options))
+            continue
+        outcomes.append((done, state, rng.prob))
+    return outcomes
+
+
+def state_key(hstate: dict):
+    return (tuple(tuple(v) for v in hstate["pool"].values()), hstate["pool_available_choice"],
+            hstate["queue_empty_slot"], hstate["score"])
+
+
+def brute_force_expected_score(hstate: dict, monkeypatch) -> float:
+    """逐步展开 step 的局面分布 (相同局面合并概率)，返回最终分数的精确期望"""
+    expected, total_prob = 0.0, 0.0
+    frontier = {state_key(hstate): (hstate, 1.0)}
+    while frontier:
+        next_frontier = {}
+        for state, prob in frontier.values():
+            for done, next_state, p in step_outcomes(state, monkeypatch):
+                if done:
+                    expected += prob * p * next_state["score"]
+                    total_prob += prob * p
+                    continue
+                key = state_key(next_state)
+                next_prob = next_frontier.get(key, (next_state, 0.0))[1] + prob * p
+                next_frontier[key] = (next_state, next_prob)
+        frontier = next_frontier
+    assert total_prob == pytest.approx(1.0)
+    return expected
+
+
+def tiny_hstate(rows, available_choice, empty_slot, score=0):
+    return {
+        "pool": {k: list(rows[k]) if k < len(rows) else [0, 0, 0] for k in range(16)},
+        "pool_available_choice": available_choice,
+        "queue_empty_slot": empty_slot,
+        "score": score,
+    }
+
+
+TINY_HSTATES = [
+    tiny_hstate([[2, 0, 1], [1, 0, 2]], 3, 7),
+    tiny_hstate([[2, 0, 1], [2, 0, 1], [1, 1, 2]], 5, 6),
+    tiny_hstate([[1, 1, 1], [2, 0, 1], [1, 0, 2]], 4, 3, score=1),
+    tiny_hstate([[3, 2, 0], [1, 0, 2]], 2, 2),
+]
+
+
+@pytest.mark.parametrize("hstate", TINY_HSTATES)
+def test_value_matches_brute_force_enumeration_of_step(hstate, monkeypatch):
+    evaluator = YangEndgameEvaluator()
+    value = evaluator.value(YangHiddenState(hstate))
+    assert value == pytest.approx(brute_force_expected_score(hstate, monkeypatch))
@@ -0,0 +1,98 @@
+import contextlib
+import io
+import pickle
+import random
+from collections import Counter
+
+import pytest
+
+from app.yang.yang_constants import CARD_KINDS, RWD_NON_CRITICAL_ACTION, RWD_IS_CRITICAL_ACTION
+from app.yang.yang_hstate import YangHiddenState
+
+
+def reference_from_new_cards(pool_cards, queue_cards, pending_actions, old_score=0, each_uncovered_cards=None):
+    """逐张卡牌计数的参考实现 (数组化之前的 from_new_cards)，返回 (dict, 扩展后的 queue_cards)"""
+    if each_uncovered_cards is None:
+        each_uncovered_cards = [YangHiddenState.INIT_CARDS] * CARD_KINDS
+    queue_cards = list(queue_cards) + list(pending_actions)
+    cnt = Counter(c[0] for c in pool_cards + queue_cards)
+    pool = {k: [cnt.get(k, 0), 0, each_uncovered_cards[k]] for k in range(CARD_KINDS)}
+    reduced_num = 0
+    for c in queue_cards:
+        pool[c[0]][1] += 1
+        while pool[c[0]][1] >= 3:
+            pool[c[0]][0] -= 3
+            pool[c[0]][1] -= 3
+            pool[c[0]][2] -= 3
+            reduced_num += 3
+    action_rwd = sum(RWD_IS_CRITICAL_ACTION if action[7] else RWD_NON_CRITICAL_ACTION for action in pending_actions)
+    return {
+        "pool": pool,
+        "pool_available_choice": len(pool_cards),
+        "queue_empty_slot": 7 - len(queue_cards) + reduced_num,
+        "score": reduced_num + old_score + action_rwd,
+    }, queue_cards
+
+
+def reference_continue_from_cards(prev: dict, pool_cards, queue_cards):
+    """数组化之前的 continue_from_cards"""
+    empty_slot_num = reference_from_new_cards(pool_cards, queue_cards, [])[0]["queue_empty_slot"]
+    if prev["queue_empty_slot"] == empty_slot_num:
+        return prev
+    cleared = prev["queue_empty_slot"] < empty_slot_num
+    cnt_all = Counter(c[0] for c in pool_cards + queue_cards)
+    cnt_queue = Counter(c[0] for c in queue_cards)
+    pool = {}
+    for k in range(CARD_KINDS):
+        remaining = prev["pool"][k][0] + prev["pool"][k][2]
+        if cleared and cnt_queue.get(k, 0) < prev["pool"][k][1]:
+            remaining -= 3
+        pool[k] = [cnt_all.get(k, 0), cnt_queue.get(k, 0), remaining - cnt_all.get(k, 0)]
+    return {
+        "pool": pool,
+        "pool_available_choice": len(pool_cards),
+        "queue_empty_slot": empty_slot_num,
+        "score": prev["score"] + (1 if cleared else 0),
+    }
+
+
+def random_cards(rnd, n):
+    return [(float(rnd.randrange(CARD_KINDS)), 1, 2, 3, 4, 5, 6, rnd.random() < 0.5) for _ in range(n)]
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_matches_reference_on_random_boards(seed):
+    rnd = random.Random(seed)
+    for _ in range(1000):
+        pool_cards = random_cards(rnd, rnd.randrange(0, 40))
+        queue_cards = random_cards(rnd, rnd.randrange(0, 7))
+        pending_actions = random_cards(rnd, rnd.randrange(0, 5))
+        uncovered = [rnd.randrange(0, 16) for _ in range(CARD_KINDS)] if rnd.random() < 0.5 else None
+
+        ref, ref_queue = reference_from_new_cards(pool_cards, queue_cards, pending_actions, 2, uncovered)
+        queue = list(queue_cards)
+        with contextlib.redirect_stdout(io.StringIO()):
+            hstate = YangHiddenState.from_new_cards(pool_cards, queue, pending_actions, old_score=2,
+                                                    each_uncovered_cards=uncovered)
+        assert hstate.to_dict() == ref
+        assert queue == ref_queue  # pending actions 追加到 queue_cards 的副作用保持不变
+        assert YangHiddenState(hstate.to_dict()).to_dict() == ref
+
+        next_pool_cards = random_cards(rnd, rnd.randrange(0, 40))
+        next_queue_cards = random_cards(rnd, rnd.randrange(0, 7))
+        with contextlib.redirect_stdout(io.StringIO()):
+            next_hstate = hstate.continue_from_cards(next_pool_cards, list(next_queue_cards))
+        assert next_hstate.to_dict() == reference_continue_from_cards(ref, next_pool_cards, next_queue_cards)
+
+
+def test_accessors_and_immutability():
+    rnd = random.Random(0)
+    with contextlib.redirect_stdout(io.StringIO()):
+        hstate = YangHiddenState.from_new_cards(random_cards(rnd, 30), random_cards(rnd, 4), [])
+    d = hstate.to_dict()
+    assert hstate.get_each_uncovered_cards() == [d["pool"][k][2] for k in range(CARD_KINDS)]
+    assert hstate.get_each_in_queue_cards() == [d["pool"][k][1] for k in range(CARD_KINDS)]
+    assert hstate.get_each_remaining_cards() == [d["pool"][k][0] + d["pool"][k][2] for k in range(CARD_KINDS)]
+    assert pickle.loads(pickle.dumps(hstate)).to_dict() == d
+    with pytest.raises(ValueError):
+        hstate.pool_array[0, 0] = 1
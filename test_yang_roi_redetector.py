@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.yang.yang_roi_redetector import YangRoiRedetector
+
+
+class FakeDetector:
+    def __init__(self, supports_region):
+        self.supports_region = supports_region
+        self.calls = []
+
+    def recognize(self, image):
+        self.calls.append("full")
+        return [(0.0, 10, 10, 40, 40, 30, 30, False)], []
+
+    def recognize_region(self, image, rect):
+        self.calls.append("region")
+        return [], []
+
+
+def frames():
+    board = np.full((400, 300, 3), 200, dtype=np.uint8)
+    clicked = board.copy()
+    clicked[10:50, 10:50] = 0  # 只有一张卡牌的区域发生变化
+    return Image.fromarray(board), Image.fromarray(clicked)
+
+
+@pytest.mark.parametrize("supports_region", [True, False])
+def test_fixed_shape_detector_falls_back_to_full_frame(supports_region):
+    detector = FakeDetector(supports_region)
+    redetector = YangRoiRedetector(detector, full_refresh_frames=100)
+    board, clicked = frames()
+    redetector.recognize(board)
+    redetector.recognize(board)  # 画面不变，沿用上一帧的结果
+    redetector.recognize(clicked)
+    assert detector.calls == ["full", "region" if supports_region else "full"]
+    assert redetector.stats["reuse"] == 1
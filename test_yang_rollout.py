@@ -0,0 +1,141 @@
+import contextlib
+import copy
+import io
+import os
+import random
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from app.yang.logic.yang_rollout import VarianceReducedRollout, batch_rollout
+from app.yang.yang_hstate import YangHiddenState
+from test_rollout import PRIORITY_TABLE, priority_rule, rollout_fast, step
+
+SAMPLE_HSTATES = [
+    {'pool': {0: [0, 0, 18], 1: [1, 0, 17], 2: [3, 0, 15], 3: [3, 1, 15], 4: [1, 1, 17], 5: [4, 0, 14],
+              6: [4, 1, 14], 7: [3, 1, 15], 8: [0, 0, 18], 9: [2, 0, 16], 10: [2, 0, 16], 11: [1, 1, 17],
+              12: [1, 0, 17], 13: [2, 1, 16], 14: [2, 0, 16], 15: [0, 0, 18]},
+     'pool_available_choice': 23, 'queue_empty_slot': 1, 'score': 0},
+    {'pool': {k: [(k * 7) % 4, 0, 10] for k in range(16)}, 'pool_available_choice': 20, 'queue_empty_slot': 7,
+     'score': 0.5},
+    {'pool': {k: [(k * 7) % 4, 0, 12 - (k * 7) % 4] for k in range(16)}, 'pool_available_choice': 20,
+     'queue_empty_slot': 7, 'score': 0},
+    {'pool': {k: [(k * 5) % 3, 1 if k in (1, 4) else 0, 6] for k in range(16)}, 'pool_available_choice': 14,
+     'queue_empty_slot': 5, 'score': 2},
+    {'pool': {k: [1 + k % 3, 2 if k == 0 else 0, 9] for k in range(16)}, 'pool_available_choice': 30,
+     'queue_empty_slot': 3, 'score': 1},
+]
+
+
+def step_scores(hstate, n, seed):
+    random.seed(seed)
+    scores = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(n):
+            state = copy.deepcopy(hstate)
+            while not step(state):
+                pass
+            scores.append(state["score"])
+    return np.array(scores, dtype=np.float64)
+
+
+@pytest.mark.parametrize("hstate", SAMPLE_HSTATES)
+def test_batch_rollout_matches_step_distribution(hstate):
+    n = 2000
+    ref = step_scores(hstate, n, seed=0)
+    scores = batch_rollout(YangHiddenState(hstate), n, np.random.default_rng(0))
+    assert scores.shape == (n,)
+    se = np.sqrt(ref.var(ddof=1) / n + scores.var(ddof=1) / n)
+    z = (scores.mean() - ref.mean()) / max(se, 1e-12)
+    assert abs(z) < 3, f"step mean {ref.mean():.3f} vectorized mean {scores.mean():.3f} z={z:.2f}"
+    # 取值范围一致: 分数只会以整数增加
+    assert np.all(scores >= hstate["score"])
+    assert np.allclose((scores - hstate["score"]) % 1, 0)
+
+
+def test_batch_rollout_does_not_modify_hstate():
+    hstate = YangHiddenState(SAMPLE_HSTATES[0])
+    before = hstate.to_dict()
+    batch_rollout(hstate, 64, np.random.default_rng(1))
+    assert hstate.to_dict() == before
+
+
+def random_dict_hstate(rnd):
+    """覆盖边界情况的随机 hidden state (负数、队列中 >= 3 张、空格为负等)"""
+    return {
+        "pool": {k: [rnd.randint(-1, 5), rnd.choice([0, 0, 0, 1, 2, 3, 4, 6]), rnd.randint(0, 15)] for k in range(16)},
+        "pool_available_choice": rnd.randint(0, 30),
+        "queue_empty_slot": rnd.randint(-1, 7),
+        "score": rnd.choice([0, 0.5, -0.9]),
+    }
+
+
+def run_traced(fn, hstate, seed):
+    """在固定种子下运行，返回 (最终状态, 打印输出, 异常, 之后的下一个随机数)"""
+    random.seed(seed)
+    output = io.StringIO()
+    error = None
+    with contextlib.redirect_stdout(output):
+        try:
+            fn(hstate)
+        except ValueError as e:
+            error = str(e)
+    return hstate, output.getvalue(), error, random.random()
+
+
+def step_loop(hstate):
+    while not step(hstate):
+        pass
+
+
+def test_priority_table_matches_rule():
+    for total_num in range(-1, 8):
+        for queue_num in range(-1, 8):
+            for empty_slot_num in range(-1, 8):
+                t = min(max(total_num, 0), 3)
+                q = queue_num if 0 <= queue_num < 3 else 3
+                e = min(max(empty_slot_num, 0), 3)
+                assert PRIORITY_TABLE[t * 16 + q * 4 + e] == priority_rule(total_num, queue_num, empty_slot_num)
+
+
+def test_rollout_fast_matches_step_bit_for_bit():
+    rnd = random.Random(0)
+    for seed in range(2000):
+        hstate = random_dict_hstate(rnd)
+        ref = run_traced(step_loop, copy.deepcopy(hstate), seed)
+        assert run_traced(rollout_fast, copy.deepcopy(hstate), seed) == ref
+
+
+CRN_SCRIPT = """
+from app.yang.logic.yang_pending_actions import PendingActionList
+from app.yang.logic.yang_rollout import VarianceReducedRollout
+
+
+class State:
+    pending_action_list = PendingActionList().push((3.0, 1, 2, 3, 4, 5, 6, True)).push((5.0, 7, 8, 9, 10, 11, 12, False))
+
+    def get_root_hash(self):
+        return "d41d8cd98f00b204e9800998ecf8427e"
+
+
+class Node:
+    state = State()
+    rollout_n = 4
+
+
+print(VarianceReducedRollout(seed=1).make_rng(Node()).integers(1 << 62))
+"""
+
+
+def test_common_random_numbers_reproducible_across_processes():
+    # 不同 PYTHONHASHSEED 的进程 (例如进程池的 worker) 必须得到相同的随机数流
+    outputs = set()
+    for hash_seed in ("1", "2", "3"):
+        env = dict(os.environ, PYTHONHASHSEED=hash_seed)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)),
+                                                          env.get("PYTHONPATH")]))
+        result = subprocess.run([sys.executable, "-c", CRN_SCRIPT], env=env, capture_output=True, text=True, check=True)
+        outputs.add(result.stdout)
+    assert len(outputs) == 1
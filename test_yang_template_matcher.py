@@ -0,0 +1,55 @@
+import os
+
+import numpy as np
+import pytest
+
+from app.yang.yang_constants import CARD_KINDS
+from app.yang.yang_template_matcher import TEMPLATE_SIZE, YangTemplateMatcher, batch_ssim, box_mean
+
+structural_similarity = pytest.importorskip("skimage.metrics").structural_similarity
+
+
+def reference_scores(crops, templates):
+    return np.array([[structural_similarity(crop, tpl, data_range=255, channel_axis=2) for tpl in templates]
+                     for crop in crops])
+
+
+def test_box_mean_matches_loop():
+    rng = np.random.default_rng(0)
+    im = rng.random((2, 12, 10, 3))
+    win = 7
+    ref = np.empty((2, 12 - win + 1, 10 - win + 1, 3))
+    for i in range(ref.shape[1]):
+        for j in range(ref.shape[2]):
+            ref[:, i, j] = im[:, i:i + win, j:j + win].mean(axis=(1, 2))
+    assert np.allclose(box_mean(im, win), ref)
+
+
+def test_batch_ssim_matches_skimage():
+    rng = np.random.default_rng(0)
+    crops = rng.integers(0, 256, (6, TEMPLATE_SIZE, TEMPLATE_SIZE, 3), dtype=np.uint8)
+    templates = rng.integers(0, 256, (4, TEMPLATE_SIZE, TEMPLATE_SIZE, 3), dtype=np.uint8)
+    # 与模板相近的候选图
+    crops[:4] = np.clip(templates.astype(np.int16) + rng.integers(-20, 20, templates.shape), 0, 255)
+    scores = batch_ssim(crops, templates)
+    assert scores.shape == (6, 4)
+    assert np.abs(scores - reference_scores(crops, templates)).max() < 1e-10
+    assert np.array_equal(scores[:4].argmax(axis=1), np.arange(4))
+
+
+def test_batch_ssim_empty():
+    templates = np.zeros((3, TEMPLATE_SIZE, TEMPLATE_SIZE, 3), dtype=np.uint8)
+    assert batch_ssim(np.zeros((0, TEMPLATE_SIZE, TEMPLATE_SIZE, 3), dtype=np.uint8), templates).shape == (0, 3)
+
+
+@pytest.mark.skipif(not os.path.exists("images/cards/0.png"), reason="card templates not found")
+def test_matcher_matches_skimage_on_card_templates():
+    matcher = YangTemplateMatcher()
+    assert YangTemplateMatcher().templates is matcher.templates  # 模板只读取一次
+    rng = np.random.default_rng(0)
+    crops = [rng.integers(0, 256, (int(h), int(w), 3), dtype=np.uint8) for h, w in rng.integers(40, 80, (5, 2))]
+    crops += [matcher.templates[i] for i in range(CARD_KINDS)]
+    scores = matcher.scores(crops)
+    ref = reference_scores(matcher.resize_crops(crops), matcher.templates)
+    assert np.abs(scores - ref).max() < 1e-10
+    assert np.array_equal(matcher.match(crops)[5:], np.arange(CARD_KINDS))
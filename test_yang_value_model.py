@@ -0,0 +1,71 @@
+import contextlib
+import io
+
+import numpy as np
+
+from app.yang.logic.yang_value_model import (
+    YangValueEstimator, YangValueModel, collect_samples, hstate_features, load_search_states, save_search_states,
+)
+from app.yang.yang_constants import CARD_KINDS, RWD_IS_CRITICAL_ACTION, RWD_NON_CRITICAL_ACTION
+from app.yang.yang_hstate import YangHiddenState
+
+
+class FakeState:
+    def __init__(self, hstate, pending_action_list=()):
+        self.hstate = hstate
+        self.pending_action_list = list(pending_action_list)
+
+    def get_hstate(self):
+        return self.hstate
+
+
+class FakeNode:
+    def __init__(self, state, visits=1):
+        self.state = state
+        self.visits = visits
+
+    def is_visited(self):
+        return self.visits > 0
+
+
+def card(label, x, is_critical):
+    return (float(label), x, 0, 10, 10, x + 5, 5, is_critical)
+
+
+def zero_model():
+    """预测的剩余分数恒为 0，估值即为当前分数"""
+    model = YangValueModel()
+    n_features = hstate_features(np.zeros((1, CARD_KINDS, 3), dtype=np.int64), np.zeros(1, dtype=np.int64),
+                                 np.zeros(1, dtype=np.int64)).shape[1]
+    model.mean, model.std = np.zeros(n_features), np.ones(n_features)
+    model.params = {"w": np.zeros(n_features), "b": np.zeros(1)}
+    return model
+
+
+def test_estimate_counts_each_pending_action_reward_once():
+    pool_cards = [card(k % 4, 20 * k, False) for k in range(8)]
+    pending_actions = [card(0, 0, True), card(1, 20, False)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        hstate = YangHiddenState.from_new_cards(pool_cards[2:], [], pending_actions)
+    node = FakeNode(FakeState(hstate, pending_actions))
+    value = YangValueEstimator(zero_model(), truncate_steps=0)(node, 1)
+    assert value == RWD_IS_CRITICAL_ACTION + RWD_NON_CRITICAL_ACTION
+
+
+def test_search_states_roundtrip(tmp_path):
+    rows = [{k: [k % 3, 0, 6] for k in range(CARD_KINDS)}, {k: [k % 2, 0, 9] for k in range(CARD_KINDS)}]
+    hstates = [YangHiddenState({"pool": pool, "pool_available_choice": 10, "queue_empty_slot": 7, "score": 0})
+               for pool in rows]
+    # 相同局面只保留一次，未访问的节点不记录
+    nodes = [FakeNode(FakeState(hstates[0])), FakeNode(FakeState(hstates[1])), FakeNode(FakeState(hstates[0])),
+             FakeNode(FakeState(hstates[1]), visits=0)]
+    path = save_search_states(nodes, str(tmp_path))
+    pool, available_choice, empty_slot, score = load_search_states(str(tmp_path / "*.npz"))
+    assert path.startswith(str(tmp_path))
+    assert len(pool) == 2
+    assert np.array_equal(pool[0], hstates[0].pool_array) and np.array_equal(pool[1], hstates[1].pool_array)
+    assert list(available_choice) == [10, 10] and list(empty_slot) == [7, 7] and list(score) == [0, 0]
+
+    X, y = collect_samples((pool, available_choice, empty_slot, score), 3, np.random.default_rng(0))
+    assert len(X) == len(y) >= 6
+    assert np.all(y >= 0)  # rollout 中分数只会增加